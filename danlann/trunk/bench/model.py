@@ -0,0 +1,115 @@
+#!/usr/bin/python
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Gallery data model benchmark.
+
+Synthetic gallery is created and memory used by gallery data model is
+measured. Then previous and next photo of every photo is found like it
+is done when photo and EXIF pages are rendered.
+
+Run the benchmark from top directory of source tree, i.e.::
+
+    PYTHONPATH=src python bench/model.py -n 1000000
+"""
+
+import gc
+import time
+import optparse
+
+from danlann.bc import Gallery, Album, Photo, Exif
+
+
+def rss():
+    """
+    Get resident memory size of the process in kilobytes.
+    """
+    f = open('/proc/self/statm')
+    try:
+        pages = int(f.read().split()[1])
+    finally:
+        f.close()
+    return pages * 4
+
+
+def create(n, size, exif):
+    """
+    Create synthetic gallery.
+
+    @param n:    amount of photos
+    @param size: amount of photos in an album
+    @param exif: amount of EXIF header items of a photo
+    """
+    gallery = Gallery('title', 'description')
+    album = None
+    for i in xrange(n):
+        if i % size == 0:
+            album = Album()
+            album.dir = 'album%d' % (i // size)
+            album.title = 'Album %d' % (i // size)
+            album.gallery = gallery
+            gallery.subalbums.append(album)
+
+        photo = Photo()
+        photo.name = 'photo%d' % i
+        photo.filename = '%s/%s.jpg' % (album.dir, photo.name)
+        photo.title = 'Photo %d' % i
+        photo.album = album
+        photo.gallery = gallery
+        photo.exif = [Exif('Header %d' % j, 'value') for j in range(exif)]
+        album.photos.append(photo)
+    return gallery
+
+
+def navigate(gallery):
+    """
+    Find previous and next photo of every photo.
+    """
+    for album in gallery.subalbums:
+        for photo in album.photos:
+            album.prev(photo)
+            album.next(photo)
+
+
+
+parser = optparse.OptionParser('%prog [options]')
+parser.add_option('-n', dest = 'photos', type = 'int', default = 1000000,
+        help = 'amount of photos (default 1000000)')
+parser.add_option('-a', dest = 'size', type = 'int', default = 1000,
+        help = 'amount of photos in an album (default 1000)')
+parser.add_option('-e', dest = 'exif', type = 'int', default = 0,
+        help = 'amount of EXIF header items of a photo (default 0)')
+(options, args) = parser.parse_args()
+
+gc.collect()
+start = rss()
+t = time.time()
+gallery = create(options.photos, options.size, options.exif)
+t = time.time() - t
+gc.collect()
+
+print 'photos: %d, albums: %d' % (options.photos, len(gallery.subalbums))
+print 'model memory: %d kB, %.1f bytes per photo' \
+        % (rss() - start, (rss() - start) * 1024.0 / options.photos)
+print 'creation time: %.2fs' % t
+
+t = time.time()
+navigate(gallery)
+print 'navigation time: %.2fs' % (time.time() - t)
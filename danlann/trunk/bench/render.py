@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+XML renderer benchmark.
+
+Strings are converted by XML renderer in order they are shown on photo
+pages of synthetic gallery, i.e. album title, photo title and
+description, previous and next photo title. Strings are converted with
+and without XML renderer memo.
+
+Run the benchmark from top directory of source tree, i.e.::
+
+    PYTHONPATH=src python bench/render.py -n 100000
+"""
+
+import time
+import optparse
+
+from danlann.template import XMLRenderer
+
+TITLES = [
+    u'Ravenpoint beach at dusk',
+    u'Kate & Tom\'s wedding',
+    u'Za\u017c\xf3\u0142\u0107 g\u0119\u015bl\u0105 ja\u017a\u0144',
+    u'View from "The Saltees" ferry',
+    u'Wexford <harbour>',
+]
+
+DESCRIPTIONS = [
+    u'The beach is a long walk from the car park.\\n'
+        u'Map: http://maps.example.org/ravenpoint',
+    u'Photos taken with 50mm lens, f/1.8 & ISO 400',
+    u'',
+]
+
+
+def strings(n, size):
+    """
+    Get strings shown on photo pages.
+
+    @param n:    amount of photos
+    @param size: amount of photos in an album
+    """
+    for i in xrange(n):
+        album = i // size
+        yield u'Album %d: %s' % (album, TITLES[album % len(TITLES)])
+        for j in (i - 1, i, i + 1):
+            yield u'%s %d' % (TITLES[j % len(TITLES)], j)
+        yield DESCRIPTIONS[i % len(DESCRIPTIONS)]
+
+
+def run(convert, data):
+    """
+    Convert strings and return conversion time.
+    """
+    t = time.time()
+    for s in data:
+        convert(s, None)
+    return time.time() - t
+
+
+
+parser = optparse.OptionParser('%prog [options]')
+parser.add_option('-n', dest = 'photos', type = 'int', default = 100000,
+        help = 'amount of photos (default 100000)')
+parser.add_option('-a', dest = 'size', type = 'int', default = 100,
+        help = 'amount of photos in an album (default 100)')
+(options, args) = parser.parse_args()
+
+data = list(strings(options.photos, options.size))
+renderer = XMLRenderer()
+
+print 'strings: %d, distinct: %d' % (len(data), len(set(data)))
+for name, convert in (('no memo', lambda s, fmt: renderer.escape(s)),
+        ('memo', renderer.toString)):
+    t = run(convert, data)
+    print '%s: %.2fs, %.0f strings/s' % (name, t, len(data) / t)
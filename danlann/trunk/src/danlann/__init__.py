@@ -24,15 +24,18 @@ Danlann processor module.
 import os
 import os.path
 import itertools
-import codecs
 from ConfigParser import ConfigParser
 
 import danlann.config
+import danlann.backend
+import danlann.exif
 from danlann import parser
 from danlann.bc import Gallery
+from danlann.cache import PhotoCache, StreamCache
 from danlann.filemanager import FileManager
 from danlann.generator import DanlannGenerator
 
+import danlann.template
 from danlann.template import Template
 
 import logging
@@ -75,18 +78,22 @@ class Danlann(object):
                      copied to output directory 
     @ivar exclude:   definition of excluded additional files (regular
                      expression)
+    @ivar engine:    album files parsing engine
+    @ivar parsejobs: amount of album files parsed in parallel
                      
     @ivar fm:        file manager
     @ivar gallery:   gallery data
     @ivar generator: gallery generator
     """
     def __init__(self):
-        self.validate = False
-        self.libpath  = [danlann.config.libpath]
-        self.outdir   = None
-        self.albums   = []
-        self.files    = ['css', 'js']
-        self.exclude  = '.svn|CVS|~$|\.swp$'
+        self.validate  = False
+        self.libpath   = [danlann.config.libpath]
+        self.outdir    = None
+        self.albums    = []
+        self.files     = ['css', 'js']
+        self.exclude   = '.svn|CVS|~$|\.swp$'
+        self.engine    = 'fast'
+        self.parsejobs = 1
 
         self.fm        = None
         self.gallery   = None
@@ -117,7 +124,7 @@ class Danlann(object):
         return conf
 
 
-    def initialize(self, conf, validate = None):
+    def initialize(self, conf, validate = None, jobs = None):
         """
         Initialize and configure all required instances like
             - generator
@@ -130,6 +137,7 @@ class Danlann(object):
 
         @param conf:     configuration object
         @param validate: override validation configuration option
+        @param jobs:     override amount of parallel conversions
         """
         #
         # configure processor
@@ -168,6 +176,22 @@ class Danlann(object):
         if conf.has_option('danlann', 'exclude'):
             self.exclude = conf.get('danlann', 'exclude')
 
+        if conf.has_option('danlann', 'parser'):
+            self.engine = conf.get('danlann', 'parser')
+            if self.engine not in parser.ENGINES:
+                raise ConfigurationError('unknown album file parser %s' \
+                        % self.engine)
+
+        if conf.has_option('danlann', 'parsejobs'):
+            try:
+                self.parsejobs = conf.getint('danlann', 'parsejobs')
+            except ValueError:
+                raise ConfigurationError('number of parsing jobs has to be' \
+                        ' integer')
+            if self.parsejobs < 1:
+                raise ConfigurationError('number of parsing jobs has to be' \
+                        ' positive')
+
         #
         # create gallery data instance
         #
@@ -189,7 +213,38 @@ class Danlann(object):
         gm = True
         if conf.has_option('danlann', 'graphicsmagick'):
             gm = conf.getboolean('danlann', 'graphicsmagick')
-        self.fm = FileManager(gm)
+
+        batch = False
+        if conf.has_option('danlann', 'gmbatch'):
+            batch = conf.getboolean('danlann', 'gmbatch')
+            if batch and not gm:
+                raise ConfigurationError('GraphicsMagick batch processes' \
+                        ' require GraphicsMagick')
+
+        if conf.has_option('danlann', 'backend'):
+            backend_name = conf.get('danlann', 'backend')
+        elif batch:
+            backend_name = 'gm-batch'
+        elif gm:
+            backend_name = 'gm'
+        else:
+            backend_name = 'convert'
+
+        try:
+            backend = danlann.backend.create(backend_name)
+        except KeyError:
+            raise ConfigurationError('unknown photo conversion backend %s' \
+                    % backend_name)
+
+        reader_name = 'python'
+        if conf.has_option('danlann', 'exifreader'):
+            reader_name = conf.get('danlann', 'exifreader')
+        try:
+            exif = danlann.exif.create(reader_name)
+        except KeyError:
+            raise ConfigurationError('unknown EXIF reader %s' % reader_name)
+
+        self.fm = FileManager(backend = backend, exif = exif)
 
         #
         # create gallery generator
@@ -206,31 +261,94 @@ class Danlann(object):
 
         if conf.has_option('danlann', 'exif'):
             headers = conf.get('danlann', 'exif').split(',')
-            exif_headers = [exif.strip() for exif in headers]
+            exif_headers = [header.strip() for header in headers]
 
         self.generator              = DanlannGenerator(self.gallery, self.fm)
         self.generator.indir        = indir
         self.generator.outdir       = self.outdir
         self.generator.exif_headers = exif_headers
+        self.generator.validate     = self.validate
+
+        if conf.has_option('danlann', 'indirrecursive'):
+            self.generator.recursive = conf.getboolean('danlann',
+                    'indirrecursive')
+
+        if conf.has_option('danlann', 'decodeonce'):
+            self.generator.decodeonce = conf.getboolean('danlann', 'decodeonce')
+            if self.generator.decodeonce and not backend.decodeonce:
+                log.warn('%s decodes photo file for every converted photo,' \
+                        ' decodeonce option has no effect' % backend.title)
+
+        if conf.has_option('danlann', 'checksum'):
+            self.generator.checksum = conf.getboolean('danlann', 'checksum')
+
+        if conf.has_option('danlann', 'cache'):
+            size = 1024
+            if conf.has_option('danlann', 'cachesize'):
+                try:
+                    size = conf.getint('danlann', 'cachesize')
+                except ValueError:
+                    raise ConfigurationError('photo cache size has to be' \
+                            ' integer')
+            if size < 1:
+                raise ConfigurationError('photo cache size has to be' \
+                        ' positive')
+            self.generator.cache = PhotoCache(conf.get('danlann', 'cache'),
+                    size * 1024 * 1024)
+
+        if jobs is None and conf.has_option('danlann', 'jobs'):
+            try:
+                jobs = conf.getint('danlann', 'jobs')
+            except ValueError:
+                raise ConfigurationError('number of jobs has to be integer')
+        if jobs is not None:
+            if jobs < 1:
+                raise ConfigurationError('number of jobs has to be positive')
+            self.generator.jobs = jobs
+
+        if conf.has_option('danlann', 'renderjobs'):
+            try:
+                renderjobs = conf.getint('danlann', 'renderjobs')
+            except ValueError:
+                raise ConfigurationError('number of rendering jobs has to be' \
+                        ' integer')
+            if renderjobs < 1:
+                raise ConfigurationError('number of rendering jobs has to be' \
+                        ' positive')
+            self.generator.renderjobs = renderjobs
 
         self.setConvertArgs(conf, 'thumb')
         self.setConvertArgs(conf, 'image')
 
+        for args in self.generator.convert_args.values():
+            try:
+                backend.checkArgs(args)
+            except ValueError, ex:
+                raise ConfigurationError(str(ex))
+
         #
         # create template object
         #
         override = None
-        name = 'basic'
+        template_name = 'basic'
 
         # get template name
         if conf.has_option('template', 'name'):
-            name = conf.get('template', 'name')
+            template_name = conf.get('template', 'name')
 
         # get template override
         if conf.has_option('template', 'override'):
             override = conf.get('template', 'override')
 
-        tmpl = self.generator.tmpl = Template(name, self.gallery, override)
+        engine = 'stringtemplate'
+        if conf.has_option('template', 'engine'):
+            engine = conf.get('template', 'engine')
+            if engine not in danlann.template.ENGINES:
+                raise ConfigurationError('unknown template engine %s' \
+                        % engine)
+
+        tmpl = self.generator.tmpl = Template(template_name, self.gallery,
+                override, engine)
 
         if conf.has_option('template', 'copyright'):
             tmpl.copyright = conf.get('template', 'copyright')
@@ -244,13 +362,9 @@ class Danlann(object):
             tmpl.js.extend(js.split())
 
         #
-        # check exiv2/GraphicsMagick/ImageMagick existence
+        # check EXIF reader and conversion backend software existence
         #
-        if gm:
-            self.checkCommand('gm', 'GraphicsMagick (gm command)')
-        else:
-            self.checkCommand('convert', 'ImageMagick (convert command)')
-        self.checkCommand('exiv2', 'Exiv2 (exiv2 command)')
+        self.checkBackend()
 
 
 
@@ -271,15 +385,32 @@ class Danlann(object):
     def parse(self):
         """
         Parse gallery data.
+
+        Gallery data is cleared before parsing, so album files can be
+        parsed again when they change.
+
+        Node streams of album files are cached in output directory, so
+        only changed album files are parsed.
         """
-        interpreter = parser.interpreter(self.gallery)
+        del self.gallery.subalbums[:]
+
+        interpreter = parser.interpreter(self.gallery, self.engine)
+
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
 
         # read album files
-        for fn in self.albums:
-            log.debug('parsing album file %s' % fn)
-            f = codecs.open(fn, encoding='utf-8')
-            parser.load(f, interpreter)
-            f.close()
+        cache = StreamCache('%s/.danlann-albums' % self.outdir)
+        cache.open()
+        try:
+            log.debug('parsing album files with %d processes' \
+                    % self.parsejobs)
+            parser.loadMulti(self.albums, interpreter, self.parsejobs,
+                    cache)
+            log.debug('album files: %d cached, %d parsed' \
+                    % (cache.hits, cache.misses))
+        finally:
+            cache.close()
 
         # check gallery data instance
         parser.check(interpreter, self.gallery)
@@ -295,6 +426,10 @@ class Danlann(object):
     def postprocess(self):
         """
         Reformat and validate output files if requested.
+
+        Pages written by generator are reformatted and validated by the
+        generator, so only pages left intact are validated. If gallery is
+        not generated, then all output files are reformatted.
         """
         def html_files():
             """
@@ -306,26 +441,31 @@ class Danlann(object):
                         yield os.path.join(dir, fn)
 
 
-        for fn in html_files():
-            self.fm.formatXML(fn)
+        written = self.generator.written
+        if written is None:
+            written = []
+            for fn in html_files():
+                self.fm.formatXML(fn)
 
-            if self.validate:
+        written = set(os.path.normpath(fn) for fn in written)
+        if self.validate:
+            for fn in html_files():
+                if os.path.normpath(fn) in written:
+                    continue
                 log.info('validating file: %s' % fn)
                 if not self.fm.validate(fn):
                     log.error('validating failed: %s' % fn)
 
 
-    def checkCommand(self, cmd, name):
+    def checkBackend(self):
         """
-        Check if given command exist. If it does not exist then
-        @C{ConfigurationError} exception is raised.
-
-        @param cmd:  command to check, i.e. convert, gm
-        @param name: software identyfing the command, i.e. ImageMagick,
-                     GraphicsMagick
+        Check if photo conversion backend and EXIF reader software is
+        installed. If it is not installed then @C{ConfigurationError}
+        exception is raised.
         """
-        try:
-            self.fm.checkCommand(cmd)
-        except OSError, ex:
-            raise ConfigurationError('%s is not installed, error: %s' \
-                    % (name, ex.strerror))
+        for backend in (self.fm.backend, self.fm.exif):
+            try:
+                backend.check()
+            except OSError, ex:
+                raise ConfigurationError('%s is not installed, error: %s' \
+                        % (backend.title, ex.strerror))
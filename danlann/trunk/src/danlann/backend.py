@@ -0,0 +1,789 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Photo conversion backends.
+
+Conversion backend converts input photo into output photos using
+conversion arguments (see @C{danlann.generator.ConversionArguments}).
+Following backends are available
+    - gm:       GraphicsMagick process per conversion
+    - convert:  ImageMagick process per conversion
+    - gm-batch: long running GraphicsMagick batch processes
+    - pil:      in-process conversion with Python Imaging Library
+    - vips:     low memory conversion with libvips
+
+Use @C{create} function to create a backend by its name.
+
+@see danlann.filemanager
+"""
+
+import os
+import re
+import errno
+import subprocess
+import tempfile
+import threading
+
+import logging
+log = logging.getLogger('danlann.backend')
+
+
+def execl(args):
+    """
+    Execute command using @C{os.exec*}.
+
+    @param args: list with command and command arguments to execute
+    """
+    pid = os.fork()
+    if pid:
+        pid, status = os.waitpid(pid, 0)
+        errno = os.WEXITSTATUS(status)
+
+        # raise exception using errno from child
+        if errno:
+            raise OSError(errno, os.strerror(errno))
+    else:
+        # child of multithreaded process exits without running exit
+        # handlers and finalizers of its parent
+        try:
+            os.close(1)
+            os.close(2)
+            os.execlp(*args)
+        except OSError, ex:
+            os._exit(ex.errno) # exit with errno
+        except:
+            os._exit(4) # otherwise EINTR
+
+
+def quote(arg):
+    """
+    Quote command argument for GraphicsMagick batch process using unix
+    escaping rules.
+
+    @param arg: argument to quote
+    """
+    return '"%s"' % arg.replace('\\', '\\\\').replace('"', '\\"')
+
+
+
+class BatchProcess(object):
+    """
+    GraphicsMagick batch process.
+
+    Commands are sent to standard input of @C{gm batch} process, which
+    reports success or failure of every command on its standard output.
+    Crashed process is restarted.
+
+    @ivar cmd:     command starting batch process
+    @ivar process: batch process
+    """
+    PASS = 'danlann:pass'
+    FAIL = 'danlann:fail'
+
+    def __init__(self, cmd = None):
+        """
+        Create batch process. The process is started on first command
+        execution.
+
+        @param cmd: command starting batch process, GraphicsMagick batch
+            process by default
+        """
+        super(BatchProcess, self).__init__()
+        if cmd is None:
+            cmd = ['gm', 'batch', '-escape', 'unix', '-feedback', 'on',
+                '-stop-on-error', 'off', '-pass', self.PASS,
+                '-fail', self.FAIL]
+        self.cmd = cmd
+        self.process = None
+
+
+    def start(self):
+        """
+        Start batch process.
+        """
+        devnull = open(os.devnull, 'w')
+        try:
+            self.process = subprocess.Popen(self.cmd,
+                stdin = subprocess.PIPE,
+                stdout = subprocess.PIPE,
+                stderr = devnull,
+                close_fds = True)
+        finally:
+            devnull.close()
+        log.debug('started batch process %d' % self.process.pid)
+
+
+    def stop(self):
+        """
+        Stop batch process.
+        """
+        if self.process is None:
+            return
+
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass # process has crashed
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+
+    def send(self, line):
+        """
+        Send command line to batch process and wait for the command
+        result.
+
+        True is returned on command success, false on command failure and
+        None if batch process has crashed.
+
+        @param line: command line
+        """
+        try:
+            self.process.stdin.write(line)
+            self.process.stdin.flush()
+            while True:
+                result = self.process.stdout.readline()
+                if not result:
+                    return None
+                result = result.strip()
+                if result.endswith(self.PASS):
+                    return True
+                elif result.endswith(self.FAIL):
+                    return False
+        except IOError:
+            return None
+
+
+    def execute(self, args):
+        """
+        Execute command with batch process.
+
+        If batch process has crashed, then it is restarted and command is
+        sent again. Command failure is reported with @C{OSError} exception
+        like in case of @C{execl} function.
+
+        @param args: command and command arguments, i.e. @C{['convert',
+            'a.jpg', 'b.jpg']}
+        """
+        line = '%s\n' % ' '.join(quote(arg) for arg in args)
+        for i in range(2):
+            if self.process is None:
+                self.start()
+
+            result = self.send(line)
+            if result is not None:
+                break
+
+            log.warn('batch process %d crashed, restarting' \
+                    % self.process.pid)
+            self.stop()
+
+        if result is None:
+            raise OSError(errno.EPIPE, os.strerror(errno.EPIPE))
+        elif not result:
+            raise OSError(1, 'command failed')
+
+
+
+class Backend(object):
+    """
+    Photo conversion backend.
+
+    Backend methods can be called from many threads at the same time.
+
+    @cvar name:       backend name, part of converted photo fingerprint
+    @cvar title:      backend description used in error messages
+    @cvar decodeonce: backend decodes input file once for several output
+        files, see @C{convertMulti}
+    """
+    name = None
+    title = None
+    decodeonce = False
+
+    def check(self):
+        """
+        Check if backend can be used. @C{OSError} is raised if backend
+        software is not installed.
+        """
+        pass
+
+
+    def checkArgs(self, args):
+        """
+        Check if backend supports conversion arguments. @C{ValueError} is
+        raised for unsupported arguments.
+
+        @param args: conversion arguments
+        """
+        pass
+
+
+    def convert(self, fn_in, fn_out, args):
+        """
+        Convert file saving it to specified filename.
+
+        @C{OSError} is raised on conversion failure.
+
+        @param fn_in  : input filename
+        @param fn_out : output filename
+        @param args   : conversion arguments
+        """
+        raise NotImplementedError()
+
+
+    def convertMulti(self, fn_in, outputs):
+        """
+        Convert file into several output files decoding input file once.
+
+        Output files should be sorted by size, the largest first.
+
+        By default, every output file is converted separately.
+
+        @param fn_in   : input filename
+        @param outputs : list of output filename and conversion arguments
+            pairs
+        """
+        for fn_out, args in outputs:
+            self.convert(fn_in, fn_out, args)
+
+
+    def close(self):
+        """
+        Release backend resources.
+        """
+        pass
+
+
+
+class CommandBackend(Backend):
+    """
+    Backend executing GraphicsMagick or ImageMagick process for every
+    conversion.
+
+    @ivar graphicsmagick: use GraphicsMagick if true, ImageMagick otherwise
+    @ivar command:        name of executed command
+    @ivar convert_cmd:    basic convert arguments for ImageMagick
+        or GraphicsMagick
+    """
+    def __init__(self, graphicsmagick):
+        """
+        Create command backend.
+
+        @param graphicsmagick: if true, then use GraphicsMagick conversion
+            basic arguments
+        """
+        super(CommandBackend, self).__init__()
+        self.graphicsmagick = graphicsmagick
+        if graphicsmagick:
+            self.command = 'gm'
+            self.name = 'gm'
+            self.title = 'GraphicsMagick (gm command)'
+            self.convert_cmd = ['gm', 'gm', 'convert']
+        else:
+            self.command = 'convert'
+            self.name = 'convert'
+            self.title = 'ImageMagick (convert command)'
+            self.convert_cmd = ['convert', 'convert']
+        self.decodeonce = not graphicsmagick
+
+
+    def check(self):
+        self.execl([self.command, self.command, '-help'])
+
+
+    def execl(self, args):
+        """
+        Execute command.
+
+        @param args: list with command and command arguments to execute
+
+        @see execl
+        """
+        execl(args)
+
+
+    def execConvert(self, args):
+        """
+        Execute conversion command.
+
+        @param args: conversion arguments
+        """
+        self.execl(self.convert_cmd + args)
+
+
+    def convert(self, fn_in, fn_out, args):
+        self.execConvert([fn_in] + args + [fn_out])
+
+
+    def convertMulti(self, fn_in, outputs):
+        """
+        Convert file into several output files decoding input file once.
+
+        ImageMagick converts every output file from decoded input file.
+        GraphicsMagick does not support image stack operations and applies
+        options to every image read by convert command, therefore every
+        output file is converted separately from input file.
+        """
+        if self.graphicsmagick or len(outputs) == 1:
+            super(CommandBackend, self).convertMulti(fn_in, outputs)
+            return
+
+        cmd = [fn_in]
+        for fn_out, args in outputs[:-1]:
+            cmd += ['(', '+clone'] + args \
+                + ['-write', fn_out, '+delete', ')']
+
+        fn_out, args = outputs[-1]
+        cmd += args + [fn_out]
+
+        self.execConvert(cmd)
+
+
+
+class GMBatchBackend(CommandBackend):
+    """
+    Backend sending GraphicsMagick conversion commands to long running
+    GraphicsMagick batch processes, one process per thread.
+
+    @ivar processes: all started batch processes
+    @ivar local:     thread local data with batch process of a thread
+    @ivar lock:      lock guarding list of batch processes
+    """
+    def __init__(self):
+        super(GMBatchBackend, self).__init__(True)
+        self.name = 'gm-batch'
+        self.processes = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+
+    def execConvert(self, args):
+        """
+        Execute conversion command with GraphicsMagick batch process of
+        current thread.
+
+        @param args: conversion arguments
+        """
+        process = getattr(self.local, 'process', None)
+        if process is None:
+            process = self.local.process = BatchProcess()
+            self.lock.acquire()
+            self.processes.append(process)
+            self.lock.release()
+        process.execute(['convert'] + args)
+
+
+    def close(self):
+        """
+        Stop all GraphicsMagick batch processes.
+        """
+        for process in self.processes:
+            process.stop()
+        self.processes = []
+        self.local = threading.local()
+
+
+
+GEOMETRY = re.compile(r'^(\d+)?(?:x(\d+))?([%!<>^]?)$')
+
+def geometry(size):
+    """
+    Parse GraphicsMagick/ImageMagick geometry without offsets, i.e.
+    @C{800x600>}.
+
+    Tuple (width, height, flag) is returned, where width or height is
+    None if not specified. @C{ValueError} is raised for unsupported
+    geometry.
+
+    @param size: geometry string
+    """
+    m = GEOMETRY.match(size.strip())
+    if not m or not (m.group(1) or m.group(2)):
+        raise ValueError('unsupported photo size geometry "%s"' % size)
+
+    width, height, flag = m.groups()
+    if width is not None:
+        width = int(width)
+    if height is not None:
+        height = int(height)
+    return width, height, flag
+
+
+def resize(size, dim):
+    """
+    Calculate dimensions of resized photo using GraphicsMagick/ImageMagick
+    geometry rules.
+
+    @param size: geometry string
+    @param dim:  dimensions (width, height) of input photo
+    """
+    width, height, flag = geometry(size)
+    w, h = dim
+
+    if flag == '%':
+        sx = width or height
+        sy = height or width
+        return max(1, int(w * sx / 100.0 + 0.5)), \
+                max(1, int(h * sy / 100.0 + 0.5))
+
+    if flag == '!':
+        return width or w, height or h
+
+    if width and height:
+        sx = float(width) / w
+        sy = float(height) / h
+        if flag == '^':
+            scale = max(sx, sy)
+        else:
+            scale = min(sx, sy)
+    elif width:
+        scale = float(width) / w
+    else:
+        scale = float(height) / h
+
+    if flag == '>' and scale >= 1 or flag == '<' and scale <= 1:
+        return w, h
+
+    return max(1, int(w * scale + 0.5)), max(1, int(h * scale + 0.5))
+
+
+UNSHARP = re.compile(r'^(\d*\.?\d+)(?:x(\d*\.?\d+))?' \
+        r'(?:\+(\d*\.?\d+))?(?:\+(\d*\.?\d+))?$')
+
+def unsharp(value):
+    """
+    Parse GraphicsMagick/ImageMagick unsharp parameters, i.e.
+    @C{0.5x0.5+1.2+0}.
+
+    Tuple (radius, sigma, amount, threshold) is returned. @C{ValueError}
+    is raised for invalid parameters.
+
+    @param value: unsharp parameters
+    """
+    m = UNSHARP.match(value.strip())
+    if not m:
+        raise ValueError('unsupported unsharp parameters "%s"' % value)
+
+    radius, sigma, amount, threshold = m.groups()
+    radius = float(radius)
+    if sigma is None:
+        sigma = radius
+    else:
+        sigma = float(sigma)
+    if amount is None:
+        amount = 1.0
+    else:
+        amount = float(amount)
+    if threshold is None:
+        threshold = 0.05
+    else:
+        threshold = float(threshold)
+    return radius, sigma, amount, threshold
+
+
+
+class PILBackend(Backend):
+    """
+    In-process backend using Python Imaging Library.
+
+    JPEG photos are decoded in draft mode, so decoder scales photo down in
+    DCT domain to the smallest size not smaller than the largest output
+    photo.
+
+    Conversion arguments are mapped in following way
+        - size: GraphicsMagick geometry without offsets
+        - quality: JPEG quality
+        - unsharp: unsharp mask filter with sigma as radius, amount as
+          percentage and threshold scaled to 0-255 range
+
+    Additional conversion parameters are not supported.
+    """
+    name = 'pil'
+    title = 'Python Imaging Library'
+    decodeonce = True
+
+    def __init__(self):
+        super(PILBackend, self).__init__()
+        self.Image = None
+        self.ImageFilter = None
+        self.resample = None
+
+
+    def check(self):
+        try:
+            self.load()
+        except ImportError, ex:
+            raise OSError(errno.ENOENT, str(ex))
+
+
+    def load(self):
+        """
+        Import Python Imaging Library modules.
+        """
+        if self.Image is None:
+            try:
+                from PIL import Image, ImageFilter
+            except ImportError:
+                import Image, ImageFilter
+            self.Image = Image
+            self.ImageFilter = ImageFilter
+            self.resample = getattr(Image, 'LANCZOS', None) \
+                    or getattr(Image, 'ANTIALIAS')
+
+
+    def checkArgs(self, args):
+        geometry(args.size)
+        if args.unsharp:
+            unsharp(args.unsharp)
+        if args.params:
+            raise ValueError('additional conversion parameters are not' \
+                    ' supported by %s' % self.title)
+
+
+    def convert(self, fn_in, fn_out, args):
+        self.convertMulti(fn_in, [(fn_out, args)])
+
+
+    def convertMulti(self, fn_in, outputs):
+        """
+        Convert file into several output files decoding input file once.
+
+        Every output photo is resized from decoded input photo.
+        """
+        self.load()
+        try:
+            img = self.Image.open(fn_in)
+            info = img.info
+
+            sizes = [resize(args.size, img.size) for fn_out, args in outputs]
+
+            # decode photo at reduced scale, large enough
+            # for the largest output photo
+            img.draft('RGB', (max(w for w, h in sizes),
+                max(h for w, h in sizes)))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+
+            for (fn_out, args), size in zip(outputs, sizes):
+                self.save(img, fn_out, args, size, info)
+
+        except IOError, ex:
+            raise OSError(ex.errno or errno.EIO, ex.strerror or str(ex))
+
+
+    def save(self, img, fn_out, args, size, info):
+        """
+        Resize, sharpen and save photo.
+
+        @param img:    decoded input photo
+        @param fn_out: output filename
+        @param args:   conversion arguments
+        @param size:   output photo dimensions
+        @param info:   input photo information like Exif data
+        """
+        if img.size != size:
+            img = img.resize(size, self.resample)
+
+        if args.unsharp:
+            radius, sigma, amount, threshold = unsharp(args.unsharp)
+            img = img.filter(self.ImageFilter.UnsharpMask(sigma,
+                int(amount * 100), int(threshold * 255)))
+
+        params = {}
+        if args.quality:
+            params['quality'] = int(args.quality)
+        for key in ('exif', 'icc_profile'):
+            if info.get(key):
+                params[key] = info[key]
+
+        img.save(fn_out, 'JPEG', **params)
+
+
+
+class VipsBackend(Backend):
+    """
+    Backend using libvips with pyvips module or, if the module is not
+    installed, with vips command.
+
+    Photos are converted with libvips thumbnail operation, which uses
+    shrink-on-load and sequential access, so only small part of decoded
+    photo is kept in memory.
+
+    Conversion arguments are mapped in following way
+        - size: GraphicsMagick geometry without offsets; vips command
+          supports no flag, '>', '<' and '!' flags only
+        - quality: JPEG quality
+        - unsharp: libvips sharpen operation with sigma as sigma, amount
+          as slope for jaggy areas and threshold scaled to L* range
+          (0-100) as flat/jaggy threshold
+
+    Additional conversion parameters are not supported.
+
+    @ivar pyvips: pyvips module or None if vips command is used
+    """
+    name = 'vips'
+    title = 'libvips (pyvips module or vips command)'
+
+    # vips command thumbnail size mode for GraphicsMagick geometry flags
+    SIZE = {'': 'both', '>': 'down', '<': 'up', '!': 'force'}
+
+    # maximum image dimension supported by libvips
+    MAX_SIZE = 10000000
+
+    def __init__(self):
+        super(VipsBackend, self).__init__()
+        try:
+            import pyvips
+        except ImportError:
+            pyvips = None
+        self.pyvips = pyvips
+
+
+    def check(self):
+        if self.pyvips is None:
+            self.execl(['vips', 'vips', '--version'])
+
+
+    def execl(self, args):
+        """
+        Execute vips command.
+
+        @param args: list with command and command arguments to execute
+
+        @see execl
+        """
+        execl(args)
+
+
+    def checkArgs(self, args):
+        width, height, flag = geometry(args.size)
+        if self.pyvips is None and flag not in self.SIZE:
+            raise ValueError('photo size geometry "%s" is not supported' \
+                    ' by vips command' % args.size)
+        if args.unsharp:
+            unsharp(args.unsharp)
+        if args.params:
+            raise ValueError('additional conversion parameters are not' \
+                    ' supported by %s' % self.title)
+
+
+    def getSharpen(self, args):
+        """
+        Get libvips sharpen operation parameters for unsharp conversion
+        argument.
+
+        @param args: conversion arguments
+        """
+        radius, sigma, amount, threshold = unsharp(args.unsharp)
+        return {
+            'sigma': sigma,
+            'x1': threshold * 100,
+            'm1': 0,
+            'm2': amount,
+        }
+
+
+    def convert(self, fn_in, fn_out, args):
+        if self.pyvips is None:
+            self.convertCommand(fn_in, fn_out, args)
+        else:
+            self.convertModule(fn_in, fn_out, args)
+
+
+    def convertModule(self, fn_in, fn_out, args):
+        """
+        Convert photo with pyvips module.
+        """
+        Image = self.pyvips.Image
+        try:
+            # only photo header is read
+            img = Image.new_from_file(fn_in, access = 'sequential')
+            width, height = resize(args.size, (img.width, img.height))
+
+            img = Image.thumbnail(fn_in, width, height = height,
+                    size = 'force')
+            if args.unsharp:
+                img = img.sharpen(**self.getSharpen(args))
+
+            params = {}
+            if args.quality:
+                params['Q'] = int(args.quality)
+            img.jpegsave(fn_out, **params)
+        except self.pyvips.Error, ex:
+            raise OSError(errno.EIO, str(ex))
+
+
+    def convertCommand(self, fn_in, fn_out, args):
+        """
+        Convert photo with vips command.
+        """
+        width, height, flag = geometry(args.size)
+        if width is None:
+            width = self.MAX_SIZE
+        if height is None:
+            height = self.MAX_SIZE
+
+        fn_save = fn_out
+        if args.quality:
+            fn_save = '%s[Q=%s]' % (fn_out, args.quality)
+
+        cmd = ['vips', 'vips', 'thumbnail', fn_in, None, str(width),
+            '--height', str(height), '--size', self.SIZE[flag]]
+
+        if not args.unsharp:
+            cmd[4] = fn_save
+            self.execl(cmd)
+            return
+
+        # sharpen thumbnail saved in vips format
+        fd, fn_tmp = tempfile.mkstemp('.v', 'danlann',
+                os.path.dirname(fn_out) or '.')
+        os.close(fd)
+        try:
+            cmd[4] = fn_tmp
+            self.execl(cmd)
+
+            cmd = ['vips', 'vips', 'sharpen', fn_tmp, fn_save]
+            for key, value in sorted(self.getSharpen(args).items()):
+                cmd.extend(('--%s' % key, str(value)))
+            self.execl(cmd)
+        finally:
+            os.unlink(fn_tmp)
+
+
+
+BACKENDS = {
+    'gm':       lambda: CommandBackend(True),
+    'convert':  lambda: CommandBackend(False),
+    'gm-batch': GMBatchBackend,
+    'pil':      PILBackend,
+    'vips':     VipsBackend,
+}
+
+def create(name):
+    """
+    Create conversion backend by its name.
+
+    @C{KeyError} is raised for unknown backend name.
+
+    @param name: backend name
+    """
+    return BACKENDS[name]()
@@ -20,10 +20,40 @@
 """
 Danlann gallery data model. Module contain definitions of gallery, album
 and photo classes.
+
+Gallery may contain millions of photos, so model classes define
+@C{__slots__} to keep their instances small.
+
+Albums and photos remember their position in list of album subalbums or
+photos, so previous and next album or photo is found in constant time.
+Positions are renumbered when a list is changed.
 """
 
 import os.path
 
+
+def position(data, item):
+    """
+    Get position of an item in list of albums or photos.
+
+    Positions of all list items are renumbered if item position is out of
+    date, i.e. an item was inserted or removed from the list.
+
+    @C{ValueError} is raised if item is not in the list.
+
+    @param data: list of albums or photos
+    @param item: album or photo
+    """
+    i = item.index
+    if i is None or i >= len(data) or data[i] is not item:
+        for i, o in enumerate(data):
+            o.index = i
+        i = item.index
+        if i is None or i >= len(data) or data[i] is not item:
+            raise ValueError('item not in list')
+    return i
+
+
 class Element(object):
     """
     Basic class for all gallery business classes. This class contains title
@@ -32,6 +62,8 @@ class Element(object):
     @ivar title:       item title
     @ivar description: item description
     """
+    __slots__ = ('title', 'description')
+
     def __init__(self):
         self.title       = ''
         self.description = ''
@@ -43,10 +75,14 @@ class Item(Element):
     Basic class for albums and photos.
 
     @ivar gallery:     gallery reference
+    @ivar index:       position in list of album subalbums or photos
     """
+    __slots__ = ('gallery', 'index')
+
     def __init__(self):
         super(Item, self).__init__()
         self.gallery  = None
+        self.index    = None
 
 
 
@@ -56,11 +92,16 @@ class Photo(Item):
 
     @ivar name    : filename of photo, no extension, no directory
     @ivar filename:    path from root dir to the item
+    @ivar album:       album containing the photo
+    @ivar exif:        list of photo EXIF header items
     """
+    __slots__ = ('name', 'filename', 'album', 'exif')
+
     def __init__(self):
         super(Photo, self).__init__()
         self.name     = None
         self.filename = None
+        self.album    = None
         self.exif     = []
 
 
@@ -74,6 +115,8 @@ class Album(Item):
     @ivar thumbnail: album thumbnail
     @ivar dir:       album directory counted from gallery root
     """
+    __slots__ = ('dir', 'thumbnail', 'subalbums', 'photos')
+
     def __init__(self):
         super(Album, self).__init__()
         self.dir = None
@@ -87,7 +130,7 @@ class Album(Item):
         if isinstance(item, Album):
             data = self.subalbums
 
-        i = data.index(item)
+        i = position(data, item)
         if i > 0:
             return data[i - 1]
 
@@ -97,7 +140,7 @@ class Album(Item):
         if isinstance(item, Album):
             data = self.subalbums
 
-        i = data.index(item)
+        i = position(data, item)
         if i < len(data) - 1:
             return data[i + 1]
 
@@ -110,6 +153,8 @@ class Gallery(Element):
     @ivar description: gallery description
     @ivar subalbums:   gallery root albums
     """
+    __slots__ = ('subalbums',)
+
     def __init__(self, title, description):
         super(Gallery, self).__init__()
         self.subalbums = []
@@ -141,14 +186,14 @@ class Gallery(Element):
 
     def prev(self, album):
         data = self.subalbums
-        i = data.index(album)
+        i = position(data, album)
         if i > 0:
             return data[i - 1]
 
 
     def next(self, album):
         data = self.subalbums
-        i = data.index(album)
+        i = position(data, album)
         if i < len(data) - 1:
             return data[i + 1]
 
@@ -161,6 +206,8 @@ class Exif(object):
     @ivar name: EXIF field name
     @ivar value: EXIF field value
     """
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
         super(Exif, self).__init__()
         self.name = name
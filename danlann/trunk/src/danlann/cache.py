@@ -0,0 +1,487 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent data stores and caches used to avoid repeating work between
+Danlann runs.
+
+Stores are not thread safe, they should be accessed by one thread only.
+Photo cache can be shared by many threads and Danlann processes.
+"""
+
+import os
+import time
+import errno
+import shutil
+import tempfile
+import threading
+import anydbm
+import marshal
+from hashlib import md5, sha1
+
+import logging
+log = logging.getLogger('danlann.cache')
+
+
+def digest(fn):
+    """
+    Calculate MD5 checksum of file content.
+
+    @param fn: filename
+    """
+    f = open(fn, 'rb')
+    try:
+        m = md5()
+        data = f.read(65536)
+        while data:
+            m.update(data)
+            data = f.read(65536)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+
+def fingerprint(fn, checksum = False):
+    """
+    Get fingerprint of a file.
+
+    Fingerprint consists of file size and modification time and,
+    optionally, of file content checksum.
+
+    @param fn:       filename
+    @param checksum: include file content checksum if true
+    """
+    st = os.stat(fn)
+    fp = '%d:%r' % (st.st_size, st.st_mtime)
+    if checksum:
+        fp = '%s:%s' % (fp, digest(fn))
+    return fp
+
+
+def link(src, dst):
+    """
+    Create hard link of a file or copy the file if hard link cannot be
+    created, i.e. files are on different file systems.
+
+    @param src: source filename
+    @param dst: destination filename
+    """
+    try:
+        os.link(src, dst)
+    except OSError, ex:
+        if ex.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copyfile(src, dst)
+
+
+
+class Store(object):
+    """
+    Persistent key-value store.
+
+    Unicode keys are encoded with UTF-8. Values are serialized with
+    @C{marshal} module, so they have to consist of basic Python types.
+
+    @ivar fn: store filename
+    @ivar db: dbm database
+    """
+    def __init__(self, fn):
+        """
+        Create persistent store.
+
+        @param fn: store filename
+        """
+        super(Store, self).__init__()
+        self.fn = fn
+        self.db = None
+
+
+    def open(self):
+        """
+        Open the store creating it if it does not exist.
+
+        Store, which cannot be read, is recreated.
+        """
+        try:
+            self.db = anydbm.open(self.fn, 'c')
+        except anydbm.error, ex:
+            log.warn('recreating store %s: %s' % (self.fn, ex))
+            self.db = anydbm.open(self.fn, 'n')
+
+
+    def close(self):
+        """
+        Close the store.
+        """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+    def key(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return key
+
+
+    def get(self, key, default = None):
+        """
+        Get value of a key.
+
+        @param key:     the key
+        @param default: value returned if key is not found
+        """
+        try:
+            return marshal.loads(self.db[self.key(key)])
+        except KeyError:
+            return default
+
+
+    def set(self, key, value):
+        """
+        Set value of a key.
+
+        @param key:   the key
+        @param value: the value
+        """
+        self.db[self.key(key)] = marshal.dumps(value)
+
+
+    def delete(self, key):
+        """
+        Delete a key from the store if it exists.
+
+        @param key: the key
+        """
+        try:
+            del self.db[self.key(key)]
+        except KeyError:
+            pass
+
+
+
+class ExifCache(Store):
+    """
+    Persistent cache of photos EXIF fields.
+
+    All EXIF fields of a photo are stored under absolute photo filename
+    with photo fingerprint and name of EXIF reader, which read the
+    fields. Cached fields are valid until photo size or modification
+    time changes or another EXIF reader is used.
+
+    @ivar hits:   amount of photos found in the cache
+    @ivar misses: amount of photos not found in the cache
+    """
+    def __init__(self, fn):
+        """
+        Create EXIF fields cache.
+
+        @param fn: cache filename
+        """
+        super(ExifCache, self).__init__(fn)
+        self.hits   = 0
+        self.misses = 0
+
+
+    def fetch(self, fn, reader):
+        """
+        Get cached EXIF fields of a photo.
+
+        None is returned if photo EXIF fields are not cached or are out
+        of date.
+
+        @param fn:     absolute photo filename
+        @param reader: EXIF reader name
+        """
+        fp = fingerprint(fn)
+        value = self.get(fn)
+        if value is not None and value[0] == fp and value[1] == reader:
+            self.hits += 1
+            return value[2]
+
+        self.misses += 1
+        return None
+
+
+    def store(self, fn, reader, fields):
+        """
+        Store EXIF fields of a photo.
+
+        @param fn:     absolute photo filename
+        @param reader: EXIF reader name
+        @param fields: dictionary of EXIF fields
+        """
+        self.set(fn, (fingerprint(fn), reader, fields))
+
+
+
+class StreamCache(Store):
+    """
+    Persistent cache of album files node streams.
+
+    Node stream of an album file is stored under absolute album filename
+    with album file fingerprint and parser version. Cached node stream is
+    valid until album file size or modification time changes or another
+    parser version or parsing engine is used.
+
+    @ivar hits:   amount of album files found in the cache
+    @ivar misses: amount of album files not found in the cache
+
+    @see danlann.parser.stream
+    """
+    def __init__(self, fn):
+        """
+        Create node streams cache.
+
+        @param fn: cache filename
+        """
+        super(StreamCache, self).__init__(fn)
+        self.hits   = 0
+        self.misses = 0
+
+
+    def fetch(self, fn, version):
+        """
+        Get cached node stream of an album file.
+
+        None is returned if node stream of album file is not cached or is
+        out of date.
+
+        @param fn:      album filename
+        @param version: parser version
+        """
+        fn = os.path.abspath(fn)
+        try:
+            fp = fingerprint(fn)
+        except OSError:
+            # let the parser report missing album file
+            fp = None
+        value = self.get(fn)
+        if fp is not None and value is not None \
+                and value[0] == fp and value[1] == version:
+            self.hits += 1
+            return value[2]
+
+        self.misses += 1
+        return None
+
+
+    def store(self, fn, version, nodes):
+        """
+        Store node stream of an album file.
+
+        @param fn:      album filename
+        @param version: parser version
+        @param nodes:   node stream
+        """
+        fn = os.path.abspath(fn)
+        self.set(fn, (fingerprint(fn), version, nodes))
+
+
+
+class PhotoCache(object):
+    """
+    Content addressed cache of converted photos.
+
+    Converted photos are stored in cache directory under a key built of
+    source photo content checksum, conversion backend name and conversion
+    arguments, so the cache can be shared by many galleries.
+
+    Photos are hard linked between cache directory and gallery output
+    directory. If hard link cannot be created, then photo is copied.
+
+    Access time of a cached photo is updated on cache hit, modification
+    time is kept as the photo is shared with gallery output directory.
+    Least recently used photos are removed when cache size exceeds its
+    limit.
+
+    Cache methods, except @C{open} and @C{close}, can be called from many
+    threads at the same time.
+
+    @ivar dir:    cache directory
+    @ivar size:   cache size limit in bytes, no limit if None
+    @ivar hits:   amount of photos found in the cache
+    @ivar misses: amount of photos not found in the cache
+    @ivar saved:  amount of bytes of photos found in the cache
+    @ivar lock:   lock guarding cache statistics
+    """
+    def __init__(self, dir, size = None):
+        """
+        Create converted photos cache.
+
+        @param dir:  cache directory
+        @param size: cache size limit in bytes
+        """
+        super(PhotoCache, self).__init__()
+        self.dir    = dir
+        self.size   = size
+        self.hits   = 0
+        self.misses = 0
+        self.saved  = 0
+        self.lock   = threading.Lock()
+
+
+    def open(self):
+        """
+        Open the cache creating cache directory if it does not exist.
+
+        Cache statistics are reset, so they are gathered for one gallery
+        generation.
+        """
+        self.hits   = 0
+        self.misses = 0
+        self.saved  = 0
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+
+
+    def close(self):
+        """
+        Close the cache removing least recently used photos if cache size
+        exceeds its limit.
+        """
+        if self.size is not None:
+            self.evict(self.size)
+
+
+    def key(self, checksum, name, args):
+        """
+        Get cache key of converted photo.
+
+        @param checksum: source photo content checksum
+        @param name:     conversion backend name
+        @param args:     conversion arguments
+        """
+        data = [checksum, name] + list(args)
+        return sha1('\0'.join(data)).hexdigest()
+
+
+    def path(self, key):
+        """
+        Get filename of cached photo.
+
+        @param key: cache key
+        """
+        return os.path.join(self.dir, key[:2], '%s.jpg' % key)
+
+
+    def fetch(self, key, fn):
+        """
+        Fetch photo from the cache.
+
+        True is returned if photo is found in the cache.
+
+        @param key: cache key
+        @param fn:  filename of fetched photo
+        """
+        path = self.path(key)
+        try:
+            link(path, fn)
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except (OSError, IOError):
+            self.lock.acquire()
+            self.misses += 1
+            self.lock.release()
+            return False
+
+        size = os.path.getsize(fn)
+        self.lock.acquire()
+        self.hits += 1
+        self.saved += size
+        self.lock.release()
+        return True
+
+
+    def store(self, key, fn):
+        """
+        Store photo in the cache.
+
+        Failure to store a photo is not fatal, it is logged only.
+
+        @param key: cache key
+        @param fn:  filename of stored photo
+        """
+        path = self.path(key)
+        try:
+            dir = os.path.dirname(path)
+            if not os.path.exists(dir):
+                try:
+                    os.mkdir(dir)
+                except OSError, ex:
+                    # directory created by another thread or process
+                    if ex.errno != errno.EEXIST:
+                        raise
+            if not os.path.exists(path):
+                # the photo is copied into temporary file first, so
+                # other Danlann processes never see partially copied
+                # photo
+                fd, tmp = tempfile.mkstemp(dir = dir)
+                os.close(fd)
+                try:
+                    shutil.copyfile(fn, tmp)
+                    os.rename(tmp, path)
+                except:
+                    os.remove(tmp)
+                    raise
+        except (OSError, IOError), ex:
+            log.warn('cannot store %s in photo cache: %s' % (fn, ex))
+
+
+    def evict(self, size):
+        """
+        Remove least recently used photos from the cache until cache size
+        does not exceed given size.
+
+        @param size: cache size in bytes
+        """
+        photos = []
+        total = 0
+        for dir, subdirs, files in os.walk(self.dir):
+            for fn in files:
+                # skip temporary files of photos being stored
+                if not fn.endswith('.jpg'):
+                    continue
+                fn = os.path.join(dir, fn)
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    # removed by another Danlann process
+                    continue
+                photos.append((st.st_atime, st.st_size, fn))
+                total += st.st_size
+
+        photos.sort()
+        for atime, fsize, fn in photos:
+            if total <= size:
+                break
+            log.debug('removing %s from photo cache' % fn)
+            try:
+                os.remove(fn)
+            except OSError:
+                # removed by another Danlann process
+                pass
+            total -= fsize
+
+
+    def report(self):
+        """
+        Get cache statistics report.
+        """
+        return 'photo cache: %d hits, %d misses, %d bytes saved' \
+                % (self.hits, self.misses, self.saved)
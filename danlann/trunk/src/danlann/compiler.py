@@ -0,0 +1,1114 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+StringTemplate compiler.
+
+Templates are translated into Python functions, which write pages
+without StringTemplate interpreting the templates for every page.
+
+Subset of StringTemplate syntax used by Danlann templates is supported
+
+    - attribute references and properties, i.e. C{$album.title$}
+    - conditionals with C{$if$}, C{$elseif$}, C{$else$} and C{$endif$}
+    - template includes, i.e. C{$basic/copyright()$} or C{$(tmpl)()$}
+    - template application, i.e. C{$album.photos:basic/pindex()$} or
+      C{$css:{c | ...}$}
+    - comments and escaped characters
+
+Pages are written exactly as StringTemplate writes them, including its
+indentation and newline rules. A page using any other syntax is rendered
+with StringTemplate.
+
+Page can be streamed into a file, so page text is never kept in memory
+as a whole.
+"""
+
+import os
+
+import logging
+log = logging.getLogger('danlann.compiler')
+
+
+class UnsupportedError(Exception):
+    """
+    Raised when template uses syntax or data not supported by the
+    compiler.
+    """
+
+
+
+# amount of text parts buffered by writer before they are written into
+# output stream
+FLUSH_PARTS = 1024
+
+# template tokens
+LITERAL, NEWLINE, ACTION, IF, ELSEIF, ELSE, ENDIF = range(7)
+
+# words, which cannot be used as attribute or template names
+RESERVED = ('if', 'elseif', 'else', 'endif', 'first', 'rest', 'last',
+        'length', 'strip', 'trunc', 'super')
+
+ESCAPES = {'n': u'\n', 'r': u'\r', 't': u'\t', ' ': u' '}
+
+
+def newline(pattern, i):
+    """
+    Get newline string at position of template.
+
+    Empty string is returned if there is no newline at the position.
+    """
+    if pattern.startswith('\r\n', i):
+        return pattern[i:i + 2]
+    elif pattern[i:i + 1] in ('\r', '\n'):
+        return pattern[i]
+    return ''
+
+
+def skipBraces(pattern, i):
+    """
+    Find end of anonymous template, which starts at position of template.
+
+    Position after closing brace is returned.
+    """
+    depth = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise UnsupportedError('unterminated anonymous template')
+
+
+def skipParens(pattern, i):
+    """
+    Find end of condition of C{$if$} action, which starts with parenthesis
+    at position of template.
+
+    Position of closing parenthesis is returned.
+    """
+    depth = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif c == '{':
+            i = skipBraces(pattern, i) - 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise UnsupportedError('unterminated condition')
+
+
+def lex(pattern):
+    """
+    Split template into tokens.
+
+    List of tuples C{(type, text, indent)} is returned, where indent is
+    indentation of an action. Comments and indentation of actions are
+    removed, whitespace after conditional actions is removed with
+    StringTemplate rules.
+
+    @param pattern: template text
+    """
+    tokens = []
+    indent = None   # indentation of actions in current line
+    bol = True      # at beginning of line
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c in '\r\n':
+            nl = newline(pattern, i)
+            tokens.append((NEWLINE, nl, None))
+            i += len(nl)
+            indent = None
+            bol = True
+
+        elif c != '$':
+            text = []
+            start = i
+            while i < n:
+                c = pattern[i]
+                if c == '\\' and i + 1 < n:
+                    if pattern[i + 1] in '$\\':
+                        text.append(pattern[i + 1])
+                    elif pattern[i + 1] in '\r\n':
+                        raise UnsupportedError('escaped newline')
+                    else:
+                        text.append(pattern[i:i + 2])
+                    i += 2
+                elif c in ' \t':
+                    j = i
+                    while j < n and pattern[j] in ' \t':
+                        j += 1
+                    if bol and i == start and pattern[j:j + 1] == '$':
+                        # indentation of an action
+                        indent = pattern[i:j]
+                    else:
+                        text.append(pattern[i:j])
+                        indent = None
+                    i = j
+                elif c in '$\r\n':
+                    break
+                else:
+                    text.append(c)
+                    i += 1
+            if text:
+                tokens.append((LITERAL, u''.join(text), indent))
+            bol = False
+
+        else:
+            i = action(pattern, i, bol, indent, tokens)
+            bol = i == 0 or pattern[i - 1] in '\r\n'
+
+    return tokens
+
+
+def action(pattern, i, bol, indent, tokens):
+    """
+    Read action starting at position of template and append its token to
+    list of tokens.
+
+    Position after the action is returned.
+
+    @param pattern: template text
+    @param i:       position of action
+    @param bol:     action starts at beginning of line
+    @param indent:  indentation of action
+    @param tokens:  list of tokens
+    """
+    def eatNewline(j, eat = True):
+        if eat:
+            j += len(newline(pattern, j))
+        return j
+
+    rest = pattern[i + 1:i + 8]
+    if rest.startswith('\\'):
+        # escaped characters, i.e. $\n$
+        text = []
+        j = i + 1
+        while pattern[j:j + 1] == '\\':
+            c = pattern[j + 1:j + 2]
+            if c in ESCAPES:
+                text.append(ESCAPES[c])
+                j += 2
+            elif c == 'u':
+                try:
+                    text.append(unichr(int(pattern[j + 2:j + 6], 16)))
+                except ValueError:
+                    raise UnsupportedError('invalid unicode escape')
+                j += 6
+            else:
+                raise UnsupportedError('unknown escape \\%s' % c)
+        if pattern[j:j + 1] != '$':
+            raise UnsupportedError('unterminated escape action')
+        tokens.append((LITERAL, u''.join(text), indent))
+        return j + 1
+
+    elif rest.startswith('!'):
+        j = pattern.find('!$', i + 2)
+        if j < 0:
+            raise UnsupportedError('unterminated comment')
+        return eatNewline(j + 2, bol)
+
+    elif rest.startswith('if') and rest[2:3] in (' ', '('):
+        token, keyword = IF, 'if'
+    elif rest.startswith('elseif'):
+        token, keyword = ELSEIF, 'elseif'
+    elif rest.startswith('endif$'):
+        tokens.append((ENDIF, u'', indent))
+        return eatNewline(i + 7, bol)
+    elif rest.startswith('else$'):
+        tokens.append((ELSE, u'', indent))
+        return eatNewline(i + 6)
+    elif rest.startswith('@'):
+        raise UnsupportedError('regions are not supported')
+
+    else:
+        j = i + 1
+        while j < len(pattern) and pattern[j] != '$':
+            c = pattern[j]
+            if c == '\\':
+                j += 2
+            elif c == '{':
+                j = skipBraces(pattern, j)
+            elif c == '"':
+                raise UnsupportedError('string literals are not supported')
+            else:
+                j += 1
+        if j == i + 1 or j >= len(pattern):
+            raise UnsupportedError('invalid action at %d' % i)
+        tokens.append((ACTION, pattern[i + 1:j], indent))
+        return j + 1
+
+    # conditional action
+    j = i + 1 + len(keyword)
+    while pattern[j:j + 1] == ' ':
+        j += 1
+    if pattern[j:j + 1] != '(':
+        raise UnsupportedError('invalid %s action' % keyword)
+    k = skipParens(pattern, j)
+    if pattern[k + 1:k + 2] != '$':
+        raise UnsupportedError('invalid %s action' % keyword)
+    tokens.append((token, pattern[j + 1:k], indent))
+    return eatNewline(k + 2)
+
+
+def parse(tokens):
+    """
+    Parse template tokens into list of template chunks.
+
+    A chunk is one of
+        - C{('text', text)}
+        - C{('newline', text)}
+        - C{('expr', expr, indent)}
+        - C{('if', [(cond, chunks), ...], chunks)}, where else chunks can
+          be None
+
+    @param tokens: template tokens
+    """
+    def template(i):
+        chunks = []
+        while i < len(tokens):
+            token, text, indent = tokens[i]
+            if token == LITERAL:
+                chunks.append(('text', text))
+            elif token == NEWLINE:
+                # newline before else or endif belongs to conditional
+                if i + 1 >= len(tokens) \
+                        or tokens[i + 1][0] not in (ELSE, ENDIF):
+                    chunks.append(('newline', text))
+            elif token == ACTION:
+                chunks.append(('expr', parseAction(text), indent))
+            elif token == IF:
+                branches = []
+                while token in (IF, ELSEIF):
+                    body, i = template(i + 1)
+                    branches.append((parseCondition(text), body))
+                    token, text, indent = tokens[min(i, len(tokens) - 1)]
+                default = None
+                if token == ELSE:
+                    default, i = template(i + 1)
+                if i >= len(tokens) or tokens[i][0] != ENDIF:
+                    raise UnsupportedError('missing endif')
+                chunks.append(('if', branches, default))
+            else:
+                break
+            i += 1
+        return chunks, i
+
+    chunks, i = template(0)
+    if i < len(tokens):
+        raise UnsupportedError('unexpected else or endif')
+    return chunks
+
+
+class ActionParser(object):
+    """
+    Parser of StringTemplate action expressions.
+
+    Expressions are parsed into tuples
+
+        - C{('attr', name, properties)}
+        - C{('include', name)}
+        - C{('indirect', expr)}
+        - C{('apply', expr, templates)}, where template is include,
+          indirect include or C{('anon', args, chunks)}
+
+    @ivar text: action text
+    @ivar pos:  position of parser in action text
+    """
+    def __init__(self, text):
+        super(ActionParser, self).__init__()
+        self.text = text
+        self.pos = 0
+
+
+    def peek(self):
+        """
+        Skip whitespace and get next character of action text.
+        """
+        while self.pos < len(self.text) and self.text[self.pos] in ' \t\r\n':
+            self.pos += 1
+        return self.text[self.pos:self.pos + 1]
+
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise UnsupportedError('expected %s in action %s' \
+                    % (c, self.text))
+        self.pos += 1
+
+
+    def id(self):
+        """
+        Parse attribute or template name.
+        """
+        self.peek()
+        start = i = self.pos
+        text = self.text
+        if i < len(text) and (text[i].isalpha() or text[i] == '_'):
+            i += 1
+            while i < len(text) and (text[i].isalnum() or text[i] in '_/'):
+                i += 1
+        name = str(text[start:i])
+        if not name or name in RESERVED:
+            raise UnsupportedError('unsupported action %s' % text)
+        self.pos = i
+        return name
+
+
+    def end(self):
+        if self.peek():
+            raise UnsupportedError('unsupported action %s' % self.text)
+
+
+    def attribute(self):
+        """
+        Parse attribute reference with its properties.
+        """
+        name = self.id()
+        props = []
+        while self.peek() == '.':
+            self.pos += 1
+            props.append(self.id())
+        return ('attr', name, tuple(props))
+
+
+    def primary(self):
+        """
+        Parse attribute reference or template include.
+        """
+        c = self.peek()
+        if c == '(':
+            self.pos += 1
+            expr = self.attribute()
+            self.expect(')')
+            self.expect('(')
+            self.expect(')')
+            return ('indirect', expr)
+
+        pos = self.pos
+        name = self.id()
+        if self.peek() == '(':
+            self.pos += 1
+            self.expect(')')
+            return ('include', name)
+
+        self.pos = pos
+        return self.attribute()
+
+
+    def template(self):
+        """
+        Parse template applied to an attribute.
+        """
+        if self.peek() == '{':
+            return self.anonymous()
+        expr = self.primary()
+        if expr[0] == 'attr':
+            raise UnsupportedError('unsupported action %s' % self.text)
+        return expr
+
+
+    def anonymous(self):
+        """
+        Parse anonymous template with its formal arguments.
+        """
+        text = self.text
+        end = skipBraces(text, self.pos) - 1
+        start = self.pos + 1
+
+        # formal arguments, one whitespace character is allowed around
+        # argument names
+        def ws(i):
+            if newline(text, i):
+                return i + len(newline(text, i))
+            elif text[i:i + 1] in (' ', '\t'):
+                return i + 1
+            return i
+
+        args = []
+        i = start
+        while True:
+            i = ws(i)
+            j = i
+            if j < end and (text[j].isalpha() or text[j] == '_'):
+                while j < end and (text[j].isalnum() or text[j] in '_/'):
+                    j += 1
+            if j == i:
+                args = []
+                break
+            args.append(str(text[i:j]))
+            i = ws(j)
+            if text[i:i + 1] == '|':
+                start = ws(i + 1)
+                break
+            elif text[i:i + 1] != ',':
+                args = []
+                break
+            i += 1
+
+        if len(args) > 1:
+            raise UnsupportedError('too many arguments of anonymous template')
+
+        body = []
+        i = start
+        while i < end:
+            if text[i] == '\\' and text[i + 1:i + 2] in '{}':
+                body.append(text[i + 1])
+                i += 2
+            elif text[i] == '\\':
+                body.append(text[i:i + 2])
+                i += 2
+            elif text[i] == '{':
+                j = skipBraces(text, i)
+                body.append(text[i:j])
+                i = j
+            else:
+                body.append(text[i])
+                i += 1
+
+        self.pos = end + 1
+        return ('anon', tuple(args), parse(lex(u''.join(body))))
+
+
+    def action(self):
+        """
+        Parse action expression.
+        """
+        expr = self.primary()
+        if self.peek() == ':':
+            if expr[0] != 'attr':
+                raise UnsupportedError('unsupported action %s' % self.text)
+            self.pos += 1
+            templates = [self.template()]
+            while self.peek() == ',':
+                self.pos += 1
+                templates.append(self.template())
+            expr = ('apply', expr, templates)
+        self.end()
+        return expr
+
+
+    def condition(self):
+        """
+        Parse condition of conditional action.
+
+        Tuple C{(negate, attr)} is returned.
+        """
+        negate = self.peek() == '!'
+        if negate:
+            self.pos += 1
+        expr = self.attribute()
+        self.end()
+        return negate, expr
+
+
+
+def parseAction(text):
+    """
+    Parse action expression.
+    """
+    return ActionParser(text).action()
+
+
+def parseCondition(text):
+    """
+    Parse condition of conditional action.
+    """
+    return ActionParser(text).condition()
+
+
+
+class Generator(object):
+    """
+    Generator of Python source code of template functions.
+
+    Every template, conditional branch and anonymous template is
+    translated into function taking writer and attribute scope. The
+    function writes template and returns amount of written characters.
+
+    @ivar lines: lines of generated code
+    @ivar count: amount of generated functions
+    """
+    def __init__(self):
+        super(Generator, self).__init__()
+        self.lines = []
+        self.count = 0
+
+
+    def source(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+    def function(self, chunks):
+        """
+        Generate function for list of template chunks.
+
+        Name of the function is returned.
+        """
+        code = []
+        self.chunks(code, 1, chunks)
+
+        name = 'f%d' % self.count
+        self.count += 1
+        self.lines.append('def %s(w, s):' % name)
+        self.lines.append('    n = 0')
+        self.lines.extend(code)
+        self.lines.append('    return n')
+        self.lines.append('')
+        return name
+
+
+    def chunks(self, code, level, chunks):
+        """
+        Generate code writing template chunks.
+
+        Empty line is not written if it contains expression only and the
+        expression writes nothing.
+        """
+        ind = '    ' * level
+        skip = False
+        for i, chunk in enumerate(chunks):
+            kind = chunk[0]
+            if kind == 'text':
+                code.append('%sn += w.write(%r)' % (ind, chunk[1]))
+            elif kind == 'newline' and skip:
+                code.append('%sif c:' % ind)
+                code.append('%s    n += w.write(%r)' % (ind, chunk[1]))
+            elif kind == 'newline':
+                code.append('%sn += w.write(%r)' % (ind, chunk[1]))
+
+            skip = False
+            if kind in ('expr', 'if'):
+                if kind == 'expr':
+                    self.expr(code, level, chunk[1], chunk[2])
+                else:
+                    self.conditional(code, level, chunk[1], chunk[2])
+                code.append('%sn += c' % ind)
+
+                skip = i + 1 < len(chunks) \
+                    and chunks[i + 1][0] == 'newline' \
+                    and (i == 0 or chunks[i - 1][0] == 'newline')
+
+
+    def value(self, expr):
+        """
+        Generate Python expression getting attribute value.
+        """
+        kind, name, props = expr
+        code = 'lookup(s, %r)' % name
+        for p in props:
+            code = 'prop(%s, %r)' % (code, p)
+        return code
+
+
+    def template(self, code, level, expr):
+        """
+        Generate Python expression getting applied template with its
+        formal arguments.
+        """
+        ind = '    ' * level
+        if expr[0] == 'anon':
+            return '(%s, %r)' % (self.function(expr[2]), expr[1] or None)
+        elif expr[0] == 'include':
+            return '(template(%r), None)' % expr[1]
+        else:
+            code.append('%sv = %s' % (ind, self.value(expr[1])))
+            code.append('%sif not v:' % ind)
+            code.append('%s    raise UnsupportedError(\'no template name\')' \
+                    % ind)
+            code.append('%sa%d = template(str(v))' % (ind, len(code)))
+            return '(a%d, None)' % (len(code) - 1)
+
+
+    def expr(self, code, level, expr, indent):
+        """
+        Generate code writing action expression.
+        """
+        ind = '    ' * level
+        if indent:
+            code.append('%sw.push(%r)' % (ind, indent))
+
+        kind = expr[0]
+        if kind == 'attr':
+            code.append('%sc = w.value(%s)' % (ind, self.value(expr)))
+        elif kind == 'include':
+            code.append('%sc = template(%r)(w, s)' % (ind, expr[1]))
+        elif kind == 'indirect':
+            code.append('%sv = %s' % (ind, self.value(expr[1])))
+            code.append('%sc = 0' % ind)
+            code.append('%sif v:' % ind)
+            code.append('%s    c = template(str(v))(w, s)' % ind)
+        else:
+            templates = [self.template(code, level, t) for t in expr[2]]
+            code.append('%sc = apply(w, s, %s, (%s,))' % (ind,
+                self.value(expr[1]), ', '.join(templates)))
+
+        if indent:
+            code.append('%sw.pop()' % ind)
+
+
+    def conditional(self, code, level, branches, default):
+        """
+        Generate code writing conditional action.
+
+        A condition referencing undefined attribute is false.
+        """
+        ind = '    ' * level
+        (negate, expr), chunks = branches[0]
+        if negate:
+            test = 'not %s' % self.value(expr)
+        else:
+            test = 'bool(%s)' % self.value(expr)
+        code.append('%stry:' % ind)
+        code.append('%s    t = %s' % (ind, test))
+        code.append('%sexcept KeyError:' % ind)
+        code.append('%s    t = False' % ind)
+        code.append('%sif t:' % ind)
+        code.append('%s    c = %s(w, s)' % (ind, self.function(chunks)))
+        code.append('%selse:' % ind)
+        if len(branches) > 1:
+            self.conditional(code, level + 1, branches[1:], default)
+        elif default is not None:
+            code.append('%s    c = %s(w, s)' % (ind, self.function(default)))
+        else:
+            code.append('%s    c = 0' % ind)
+
+
+
+def translate(pattern):
+    """
+    Translate template into Python source code.
+
+    Source code defines template functions, the last one is function of
+    the template.
+
+    @param pattern: template text
+    """
+    g = Generator()
+    g.function(parse(lex(pattern)))
+    return g.source(), 'f%d' % (g.count - 1)
+
+
+
+class Writer(object):
+    """
+    Writer of template output.
+
+    The writer indents lines written by expressions, which are indented
+    in a template, like StringTemplate auto indent writer.
+
+    If output stream is set, then written text is encoded with UTF-8 and
+    written into the stream in chunks of C{FLUSH_PARTS} text parts.
+
+    @ivar parts:   written text
+    @ivar indents: stack of indentation strings
+    @ivar indent:  current indentation
+    @ivar bol:      true if at beginning of line
+    @ivar renderer: renderer converting strings into output text
+    @ivar out:      binary output stream, None if text is kept in memory
+    """
+    def __init__(self, renderer, out = None):
+        super(Writer, self).__init__()
+        self.parts = []
+        self.indents = []
+        self.indent = ''
+        self.bol = True
+        self.renderer = renderer
+        self.out = out
+
+
+    def push(self, indent):
+        self.indents.append(self.indent)
+        self.indent += indent
+
+
+    def pop(self):
+        self.indent = self.indents.pop()
+
+
+    def write(self, text):
+        """
+        Write text and return amount of written characters including
+        indentation.
+        """
+        if not text:
+            return 0
+
+        parts = self.parts
+        if len(parts) > FLUSH_PARTS and self.out is not None:
+            self.flush()
+
+        indent = self.indent
+        if not indent:
+            parts.append(text)
+            self.bol = text[-1] == '\n'
+            return len(text)
+
+        n = len(text)
+        bol = self.bol
+        lines = text.split('\n')
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            if line:
+                if bol:
+                    parts.append(indent)
+                    n += len(indent)
+                parts.append(line)
+                bol = False
+            if i < last:
+                parts.append('\n')
+                bol = True
+        self.bol = bol
+        return n
+
+
+    def value(self, o):
+        """
+        Write attribute value.
+
+        Strings are converted with writer renderer, items of
+        collections are written one by one.
+        """
+        if o is None:
+            return 0
+
+        cls = o.__class__
+        if cls is str or cls is unicode:
+            return self.write(self.renderer.toString(o, None))
+        elif isinstance(o, basestring):
+            return self.write(unicode(o))
+        elif isinstance(o, dict):
+            items = o.values()
+        else:
+            try:
+                items = iter(o)
+            except TypeError:
+                return self.write(unicode(o))
+
+        n = 0
+        for item in items:
+            if item is not None:
+                n += self.value(item)
+        return n
+
+
+    def flush(self):
+        """
+        Write buffered text into output stream.
+        """
+        if self.parts:
+            self.out.write(u''.join(self.parts).encode('utf-8'))
+            del self.parts[:]
+
+
+    def getvalue(self):
+        return u''.join(self.parts)
+
+
+
+def lookup(scope, name):
+    """
+    Get value of attribute from attribute scope.
+
+    Scope is a tuple C{(attributes, enclosing scope, formal arguments)}.
+    Like StringTemplate, C{KeyError} is raised when an anonymous template
+    with formal arguments references an enclosing attribute without
+    value.
+    """
+    s = scope
+    while s is not None:
+        attrs = s[0]
+        if name in attrs:
+            value = attrs[name]
+            break
+        s = s[1]
+    else:
+        value = None
+
+    if not value and s is not scope:
+        s = scope
+        while s is not None and s[2] is None:
+            s = s[1]
+        if s is not None:
+            while s is not None:
+                if s[2] is not None and name in s[2]:
+                    return value
+                s = s[1]
+            raise KeyError('no such attribute: %s' % name)
+    return value
+
+
+def prop(o, name):
+    """
+    Get property of an object like StringTemplate does.
+    """
+    if not o:
+        return None
+
+    if isinstance(o, dict):
+        if name == 'keys':
+            return o.keys()
+        elif name == 'values':
+            return o.values()
+        value = o.get(name)
+        if value is None:
+            value = o.get('_default_')
+        return value
+
+    suffix = name[0].upper() + name[1:]
+    if hasattr(o, 'get' + suffix):
+        m = getattr(o, 'get' + suffix)
+    else:
+        try:
+            m = getattr(o, 'is' + suffix)
+        except AttributeError:
+            try:
+                return getattr(o, name)
+            except AttributeError:
+                raise UnsupportedError('no property %s of %s' \
+                        % (name, o.__class__.__name__))
+
+    if m is not None:
+        try:
+            return m()
+        except Exception, ex:
+            raise UnsupportedError('cannot get property %s: %s' % (name, ex))
+    return None
+
+
+def apply(w, scope, value, templates):
+    """
+    Apply templates to attribute value, which is a collection or single
+    object.
+
+    @param w:         writer
+    @param scope:     attribute scope of applying template
+    @param value:     attribute value
+    @param templates: list of templates and their formal arguments
+    """
+    if not value:
+        return 0
+    if isinstance(value, dict):
+        raise UnsupportedError('applying template to map')
+
+    if isinstance(value, basestring):
+        items = None
+    else:
+        try:
+            items = iter(value)
+        except TypeError:
+            items = None
+
+    if items is None:
+        f, args = templates[0]
+        attrs = {'i': 1, 'i0': 0}
+        if args:
+            attrs[args[0]] = value
+        else:
+            attrs['it'] = attrs['attr'] = value
+        return f(w, (attrs, scope, args))
+
+    n = 0
+    k = len(templates)
+    for i, item in enumerate(items):
+        if item is None:
+            continue
+        f, args = templates[i % k]
+        attrs = {'ik': None, 'i': i + 1, 'i0': i}
+        if args:
+            attrs[args[0]] = item
+        else:
+            attrs['it'] = attrs['attr'] = item
+        n += f(w, (attrs, scope, args))
+    return n
+
+
+
+class Page(object):
+    """
+    Page template instance with its attributes.
+
+    @ivar group:      template group
+    @ivar name:       template name
+    @ivar attributes: page attributes
+    """
+    def __init__(self, group, name):
+        super(Page, self).__init__()
+        self.group = group
+        self.name = name
+        self.attributes = {}
+
+
+    def __setitem__(self, name, value):
+        if value is not None:
+            self.attributes[name] = value
+
+
+    def __getitem__(self, name):
+        return self.attributes.get(name)
+
+
+    def __unicode__(self):
+        try:
+            w = Writer(self.group.renderer)
+            self.group.template(self.name)(w, (self.attributes, None, None))
+            return w.getvalue()
+        except UnsupportedError, ex:
+            log.debug('rendering %s with StringTemplate: %s' % (self.name, ex))
+        return self.fallback()
+
+
+    def write(self, f):
+        """
+        Stream page into binary file encoded with UTF-8.
+
+        If page cannot be rendered with compiled templates, then the file
+        is truncated to its position before rendering and page rendered
+        with StringTemplate is written.
+
+        @param f: seekable binary file
+        """
+        pos = f.tell()
+        try:
+            w = Writer(self.group.renderer, f)
+            self.group.template(self.name)(w, (self.attributes, None, None))
+            w.flush()
+            return
+        except UnsupportedError, ex:
+            log.debug('rendering %s with StringTemplate: %s' % (self.name, ex))
+
+        f.seek(pos)
+        f.truncate()
+        f.write(self.fallback().encode('utf-8'))
+
+
+    def fallback(self):
+        """
+        Render page with StringTemplate.
+        """
+        page = self.group.fallback.getInstanceOf(self.name)
+        for name, value in self.attributes.items():
+            page[name] = value
+        return unicode(page)
+
+
+    __str__ = __unicode__
+
+
+
+class TemplateGroup(object):
+    """
+    Group of compiled templates.
+
+    All templates are compiled when group is created. Templates, which
+    cannot be compiled, and pages, which use them, are rendered with
+    fallback StringTemplate group.
+
+    @ivar templates: template functions by template name, None if a
+                     template is not supported
+    @ivar renderer:  renderer converting strings into output text
+    @ivar fallback:  StringTemplate group
+    """
+    def __init__(self, dirs, renderer, fallback):
+        """
+        Compile templates from template directories.
+
+        @param dirs:     template directories, a template in a directory
+                         overrides templates of following directories
+        @param renderer: renderer converting strings into output text
+        @param fallback: StringTemplate group
+        """
+        super(TemplateGroup, self).__init__()
+        self.templates = {}
+        self.renderer = renderer
+        self.fallback = fallback
+
+        for path in dirs:
+            for dir, subdirs, files in os.walk(path):
+                for fn in files:
+                    if not fn.endswith('.st'):
+                        continue
+                    fn = os.path.join(dir, fn)
+                    name = fn[len(path):-3].strip(os.sep)
+                    name = name.replace(os.sep, '/')
+                    if name not in self.templates:
+                        self.templates[name] = self.compile(name, fn)
+
+
+    def compile(self, name, fn):
+        """
+        Compile template file into template function.
+
+        None is returned if template is not supported.
+        """
+        f = open(fn, 'rb')
+        try:
+            pattern = f.read().strip().decode('utf-8')
+        finally:
+            f.close()
+
+        try:
+            source, entry = translate(pattern)
+        except UnsupportedError, ex:
+            log.debug('template %s not compiled: %s' % (name, ex))
+            return None
+
+        env = {
+            'lookup': lookup,
+            'prop': prop,
+            'apply': apply,
+            'template': self.template,
+            'UnsupportedError': UnsupportedError,
+        }
+        exec compile(source, fn, 'exec') in env
+        return env[entry]
+
+
+    def template(self, name):
+        """
+        Get template function.
+
+        @C{UnsupportedError} is raised if template does not exist or is
+        not supported.
+        """
+        f = self.templates.get(name)
+        if f is None:
+            raise UnsupportedError('template %s not compiled' % name)
+        return f
+
+
+    def getInstanceOf(self, name):
+        """
+        Create page template instance.
+        """
+        return Page(self, name)
@@ -0,0 +1,715 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+EXIF readers.
+
+EXIF reader returns photo EXIF fields using names and formatting of Exiv2
+summary output, i.e. 'Exposure time', 'Aperture', 'ISO speed'. Following
+readers are available
+    - python: in-process reader of JPEG files EXIF data
+    - exiv2: reader using exiv2 command
+
+Use @C{create} function to create a reader by its name.
+"""
+
+import os
+import math
+import struct
+import subprocess
+
+import logging
+log = logging.getLogger('danlann.exif')
+
+
+# Exiv2 summary fields
+FIELDS = ('File name', 'File size', 'MIME type', 'Image size',
+    'Camera make', 'Camera model', 'Image timestamp', 'Image number',
+    'Exposure time', 'Aperture', 'Exposure bias', 'Flash', 'Flash bias',
+    'Focal length', 'Subject distance', 'ISO speed', 'Exposure mode',
+    'Metering mode', 'Macro mode', 'Image quality', 'Exif Resolution',
+    'White balance', 'Thumbnail', 'Copyright', 'Exif comment')
+
+# TIFF tags
+MAKE                = 0x010f
+MODEL               = 0x0110
+DATE_TIME           = 0x0132
+THUMBNAIL_LENGTH    = 0x0202
+COPYRIGHT           = 0x8298
+EXPOSURE_TIME       = 0x829a
+F_NUMBER            = 0x829d
+EXIF_IFD            = 0x8769
+EXPOSURE_PROGRAM    = 0x8822
+ISO_SPEED           = 0x8827
+DATE_TIME_ORIGINAL  = 0x9003
+DATE_TIME_DIGITIZED = 0x9004
+SHUTTER_SPEED       = 0x9201
+APERTURE            = 0x9202
+EXPOSURE_BIAS       = 0x9204
+SUBJECT_DISTANCE    = 0x9206
+METERING_MODE       = 0x9207
+FLASH               = 0x9209
+FOCAL_LENGTH        = 0x920a
+USER_COMMENT        = 0x9286
+PIXEL_X_DIMENSION   = 0xa002
+PIXEL_Y_DIMENSION   = 0xa003
+WHITE_BALANCE       = 0xa403
+FOCAL_LENGTH_35MM   = 0xa405
+
+# TIFF types: struct format and size of a value
+TYPES = {
+    1: ('B', 1),    # byte
+    2: ('s', 1),    # ascii
+    3: ('H', 2),    # short
+    4: ('L', 4),    # long
+    5: ('LL', 8),   # rational
+    6: ('b', 1),    # signed byte
+    7: ('s', 1),    # undefined
+    8: ('h', 2),    # signed short
+    9: ('l', 4),    # signed long
+    10: ('ll', 8),  # signed rational
+    11: ('f', 4),   # float
+    12: ('d', 8),   # double
+}
+
+EXPOSURE_PROGRAMS = {
+    0: 'Not defined',
+    1: 'Manual',
+    2: 'Auto',
+    3: 'Aperture priority',
+    4: 'Shutter priority',
+    5: 'Creative program',
+    6: 'Action program',
+    7: 'Portrait mode',
+    8: 'Landscape mode',
+}
+
+METERING_MODES = {
+    0: 'Unknown',
+    1: 'Average',
+    2: 'Center weighted average',
+    3: 'Spot',
+    4: 'Multi-spot',
+    5: 'Multi-segment',
+    6: 'Partial',
+    255: 'Other',
+}
+
+WHITE_BALANCES = {
+    0: 'Auto',
+    1: 'Manual',
+}
+
+FLASHES = {
+    0x00: 'No flash',
+    0x01: 'Fired',
+    0x05: 'Fired, strobe return light not detected',
+    0x07: 'Fired, strobe return light detected',
+    0x08: 'Yes, did not fire',
+    0x09: 'Yes, compulsory',
+    0x0d: 'Yes, compulsory, return light not detected',
+    0x0f: 'Yes, compulsory, return light detected',
+    0x10: 'No, compulsory',
+    0x14: 'No, did not fire, return not detected',
+    0x18: 'No, auto',
+    0x19: 'Yes, auto',
+    0x1d: 'Yes, auto, return light not detected',
+    0x1f: 'Yes, auto, return light detected',
+    0x20: 'No flash function',
+    0x41: 'Yes, red-eye reduction',
+    0x45: 'Yes, red-eye reduction, return light not detected',
+    0x47: 'Yes, red-eye reduction, return light detected',
+    0x49: 'Yes, compulsory, red-eye reduction',
+    0x4d: 'Yes, compulsory, red-eye reduction, return light not detected',
+    0x4f: 'Yes, compulsory, red-eye reduction, return light detected',
+    0x50: 'No, red-eye reduction',
+    0x58: 'No, auto, red-eye reduction',
+    0x59: 'Yes, auto, red-eye reduction',
+    0x5d: 'Yes, auto, red-eye reduction, return light not detected',
+    0x5f: 'Yes, auto, red-eye reduction, return light detected',
+}
+
+CHARSETS = {
+    'ASCII\0\0\0': 'Ascii',
+    'JIS\0\0\0\0\0': 'Jis',
+    'UNICODE\0': 'Unicode',
+}
+
+
+def readSegments(f):
+    """
+    Read JPEG file EXIF data and image size.
+
+    Only JPEG segment headers are read until start of frame segment. APP1
+    segment is read if it contains EXIF data. Tuple of EXIF data (TIFF
+    structure) and image size is returned. EXIF data is None if not
+    found.
+
+    @param f: JPEG file
+    """
+    if f.read(2) != '\xff\xd8':
+        raise ValueError('not a JPEG file')
+
+    data = None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != '\xff':
+            raise ValueError('invalid JPEG segment')
+        code = ord(marker[1])
+
+        if code == 0xda or code == 0xd9:
+            # start of scan or end of image, no frame header found
+            return data, None
+        if 0xd0 <= code <= 0xd7 or code in (0x01, 0xff):
+            # segments without length
+            continue
+
+        length = struct.unpack('>H', f.read(2))[0] - 2
+        if code == 0xe1 and data is None:
+            segment = f.read(length)
+            if segment.startswith('Exif\0\0'):
+                data = segment[6:]
+        elif 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', f.read(5)[1:])
+            return data, (width, height)
+        else:
+            f.seek(length, 1)
+
+
+
+class TIFF(object):
+    """
+    TIFF structure parser.
+
+    @ivar data:  TIFF structure data
+    @ivar order: byte order, struct module format character
+    """
+    def __init__(self, data):
+        """
+        Create TIFF structure parser.
+
+        @param data: TIFF structure data
+        """
+        super(TIFF, self).__init__()
+        self.data = data
+        if data[:2] == 'II':
+            self.order = '<'
+        elif data[:2] == 'MM':
+            self.order = '>'
+        else:
+            raise ValueError('invalid TIFF byte order')
+
+        if self.unpack('H', 2) != (42,):
+            raise ValueError('invalid TIFF header')
+
+
+    def unpack(self, fmt, offset):
+        """
+        Unpack data at given offset.
+        """
+        fmt = self.order + fmt
+        size = struct.calcsize(fmt)
+        if offset < 0 or offset + size > len(self.data):
+            raise ValueError('TIFF data offset out of range')
+        return struct.unpack(fmt, self.data[offset:offset + size])
+
+
+    def first(self):
+        """
+        Get offset of first IFD.
+        """
+        return self.unpack('L', 4)[0]
+
+
+    def ifd(self, offset):
+        """
+        Read IFD entries.
+
+        Tuple of tag dictionary and offset of next IFD is returned.
+        Rationals are returned as tuples of numerator and denominator,
+        ASCII and undefined values as strings, other values as lists of
+        numbers.
+
+        @param offset: IFD offset
+        """
+        tags = {}
+        count = self.unpack('H', offset)[0]
+        for i in xrange(count):
+            entry = offset + 2 + i * 12
+            tag, type, n = self.unpack('HHL', entry)
+            if type not in TYPES:
+                continue
+            fmt, size = TYPES[type]
+            if size * n > len(self.data):
+                log.debug('invalid TIFF tag 0x%04x' % tag)
+                continue
+
+            pos = entry + 8
+            if size * n > 4:
+                pos = self.unpack('L', pos)[0]
+
+            try:
+                if fmt == 's':
+                    value = self.unpack('%ds' % n, pos)[0]
+                else:
+                    value = self.unpack(fmt * n, pos)
+                    if len(fmt) == 2:
+                        value = zip(value[::2], value[1::2])
+            except ValueError:
+                log.debug('invalid TIFF tag 0x%04x' % tag)
+                continue
+            tags[tag] = value
+
+        next = 0
+        try:
+            next = self.unpack('L', offset + 2 + count * 12)[0]
+        except ValueError:
+            pass
+        return tags, next
+
+
+
+def string(value):
+    """
+    Format ASCII value.
+    """
+    return value.split('\0')[0].strip()
+
+
+def number(value):
+    """
+    Format number.
+    """
+    return '%d' % value[0]
+
+
+def fnumber(value):
+    """
+    Format F number.
+    """
+    num, den = value[0]
+    if den == 0:
+        return '(%d/%d)' % (num, den)
+    return 'F%.2g' % (float(num) / den)
+
+
+def aperture(value):
+    """
+    Format APEX aperture value as F number.
+    """
+    num, den = value[0]
+    if den == 0:
+        return '(%d/%d)' % (num, den)
+    return 'F%.2g' % math.pow(2, float(num) / den / 2)
+
+
+def exposureTime(value):
+    """
+    Format exposure time.
+    """
+    num, den = value[0]
+    if num > 1 and den > 1 and den >= num:
+        den = int(float(den) / num + 0.5)
+        num = 1
+    if den > 1 and den < num:
+        num = int(float(num) / den + 0.5)
+        den = 1
+    if den == 1:
+        return '%d s' % num
+    return '%d/%d s' % (num, den)
+
+
+def shutterSpeed(value):
+    """
+    Format APEX shutter speed value as exposure time.
+    """
+    num, den = value[0]
+    if den == 0:
+        return '(%d/%d)' % (num, den)
+    t = math.pow(2, float(num) / den)
+    if t > 1:
+        return '1/%d s' % int(t + 0.5)
+    return '%d s' % int(1 / t + 0.5)
+
+
+def exposureBias(value):
+    """
+    Format exposure bias.
+    """
+    num, den = value[0]
+    if den <= 0:
+        return '(%d/%d)' % (num, den)
+    if num == 0:
+        return '0 EV'
+
+    a, b = abs(num), den
+    while b:
+        a, b = b, a % b
+    sign = num < 0 and '-' or '+'
+    num, den = abs(num) / a, den / a
+    if den == 1:
+        return '%s%d EV' % (sign, num)
+    return '%s%d/%d EV' % (sign, num, den)
+
+
+def focalLength(value):
+    """
+    Format focal length.
+    """
+    num, den = value[0]
+    if den == 0:
+        return '(%d/%d)' % (num, den)
+    return '%.1f mm' % (float(num) / den)
+
+
+def subjectDistance(value):
+    """
+    Format subject distance.
+    """
+    num, den = value[0]
+    if num == 0:
+        return 'Unknown'
+    if num == 0xffffffff:
+        return 'Infinity'
+    if den == 0:
+        return '(%d/%d)' % (num, den)
+    return '%.2f m' % (float(num) / den)
+
+
+def table(values):
+    """
+    Create formatting function for enumerated values.
+
+    @param values: value descriptions
+    """
+    def format(value):
+        return values.get(value[0], '(%d)' % value[0])
+    return format
+
+
+def copyright(value):
+    """
+    Format copyright, which contains photographer and editor copyright.
+    """
+    items = [item.strip() for item in value.split('\0')]
+    return ', '.join(item for item in items[:2] if item)
+
+
+def comment(value):
+    """
+    Format user comment.
+    """
+    charset = CHARSETS.get(value[:8])
+    if charset is None:
+        return string(value[8:])
+    return 'charset="%s" %s' % (charset, string(value[8:]))
+
+
+
+class Reader(object):
+    """
+    EXIF reader.
+
+    Reader methods can be called from many threads at the same time.
+
+    @cvar name:  reader name
+    @cvar title: reader description used in error messages
+    """
+    name = None
+    title = None
+
+    def check(self):
+        """
+        Check if reader can be used. @C{OSError} is raised if reader
+        software is not installed.
+        """
+        pass
+
+
+    def read(self, fn):
+        """
+        Read EXIF fields of a photo.
+
+        Dictionary of fields is returned, which is empty if photo has no
+        EXIF data.
+
+        @param fn: photo filename
+        """
+        raise NotImplementedError
+
+
+    def readMulti(self, files):
+        """
+        Read EXIF fields of many photos.
+
+        Dictionary of photo filename and its EXIF fields is returned.
+        Problems with reading EXIF data of a photo are logged and the
+        photo is not included in the dictionary.
+
+        @param files: list of photo filenames
+        """
+        result = {}
+        for fn in files:
+            try:
+                result[fn] = self.read(fn)
+            except (IOError, OSError, ValueError), ex:
+                log.warn('exif problem (%s): %s' % (fn, ex))
+        return result
+
+
+
+class PythonReader(Reader):
+    """
+    In-process EXIF reader of JPEG files.
+
+    Only JPEG segment headers and EXIF segment are read from a file.
+    Maker notes are not supported, so fields, which are available in maker
+    notes only (i.e. 'Flash bias', 'Macro mode'), are empty.
+    """
+    name = 'python'
+    title = 'Python EXIF reader'
+
+    # EXIF IFD fields: tag and formatting function
+    EXIF = (
+        ('Exposure time', EXPOSURE_TIME, exposureTime),
+        ('Aperture', F_NUMBER, fnumber),
+        ('Exposure bias', EXPOSURE_BIAS, exposureBias),
+        ('Flash', FLASH, table(FLASHES)),
+        ('Focal length', FOCAL_LENGTH, focalLength),
+        ('Subject distance', SUBJECT_DISTANCE, subjectDistance),
+        ('ISO speed', ISO_SPEED, number),
+        ('Exposure mode', EXPOSURE_PROGRAM, table(EXPOSURE_PROGRAMS)),
+        ('Metering mode', METERING_MODE, table(METERING_MODES)),
+        ('White balance', WHITE_BALANCE, table(WHITE_BALANCES)),
+        ('Exif comment', USER_COMMENT, comment),
+    )
+
+    def read(self, fn):
+        f = open(fn, 'rb')
+        try:
+            try:
+                data, size = readSegments(f)
+            except struct.error:
+                raise ValueError('truncated JPEG file')
+        finally:
+            f.close()
+
+        if data is None:
+            return {}
+
+        tiff = TIFF(data)
+        ifd0, next = tiff.ifd(tiff.first())
+        exif = {}
+        if isinstance(ifd0.get(EXIF_IFD), tuple):
+            exif = tiff.ifd(ifd0[EXIF_IFD][0])[0]
+        ifd1 = {}
+        if next:
+            ifd1 = tiff.ifd(next)[0]
+
+        fields = dict((field, '') for field in FIELDS)
+        fields['File name'] = fn
+        fields['File size'] = '%d Bytes' % os.path.getsize(fn)
+        fields['MIME type'] = 'image/jpeg'
+        if size:
+            fields['Image size'] = '%d x %d' % size
+
+        def value(tags, tag, format):
+            # tags of unexpected type or count are skipped like exiv2
+            # does
+            if tag not in tags or not tags[tag]:
+                return ''
+            try:
+                return format(tags[tag])
+            except (TypeError, ValueError, AttributeError, IndexError,
+                    ZeroDivisionError, OverflowError), ex:
+                log.warn('exif problem (%s): invalid tag 0x%04x: %s' \
+                        % (fn, tag, ex))
+                return ''
+
+        fields['Camera make'] = value(ifd0, MAKE, string)
+        fields['Camera model'] = value(ifd0, MODEL, string)
+        fields['Copyright'] = value(ifd0, COPYRIGHT, copyright)
+
+        for tags, tag in ((exif, DATE_TIME_ORIGINAL),
+                (exif, DATE_TIME_DIGITIZED), (ifd0, DATE_TIME)):
+            if tag in tags:
+                fields['Image timestamp'] = value(tags, tag, string)
+                break
+
+        for field, tag, format in self.EXIF:
+            fields[field] = value(exif, tag, format)
+
+        if not fields['Exposure time']:
+            fields['Exposure time'] = value(exif, SHUTTER_SPEED,
+                    shutterSpeed)
+        if not fields['Aperture']:
+            fields['Aperture'] = value(exif, APERTURE, aperture)
+        if fields['Focal length']:
+            length = value(exif, FOCAL_LENGTH_35MM, number)
+            if length and length != '0':
+                fields['Focal length'] += ' (35 mm equivalent: %s.0 mm)' \
+                        % length
+
+        width = value(exif, PIXEL_X_DIMENSION, number)
+        height = value(exif, PIXEL_Y_DIMENSION, number)
+        if width and height:
+            fields['Exif Resolution'] = '%s x %s' % (width, height)
+
+        length = value(ifd1, THUMBNAIL_LENGTH, number)
+        if length:
+            fields['Thumbnail'] = 'image/jpeg, %s Bytes' % length
+
+        return fields
+
+
+
+class Exiv2Reader(Reader):
+    """
+    EXIF reader using exiv2 command.
+
+    Exiv2 summary output is parsed, problems reported by exiv2 are
+    logged.
+
+    When reading EXIF data of many photos, exiv2 command is run once for
+    a chunk of photos. Exiv2 prefixes output lines with photo filename in
+    such case and the output is split by the prefix. Photos without
+    output lines could not be read by exiv2.
+
+    @cvar CHUNK: maximum amount of photos processed by one exiv2 run
+    """
+    name = 'exiv2'
+    title = 'Exiv2 (exiv2 command)'
+
+    CHUNK = 100
+
+    def check(self):
+        self.execute(['-h'])
+
+
+    def execute(self, args):
+        """
+        Run exiv2 command and return its standard output.
+
+        Standard output and error are read at the same time, problems
+        reported by exiv2 are logged.
+
+        @param args: exiv2 command arguments
+        """
+        p = subprocess.Popen(['exiv2'] + list(args),
+                stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        stdout, stderr = p.communicate()
+
+        # report exif problems
+        for line in stderr.splitlines():
+            log.warn('exif problem: %s' % line)
+        return stdout
+
+
+    def parse(self, lines):
+        """
+        Parse exiv2 summary output lines.
+
+        @param lines: exiv2 output lines
+        """
+        fields = {}
+        for line in lines:
+            if not line:
+                continue
+            data = line.split(':')
+            field = data[0].strip()
+            value = ':'.join(data[1:]).strip()
+            fields[field] = value
+        return fields
+
+
+    def split(self, files, output):
+        """
+        Split output of exiv2 run for many photos.
+
+        Dictionary of photo filename and its output lines, without
+        filename prefix, is returned.
+
+        @param files:  list of photo filenames in order of exiv2 arguments
+        @param output: exiv2 output
+        """
+        def prefixed(line, fn):
+            return line.startswith(fn) and line[len(fn):len(fn) + 1] == ' '
+
+        result = dict((fn, []) for fn in files)
+        i = 0
+        for line in output.splitlines():
+            # output is in order of files, so look for line prefix
+            # starting with current file; the longest prefix wins as
+            # filename of a photo can be prefix of another one
+            found = None
+            for j in xrange(i, len(files)):
+                if not prefixed(line, files[j]):
+                    continue
+                if found is None or len(files[j]) > len(files[found]):
+                    found = j
+            if found is not None:
+                i = found
+                result[files[found]].append(line[len(files[found]):])
+        return result
+
+
+    def read(self, fn):
+        lines = self.execute([fn]).splitlines()
+        if not lines:
+            raise ValueError('no exiv2 output')
+        return self.parse(lines)
+
+
+    def readMulti(self, files):
+        # remove duplicates keeping order of files
+        unique = set()
+        files = [fn for fn in files if not (fn in unique or unique.add(fn))]
+
+        result = {}
+        for i in xrange(0, len(files), self.CHUNK):
+            chunk = files[i:i + self.CHUNK]
+            if len(chunk) == 1:
+                # exiv2 does not prefix output lines for one photo
+                result.update(super(Exiv2Reader, self).readMulti(chunk))
+                continue
+
+            output = self.split(chunk, self.execute(chunk))
+            for fn in chunk:
+                # exiv2 does not output anything for a photo it cannot read
+                if output[fn]:
+                    result[fn] = self.parse(output[fn])
+        return result
+
+
+
+READERS = {
+    'python': PythonReader,
+    'exiv2': Exiv2Reader,
+}
+
+
+def create(name):
+    """
+    Create EXIF reader by its name.
+
+    @C{KeyError} is raised if reader is unknown.
+
+    @param name: reader name, see @C{READERS}
+    """
+    return READERS[name]()
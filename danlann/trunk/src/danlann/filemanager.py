@@ -20,10 +20,11 @@
 import os.path
 import re
 import shutil
-import sys
 import libxml2
 
 from danlann.bc import Exif
+import danlann.backend
+import danlann.exif
 
 import logging
 log = logging.getLogger('danlann.filemanager')
@@ -36,20 +37,43 @@ class FileManager(object):
         - converting
         - looking for files
 
+    Photos are converted with conversion backend. Photo EXIF data are read
+    with EXIF reader.
+
+    @ivar backend:     photo conversion backend
+    @ivar exif:        EXIF reader
     @ivar convert_cmd: basic convert arguments for ImageMagick
-        or GraphicsMagick
+        or GraphicsMagick if command conversion backend is used
+
+    @see danlann.backend
+    @see danlann.exif
     """
-    def __init__(self, graphicsmagick):
+    def __init__(self, graphicsmagick = True, batch = False, backend = None,
+            exif = None):
         """
         Create file manager.
 
+        If conversion backend is not specified, then it is chosen using
+        GraphicsMagick and batch flags.
+
         @param graphicsmagick: if true, then use GraphicsMagick conversion
             basic arguments
+        @param batch:          if true, then use GraphicsMagick batch
+            processes
+        @param backend:        photo conversion backend
+        @param exif:           EXIF reader, in-process reader by default
         """
-        if graphicsmagick:
-            self.convert_cmd = ['gm', 'gm', 'convert']
-        else:
-            self.convert_cmd = ['convert', 'convert']
+        if backend is None:
+            if graphicsmagick and batch:
+                backend = danlann.backend.GMBatchBackend()
+            else:
+                backend = danlann.backend.CommandBackend(graphicsmagick)
+        self.backend = backend
+        self.convert_cmd = getattr(backend, 'convert_cmd', None)
+
+        if exif is None:
+            exif = danlann.exif.PythonReader()
+        self.exif = exif
 
 
     def mkdir(self, dir):
@@ -110,32 +134,31 @@ class FileManager(object):
             log.info('%s copied into %s' % (src, dest))
 
 
-    def getExif(self, fn, headers):
+    def readExif(self, files):
         """
-        Get EXIF data from file.
+        Read EXIF fields from many files.
 
-        List of EXIF objects.
+        Dictionary of filename and its EXIF fields is returned. Files,
+        which EXIF fields cannot be read, are not included.
 
-        @param fn:      input file
-        @param headers: EXIF headers to be returned
+        @param files: list of input files
         """
-        stdin, f, stderr = os.popen3('exiv2 \'%s\'' % fn)
-        exif = []
-        for line in f:
-            if not line:
-                continue
-            data = line.split(':')
-            field = data[0].strip()
-            value = ':'.join(data[1:]).strip()
-            if field in headers:
-                exif.append(Exif(field.strip(), value.strip()))
+        try:
+            return self.exif.readMulti(files)
+        except OSError, ex:
+            log.warn('exif problem: %s' % ex)
+            return {}
 
-        exif.sort(key = lambda item: headers.index(item.name))
 
-        # report exif problems
-        for line in stderr:
-            log.warn('exif problem (%s): %s' % (fn, line))
-        return exif
+    def selectExif(self, fields, headers):
+        """
+        Get list of EXIF objects for EXIF headers.
+
+        @param fields:  dictionary of EXIF fields
+        @param headers: EXIF headers to be returned
+        """
+        return [Exif(field, fields[field]) for field in headers
+                if field in fields]
 
 
     def lookup(self, path, fn):
@@ -160,10 +183,32 @@ class FileManager(object):
         @pvar fn_out : output filename
         @pvar args   : conversion arguments
         """
-        self.execl(self.convert_cmd + [fn_in] + args + [fn_out])
+        self.backend.convert(fn_in, fn_out, args)
         log.info('converted %s -> %s' % (fn_in, fn_out))
 
 
+    def convertMulti(self, fn_in, outputs):
+        """
+        Convert file into several output files decoding input file once.
+
+        Output files should be sorted by size, the largest first.
+
+        @pvar fn_in   : input filename
+        @pvar outputs : list of output filename and conversion arguments
+            pairs
+        """
+        self.backend.convertMulti(fn_in, outputs)
+        log.info('converted %s -> %s' % (fn_in,
+            ', '.join(fn_out for fn_out, args in outputs)))
+
+
+    def close(self):
+        """
+        Release conversion backend resources.
+        """
+        self.backend.close()
+
+
     def validate(self, fn):
         """
         Validate XML file.
@@ -192,49 +237,97 @@ class FileManager(object):
         ctxt.parseDocument()
         doc = ctxt.doc()
 
-        # save formatted file
-        f = open(fn, 'w')
+        # save formatted file, it replaces the file when it is saved
+        tmp = '%s.tmp' % fn
+        f = open(tmp, 'w')
         buf = libxml2.createOutputBuffer(f, 'UTF-8')
         doc.saveFormatFileTo(buf, 'UTF-8', 1)
         f.close()
+        os.rename(tmp, fn)
 
         doc.freeDoc()
         del ctxt
 
 
-    def execl(self, args):
+
+class PhotoIndex(object):
+    """
+    Index of photo files in a list of directories.
+
+    Directories are scanned once, then looking for a photo file requires
+    no file system access. If a photo file exists in more than one
+    directory, then the file from the first directory is used, the same
+    as for @C{FileManager.lookup} method, and a warning is logged.
+
+    In recursive mode, subdirectories are scanned as well and photo files
+    are indexed by their names.
+
+    @ivar path:      list of indexed directories
+    @ivar recursive: scan subdirectories if true
+    @ivar ext:       extension of indexed files
+    @ivar files:     photo filename to absolute directory mapping
+    """
+    def __init__(self, path, recursive = False, ext = '.jpg'):
         """
-        Execute command using @C{os.exec*}.
+        Create photo index.
 
-        @param args: list with command and command arguments to execute
+        @param path:      list of directories to index
+        @param recursive: scan subdirectories if true
+        @param ext:       extension of indexed files
         """
-        pid = os.fork()
-        if pid:
-            pid, status = os.waitpid(pid, 0)
-            errno = os.WEXITSTATUS(status)
+        super(PhotoIndex, self).__init__()
+        self.path      = path
+        self.recursive = recursive
+        self.ext       = ext
+        self.files     = {}
 
-            # raise exception using errno from child
-            if errno:
-                raise OSError(errno, os.strerror(errno))
+
+    def build(self):
+        """
+        Scan directories and build the index.
+        """
+        self.files = {}
+        for dir in self.path:
+            for subdir, fn in self.scan(os.path.abspath(dir)):
+                if fn in self.files:
+                    log.warn('photo %s found in %s and %s, using the first' \
+                            ' one' % (fn, self.files[fn], subdir))
+                else:
+                    self.files[fn] = subdir
+        log.debug('indexed %d photo files' % len(self.files))
+
+
+    def scan(self, dir):
+        """
+        Get directory and name of photo files found in a directory.
+
+        @param dir: absolute directory name
+        """
+        if self.recursive:
+            for subdir, subdirs, files in os.walk(dir):
+                subdirs.sort()
+                for fn in sorted(files):
+                    if fn.endswith(self.ext):
+                        yield subdir, fn
         else:
             try:
-                os.close(1)
-                os.close(2)
-                os.execlp(*args)
+                files = os.listdir(dir)
             except OSError, ex:
-                sys.exit(ex.errno) # exit with errno
-            except:
-                sys.exit(4) # otherwise EINTR
+                log.warn('cannot read directory %s: %s' % (dir, ex.strerror))
+                files = []
+            for fn in sorted(files):
+                if fn.endswith(self.ext):
+                    yield dir, fn
 
 
-    def checkCommand(self, cmd):
+    def lookup(self, fn):
         """
-        Check if it is possible to execute @C{cmd} command by calling:
-
-            cmd -help
-
-        This way it is possible to check for command existence.
+        Look for a photo file. Absolute path to the file is returned or
+        None if file is not found.
 
-        @param cmd: command to check
+        @param fn: a photo file looked for
         """
-        self.execl([cmd, cmd, '-help'])
+        dir = self.files.get(fn)
+        if dir is None:
+            return None
+        return '%s/%s' % (dir, fn)
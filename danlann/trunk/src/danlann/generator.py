@@ -20,13 +20,106 @@
 import sys
 import os
 import os.path
-import codecs
+from hashlib import sha1
 
 from danlann.bc import Gallery, Album, Photo
+from danlann.pool import WorkerPool
+from danlann.scheduler import Scheduler
+from danlann.filemanager import PhotoIndex
+from danlann.cache import Store, ExifCache, fingerprint, digest
 
 import logging
 log = logging.getLogger('danlann.generator')
 
+# amount of pages sent to page rendering process at once
+RENDER_BATCH = 32
+
+# size of page file buffer
+PAGE_BUFFER = 256 * 1024
+
+# template of page rendering process, see initRenderer
+renderer = None
+
+
+def initRenderer(tmpl):
+    """
+    Initialize page rendering process with gallery template.
+
+    @param tmpl: gallery template
+    """
+    global renderer
+    renderer = tmpl
+
+
+def renderPage(fn, checksum, render, *args):
+    """
+    Render page into temporary file and replace page file with it if page
+    content changed.
+
+    Page is streamed into the temporary file through a large buffer.
+    Page file is left intact if checksum of rendered page is the same as
+    checksum of page rendered previously, so page file modification time
+    is preserved. The checksums are taken before page file is reformatted,
+    see @C{DanlannGenerator.formatPage}, so they differ from checksum of
+    page file content. Checksum of rendered page is returned.
+
+    @param fn:       page filename
+    @param checksum: checksum of page rendered previously, None if unknown
+    @param render:   template method rendering the page
+    @param args:     rendering method arguments
+    """
+    tmp = '%s.tmp' % fn
+    try:
+        f = open(tmp, 'wb', PAGE_BUFFER)
+        try:
+            render(f, *args)
+        finally:
+            f.close()
+
+        rendered = digest(tmp)
+        if rendered == checksum:
+            os.remove(tmp)
+        else:
+            os.rename(tmp, fn)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return rendered
+
+
+def temporary(fn):
+    """
+    Get name of temporary file of output photo.
+
+    Output photo file extension is kept, so conversion software
+    recognizes output file format.
+
+    @param fn: output photo filename
+    """
+    root, ext = os.path.splitext(fn)
+    return '%s.tmp%s' % (root, ext)
+
+
+def renderPages(pages):
+    """
+    Render pages and write changed pages into files.
+
+    The function is called by page rendering processes. Gallery items
+    shown on a page are recreated from page data. List of rendered pages
+    checksums is returned.
+
+    @param pages: list of page filename, checksum of page rendered
+                  previously, name of template method rendering the page
+                  and page data
+    """
+    checksums = []
+    for fn, checksum, render, data in pages:
+        args = renderer.pageItems(render, data)
+        checksums.append(renderPage(fn, checksum, getattr(renderer, render),
+                *args))
+    return checksums
+
 
 
 class ConversionArguments(list):
@@ -101,18 +194,63 @@ class DanlannGenerator(object):
     Gallery generator.
 
     @ivar indir        : gallery input directories
+    @ivar recursive    : look for photo files in input directories
+                         subdirectories
+    @ivar index        : photo files index, built on generation if None
     @ivar outdir       : gallery output dir
     @ivar convert_args : photo conversion parameters
     @ivar fm           : file manager
+    @ivar jobs         : amount of parallel photo conversions
+    @ivar renderjobs   : amount of pages rendered in parallel by separate
+                         processes
+    @ivar decodeonce   : convert thumbnail and image decoding photo once
+    @ivar pool         : worker pool
+    @ivar scheduler    : generation tasks scheduler
+    @ivar validate     : validate written pages
+    @ivar checksum     : use input photo checksum to check if converted
+                         photo is up to date
+    @ivar state        : conversion state (converted photos fingerprints)
+    @ivar cache        : converted photos cache, None if not used
+    @ivar exifcache    : photos EXIF fields cache
+    @ivar pages        : pages state (generated pages data fingerprints
+                         and rendered pages checksums)
+    @ivar tmplfp       : gallery template fingerprint
+    @ivar written      : list of pages written by generator, None if
+                         gallery is not generated yet
+    @ivar unchanged    : amount of pages, which content did not change
+    @ivar renderer     : pool of page rendering processes, None if pages
+                         are rendered by generator
+    @ivar batch        : pages to be sent to page rendering process
+    @ivar rendering    : pages sent to page rendering processes with
+                         their rendering results
 
     @ivar tmpl         : gallery template
     """
     def __init__(self, gallery, fm):
         self.indir        = []
+        self.recursive    = False
+        self.index        = None
         self.outdir       = None
         self.gallery      = gallery
         self.fm           = fm
         self.exif_headers = []
+        self.jobs         = 1
+        self.renderjobs   = 1
+        self.pool         = None
+        self.scheduler    = None
+        self.validate     = False
+        self.decodeonce   = False
+        self.checksum     = False
+        self.state        = None
+        self.cache        = None
+        self.exifcache    = None
+        self.pages        = None
+        self.tmplfp       = None
+        self.written      = None
+        self.unchanged    = 0
+        self.renderer     = None
+        self.batch        = []
+        self.rendering    = []
 
         self.convert_args = {
             'thumb'   : ConversionArguments('128x128>'),
@@ -160,95 +298,523 @@ class DanlannGenerator(object):
         if not os.path.exists(self.outdir):
             os.makedirs(self.outdir)
 
-        f = codecs.open('%s/index.xhtml' % self.outdir, 'w', encoding='utf-8')
-        self.tmpl.galleryPage(f)
-        f.close()
+        # photo index is kept between generator runs, it is rebuilt when
+        # reset
+        if self.index is None:
+            self.index = PhotoIndex(self.indir, self.recursive)
+            self.index.build()
+
+        self.state = Store('%s/.danlann-convert' % self.outdir)
+        self.state.open()
+
+        self.pages = Store('%s/.danlann-pages' % self.outdir)
+        self.pages.open()
+        self.tmplfp = self.tmpl.fingerprint()
+        self.written = []
+        self.unchanged = 0
+
+        self.exifcache = ExifCache('%s/.danlann-exif' % self.outdir)
+        self.exifcache.open()
+
+        if self.cache is not None:
+            self.cache.open()
+
+        # rendering processes are forked before worker threads are
+        # started
+        self.startRenderer()
+        self.pool = WorkerPool(self.jobs, ('danlann',))
+        self.pool.start()
+        self.scheduler = Scheduler(self.pool)
+        try:
+            self.scheduler.add(self.generateGallery)
+            for album in self.gallery.subalbums:
+                self.generateAlbum(album, self.gallery)
+
+            self.scheduler.run()
 
-        for album in self.gallery.subalbums:
-            self.generateAlbum(album, self.gallery)
+            # wait for rendered pages and reformat them
+            self.flushPages(True)
+            self.scheduler.run()
 
-        log.info('generated index page')
+            # process results of remaining jobs
+            self.pool.join()
+        finally:
+            self.pool.close()
+            self.stopRenderer()
+            self.fm.close()
+            self.state.close()
+            self.pages.close()
+            self.exifcache.close()
+            if self.cache is not None:
+                self.cache.close()
+
+        log.debug('exif cache: %d hits, %d misses' \
+                % (self.exifcache.hits, self.exifcache.misses))
+
+
+    def report(self):
+        """
+        Get generated pages statistics report.
+        """
+        return 'pages: %d written, %d unchanged' \
+                % (len(self.written), self.unchanged)
+
+
+    def startRenderer(self):
+        """
+        Start pool of page rendering processes if pages are rendered in
+        parallel.
+
+        Each process receives gallery template once, then only data of
+        rendered pages is sent to the processes. Pages are rendered by
+        generator if multiprocessing module is not available or page
+        data does not contain all item attributes used by the template,
+        i.e. template override is used.
+        """
+        self.renderer = None
+        self.batch = []
+        self.rendering = []
+        if self.renderjobs < 2:
+            return
+
+        if not self.tmpl.complete():
+            log.info('template override used, pages are rendered one' \
+                    ' after another')
+            return
+
+        try:
+            import multiprocessing
+        except ImportError:
+            log.warning('multiprocessing module not available, pages are' \
+                    ' rendered one after another')
+            return
+
+        self.renderer = multiprocessing.Pool(self.renderjobs, initRenderer,
+                (self.tmpl,))
+        log.debug('started %d page rendering processes' % self.renderjobs)
+
+
+    def stopRenderer(self):
+        """
+        Stop page rendering processes.
+
+        All rendered pages are processed on successful generation, so
+        only pages being rendered on failure are discarded.
+        """
+        if self.renderer is not None:
+            self.renderer.terminate()
+            self.renderer.join()
+            self.renderer = None
+
+
+    def generateGallery(self):
+        """
+        Generate gallery index page.
+        """
+        self.writePage('index.xhtml', 'index page', self.tmpl.galleryData(),
+                self.tmpl.galleryPage)
 
 
     def generateAlbum(self, album, parent):
-        self.fm.mkdir(self.getDir(album))
-        fn = self.getAlbumFile(album, 'index.xhtml')
+        """
+        Schedule generation of album, its subalbums and photos.
 
-        f = codecs.open(fn, 'w', encoding='utf-8')
-        self.tmpl.albumPage(f, album, parent)
-        f.close()
+        Album page and photo pages do not depend on any other task. Photo
+        EXIF page depends on reading EXIF data of album photos.
+        """
+        self.fm.mkdir(self.getDir(album))
+        self.scheduler.add(self.generateAlbumPage, (album, parent))
 
         for subalbum in album.subalbums:
             self.generateAlbum(subalbum, album)
 
-        for photo in album.photos:
-            self.generateAlbumPhotos(photo)
+        photos = [photo for photo in album.photos if self.lookupPhoto(photo)]
+        exif = self.readExif(photos)
 
-        log.info('generated album %s' % album.dir)
+        for photo in photos:
+            self.scheduler.add(self.generateExif, (photo,), (exif,))
+            self.convertPhotos(photo)
+            self.scheduler.add(self.generatePhoto, (photo,))
 
 
-    def generateAlbumPhotos(self, photo):
-        try:
-            # lookup photo input absolute filename
-            files = self.fm.lookup(self.indir, '%s.jpg' % photo.name)
-            photo.filename = files.next()
+    def generateAlbumPage(self, album, parent):
+        """
+        Generate album page.
+        """
+        self.writePage('%s/index.xhtml' % album.dir, 'album %s' % album.dir,
+                self.tmpl.albumData(album, parent),
+                self.tmpl.albumPage, album, parent)
 
-            self.generateExif(photo)
-            self.convertPhoto(photo, 'thumb')
-            self.convertPhoto(photo)
 
-            self.generatePhoto(photo)
-        except StopIteration, ex:
+    def lookupPhoto(self, photo):
+        """
+        Lookup photo input absolute filename.
+
+        False is returned if photo file is not found.
+        """
+        photo.filename = self.index.lookup('%s.jpg' % photo.name)
+        if photo.filename is None:
             log.error('could not find photo %s file' % photo.name)
+            return False
+        return True
 
 
-    def generateExif(self, photo):
-        photo.exif = self.fm.getExif(photo.filename, self.exif_headers)
+    def readExif(self, photos):
+        """
+        Read EXIF data of album photos at once.
+
+        EXIF data is taken from EXIF cache. Photos, which are not in the
+        cache or changed since they were cached, are read by worker task.
+        The task is returned or None if all photos are cached.
+        """
+        missing = []
+        for photo in photos:
+            fields = self.exifcache.fetch(photo.filename, self.fm.exif.name)
+            if fields is None:
+                missing.append(photo)
+            else:
+                photo.exif = self.fm.selectExif(fields, self.exif_headers)
+
+        if not missing:
+            return None
+
+        def update(data):
+            for photo in missing:
+                fields = data.get(photo.filename)
+                if fields is None:
+                    photo.exif = []
+                    continue
+                self.exifcache.store(photo.filename, self.fm.exif.name,
+                        fields)
+                photo.exif = self.fm.selectExif(fields, self.exif_headers)
+
+        files = [photo.filename for photo in missing]
+        return self.scheduler.add(self.fm.readExif, (files,), worker = True,
+                callback = update)
+
 
+    def generateExif(self, photo):
         if photo.exif:
             exif_fn = self.getPhotoFile(photo, 'exif')
-            f = codecs.open(self.getAlbumFile(photo.album, exif_fn), 'w', encoding='utf-8')
-            self.tmpl.exifPage(f, photo)
-            f.close()
-            log.info('generated exif page for photo %s' % photo.name)
+            self.writePage('%s/%s' % (photo.album.dir, exif_fn),
+                    'exif page for photo %s' % photo.name,
+                    self.tmpl.exifData(photo), self.tmpl.exifPage, photo)
         else:
             log.error('photo %s does not contain exif' % photo.name)
 
 
 
-    def convertPhoto(self, photo, photo_type=None):
-        fn_in  = None
-        fn_out = '%s/%s/%s' % (self.outdir,
+    def convertPhotos(self, photo):
+        """
+        Convert photo into thumbnail and image if they are not up to date.
+
+        Conversion is executed by conversion worker pool. Converted photo
+        is up to date if input photo fingerprint, conversion arguments and
+        conversion backend did not change since last conversion.
+        """
+        photo_types = ('thumb', None)
+        if self.decodeonce:
+            # image is converted before thumbnail as conversion backend
+            # can derive thumbnail from image
+            photo_types = (None, 'thumb')
+
+        fp_in = fingerprint(photo.filename, self.checksum)
+
+        outputs = []
+        for photo_type in photo_types:
+            fn_out = self.getConvertFile(photo, photo_type)
+            key = '%s/%s' % (photo.album.dir,
+                    self.getPhotoFile(photo, photo_type, 'jpg'))
+            args = self.getConvertArgs(photo_type)
+            fp = self.getConvertFingerprint(fp_in, args)
+
+            if self.isConverted(fn_out, key, fp):
+                log.info('leaving intact %s' % fn_out)
+            else:
+                outputs.append((fn_out, args, key, fp))
+
+        if outputs:
+            self.scheduler.add(self.convert, (photo.filename, outputs),
+                    worker = True, callback = self.converted)
+
+
+    def getConvertFile(self, photo, photo_type):
+        """
+        Return output filename of converted photo.
+        """
+        return '%s/%s/%s' % (self.outdir,
             photo.album.dir,
             self.getPhotoFile(photo, photo_type, 'jpg'))
 
-        if os.path.exists(fn_out):
-            log.info('leaving intact %s' % fn_out)
-        elif photo.filename:
+
+    def getConvertArgs(self, photo_type):
+        """
+        Return conversion arguments for given photo type.
+        """
+        pt = 'image'
+        if photo_type is not None:
+            pt = photo_type
+        assert pt in self.convert_args
+        return self.convert_args[pt]
+
+
+    def getConvertFingerprint(self, fp_in, args):
+        """
+        Return fingerprint of converted photo.
+
+        The fingerprint is built of input photo fingerprint, conversion
+        arguments and conversion backend name.
+
+        @param fp_in: input photo fingerprint
+        @param args:  conversion arguments
+        """
+        data = [fp_in, self.fm.backend.name] + list(args)
+        return sha1('\0'.join(data)).hexdigest()
+
+
+    def isConverted(self, fn_out, key, fp):
+        """
+        Check if converted photo is up to date.
+
+        Converted photo, which has no fingerprint recorded, was created
+        by previous version of Danlann and it is assumed to be up to date.
+
+        @param fn_out: converted photo filename
+        @param key:    converted photo conversion state key
+        @param fp:     converted photo fingerprint
+        """
+        if not os.path.exists(fn_out):
+            return False
+
+        recorded = self.state.get(key)
+        if recorded is None:
+            self.state.set(key, fp)
+            return True
+        return recorded == fp
+
+
+    def convert(self, fn_in, outputs):
+        """
+        Convert photo into output photos fetching them from converted
+        photos cache if possible.
+
+        The method is called by conversion worker pool. List of
+        successfully converted output photos is returned.
+
+        @param fn_in:   input photo filename
+        @param outputs: list of output photos, see @C{convertPhotos}
+        """
+        # photos are converted into temporary files, which replace output
+        # photos on success, so output photo is left intact if conversion
+        # fails and hard link to a cached photo is never overwritten
+        try:
+            if self.cache is None:
+                converted = self.convertFiles(fn_in, outputs)
+            else:
+                converted = self.convertCached(fn_in, outputs)
+
+            for output in converted:
+                os.rename(temporary(output[0]), output[0])
+            return converted
+        finally:
+            for output in outputs:
+                tmp = temporary(output[0])
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+
+    def convertCached(self, fn_in, outputs):
+        """
+        Fetch output photos from converted photos cache, convert and store
+        in the cache the missing ones.
+
+        List of fetched and converted output photos is returned.
+
+        @param fn_in:   input photo filename
+        @param outputs: list of output photos, see @C{convertPhotos}
+        """
+        checksum = digest(fn_in)
+        keys = {}
+        cached = []
+        missing = []
+        for output in outputs:
+            fn_out, args = output[:2]
+            key = self.cache.key(checksum, self.fm.backend.name, args)
+            if self.cache.fetch(key, temporary(fn_out)):
+                log.info('fetched from cache %s' % fn_out)
+                cached.append(output)
+            else:
+                keys[fn_out] = key
+                missing.append(output)
+
+        converted = []
+        if missing:
+            converted = self.convertFiles(fn_in, missing)
+        for output in converted:
+            self.cache.store(keys[output[0]], temporary(output[0]))
+
+        return cached + converted
+
+
+    def convertFiles(self, fn_in, outputs):
+        """
+        Convert photo into temporary files of output photos with
+        conversion backend, see @C{temporary}.
+
+        List of successfully converted output photos is returned.
+
+        @param fn_in:   input photo filename
+        @param outputs: list of output photos, see @C{convertPhotos}
+        """
+        if self.decodeonce:
+            files = ', '.join(fn_out for fn_out, args, key, fp in outputs)
+            log.info('converting to %s' % files)
+            try :
+                self.fm.convertMulti(fn_in, [(temporary(fn_out), args)
+                    for fn_out, args, key, fp in outputs])
+                return outputs
+            except OSError, ex:
+                log.error('failed conversion %s: %s' % (files, ex))
+                return []
+
+        converted = []
+        for output in outputs:
+            fn_out, args, key, fp = output
             log.info('converting to %s' % fn_out)
             try :
-                # get conversion parameters
-                pt = 'image'
-                if photo_type is not None:
-                    pt = photo_type
-                assert pt in self.convert_args
-                args = self.convert_args[pt]
-
-                self.fm.convert(photo.filename, fn_out, args)
+                self.fm.convert(fn_in, temporary(fn_out), args)
+                converted.append(output)
             except OSError, ex:
                 log.error('failed conversion %s: %s' % (fn_out, ex))
+        return converted
+
+
+    def converted(self, outputs):
+        """
+        Record fingerprints of converted photos.
+
+        @param outputs: list of converted output photos
+        """
+        for fn_out, args, key, fp in outputs:
+            self.state.set(key, fp)
 
 
     def generatePhoto(self, photo, photo_type=None):
         """
         Generate photo page.
         """
-        fn = self.getAlbumFile(photo.album,
-            self.getPhotoFile(photo, photo_type))
+        fn = self.getPhotoFile(photo, photo_type)
+        self.writePage('%s/%s' % (photo.album.dir, fn),
+                'photo page %s.%s' % (photo.name, photo_type),
+                self.tmpl.photoData(photo), self.tmpl.photoPage, photo)
+
+
+    def writePage(self, key, title, data, render, *args):
+        """
+        Render gallery page if it is not up to date.
+
+        Page is up to date if it exists and its data and gallery template
+        did not change since the page was written. Pages of template,
+        which uses item attributes not in page data, are always rendered.
+        Rendered page is written only if its content changed.
+
+        @param key:    page filename relative to output directory
+        @param title:  page title used in log messages, i.e. 'index page'
+        @param data:   page data, see @C{Template.galleryData}
+        @param render: template method rendering the page
+        @param args:   rendering method arguments
+        """
+        fn = os.path.normpath('%s/%s' % (self.outdir, key))
+        fp = sha1(repr((self.tmplfp, data))).hexdigest()
+
+        # page state is page data fingerprint and rendered page checksum,
+        # previous versions of Danlann recorded the fingerprint only
+        state = None
+        if os.path.exists(fn):
+            state = self.pages.get(key)
+            if not isinstance(state, tuple):
+                state = (state, None)
+
+        if state is not None and state[0] == fp and self.tmpl.complete():
+            log.debug('leaving intact %s' % fn)
+            self.unchanged += 1
+            return
+
+        checksum = state and state[1]
+        if self.renderer is not None:
+            # page is written by page rendering process
+            self.batch.append((key, title, fn, fp, checksum, render.__name__,
+                data))
+            if len(self.batch) >= RENDER_BATCH:
+                self.flushPages()
+            return
+
+        rendered = renderPage(fn, checksum, render, *args)
+        self.pageRendered(key, title, fn, fp, checksum, rendered)
+
+
+    def pageRendered(self, key, title, fn, fp, checksum, rendered):
+        """
+        Record state of rendered page and schedule reformatting of the
+        page if it was written.
+
+        @param key:      page filename relative to output directory
+        @param title:    page title used in log messages
+        @param fn:       page filename
+        @param fp:       page data fingerprint
+        @param checksum: checksum of page rendered previously
+        @param rendered: checksum of rendered page content
+        """
+        self.pages.set(key, (fp, rendered))
+        if rendered == checksum:
+            log.debug('page not changed %s' % fn)
+            self.unchanged += 1
+            return
 
-        f = codecs.open(fn, 'w', encoding='utf-8')
-        self.tmpl.photoPage(f, photo)
-        f.close()
+        log.info('generated %s' % title)
+        self.written.append(fn)
+        if self.scheduler is not None:
+            self.scheduler.add(self.formatPage, (fn,), worker = True)
 
-        log.info('generated photo page %s.%s' % (photo.name, photo_type))
+
+    def flushPages(self, block = False):
+        """
+        Send batch of pages to page rendering processes and process pages
+        rendered so far in order of sending.
+
+        If a page rendering process failed, then its exception is raised.
+
+        @param block: wait for all sent pages if true
+        """
+        if self.batch:
+            pages = [(fn, checksum, render, data)
+                    for key, title, fn, fp, checksum, render, data
+                    in self.batch]
+            result = self.renderer.apply_async(renderPages, (pages,))
+            self.rendering.append((result, self.batch))
+            self.batch = []
+
+        while self.rendering:
+            result, batch = self.rendering[0]
+            if not block and not result.ready():
+                break
+            checksums = result.get()
+            del self.rendering[0]
+
+            for page, rendered in zip(batch, checksums):
+                key, title, fn, fp, checksum, render, data = page
+                self.pageRendered(key, title, fn, fp, checksum, rendered)
+
+
+    def formatPage(self, fn):
+        """
+        Reformat written page and validate it if requested.
+
+        @param fn: page filename
+        """
+        self.fm.formatXML(fn)
+        if self.validate:
+            log.info('validating file: %s' % fn)
+            if not self.fm.validate(fn):
+                log.error('validating failed: %s' % fn)
 
@@ -24,14 +24,29 @@ Use interpreter function to get Danlann album file interpreter. Then load
 function should be used to parse album files and check function should be
 used to check consistency of data model.
 
-DanlannScanner is used to create list of tokens. DanlannParser creates list
-of nodes using token information. Danlann interpreter uses list of nodes
-to create gallery data model.
+Every interpreter owns its parsing engine and position in parsed album
+file, so many album files can be parsed at the same time, i.e. by many
+threads, using different interpreters.
+
+Album files can be parsed into node streams by many processes with
+loadMulti function. Node streams are replayed into interpreter in order of
+album files, so created gallery and reported errors are the same as when
+album files are loaded one after another. Node streams can be cached, so
+only changed album files are parsed again.
+
+Two parsing engines are available. The default, fast engine
+(DanlannLineParser) matches every line with a single regular expression.
+The SPARK engine is a reference implementation, where DanlannScanner is
+used to create list of tokens and DanlannParser creates list of nodes
+using token information. Both engines create the same nodes. Danlann
+interpreter uses list of nodes to create gallery data model.
 
 @see danlann.bc
 @see danlann.test.parser
 """
 import os
+import re
+import codecs
 from spark import GenericScanner, GenericParser, GenericASTTraversal
 
 from danlann.bc import Gallery, Album, Photo
@@ -40,6 +55,29 @@ from danlann.bc import Gallery, Album, Photo
 FILE, DIR, STRING, COMMENT, SLASH, SEMICOLON, EMPTY = \
         'FILE', 'DIR', 'STRING', 'COMMENT', 'SLASH', 'SEMICOLON', 'EMPTY'
 
+class Position(object):
+    """
+    Position in parsed album file used for error reporting.
+
+    @ivar filename: name of parsed album file
+    @ivar lineno:   number of parsed line
+    """
+    def __init__(self):
+        super(Position, self).__init__()
+        self.filename = None
+        self.lineno   = None
+
+
+    def error(self, message):
+        """
+        Create parse error at current position.
+
+        @param message: error message
+        """
+        return ParseError(message, self.filename, self.lineno)
+
+
+
 class Token(object):
     """
     Token class with type and value.
@@ -83,7 +121,16 @@ class Node(list):
 class DanlannScanner(GenericScanner):
     """
     Danlann album file scanner.
+
+    @ivar position: position in parsed album file
     """
+    def __init__(self, position = None):
+        GenericScanner.__init__(self)
+        if position is None:
+            position = Position()
+        self.position = position
+
+
     def tokenize(self, line):
         """
         Create tokens from string.
@@ -139,16 +186,14 @@ class DanlannScanner(GenericScanner):
 
     def t_default(self, value):
         r'(.|\n)+'
-        global filename, lineno
-        if 'filename' in globals() and 'lineno' in globals():
-            raise ParseError('syntax error', filename, lineno)
+        if self.position.filename is not None:
+            raise self.position.error('syntax error')
         else:
             raise ParseError('syntax error, invalid token %s' % value)
 
 
     def error(self, value, pos):
-        global filename, lineno
-        raise ParseError('syntax error', filename, lineno)
+        raise self.position.error('syntax error')
 
 
 
@@ -156,14 +201,18 @@ class DanlannScanner(GenericScanner):
 class DanlannParser(GenericParser):
     """
     Danlann album file parser.
+
+    @ivar position: position in parsed album file
     """
-    def __init__(self):
+    def __init__(self, position = None):
         GenericParser.__init__(self, 'expr')
+        if position is None:
+            position = Position()
+        self.position = position
 
 
     def error(self, token):
-        global filename, lineno
-        raise ParseError('syntax error', filename, lineno)
+        raise self.position.error('syntax error')
 
 
     def p_expr(self, args):
@@ -225,21 +274,80 @@ class DanlannParser(GenericParser):
 
 
 
+class DanlannLineParser(object):
+    """
+    Fast Danlann album file parser.
+
+    Every line is matched with one regular expression, which accepts the
+    same lines as DanlannScanner and DanlannParser do. Note, that SPARK
+    scanner uses verbose regular expressions, so space after semicolon
+    is optional.
+
+    @ivar position: position in parsed album file
+    """
+    LINE = re.compile(r'''
+        (?:
+            (?P<comment>\#.*)
+          | /(?P<dir>[A-Za-z0-9_\-/]+)
+                (?:;(?P<atitle>[^;]+)(?:;(?P<adesc>[^;]+))?)?
+          | (?P<file>[A-Za-z0-9_\-]+)
+                (?:;(?P<ptitle>[^;]+)(?:;(?P<pdesc>[^;]+))?)?
+          | (?P<empty>\s+)
+        )\Z
+    ''', re.VERBOSE)
+
+    def __init__(self, position = None):
+        super(DanlannLineParser, self).__init__()
+        if position is None:
+            position = Position()
+        self.position = position
+
+
+    def parse(self, line):
+        """
+        Parse a line and return node.
+
+        @param line: string to parse
+        """
+        m = self.LINE.match(line)
+        if m is None:
+            raise self.position.error('syntax error')
+
+        dir, file = m.group('dir', 'file')
+        if dir is not None:
+            title, desc = m.group('atitle', 'adesc')
+            if title is None:
+                return Node('subalbum', [dir])
+            return Node('album', [dir, title.strip(), (desc or '').strip()])
+        elif file is not None:
+            title, desc = m.group('ptitle', 'pdesc')
+            return Node('photo',
+                    [file, (title or '').strip(), (desc or '').strip()])
+        elif m.group('comment') is not None:
+            return Node('comment')
+        else:
+            return Node('empty')
+
+
 class DanlannInterpret(GenericASTTraversal):
     """
     Danlann album file interpreter. Create gallery albums and photos objects.
 
     @ivar gallery:    gallery object
+    @ivar position:   position in parsed album file
     @ivar album:      current album
     @ivar references: album references
     @ivar store:      gallery albums
+    @ivar nested:     directories of defined albums, which are subalbums
     """
     def __init__(self, gallery):
         self.gallery    = gallery
+        self.position   = Position()
 
         self.album      = None
         self.references = {}
         self.store      = {}
+        self.nested     = set()
 
         GenericASTTraversal.__init__(self, None)
 
@@ -255,14 +363,12 @@ class DanlannInterpret(GenericASTTraversal):
         """
         Create album. Set current album.
         """
-        global filename, lineno
-
         album = self.get_album(node)
         self.album = album
 
         if album.dir in self.store:
-            raise ParseError('album "%s" already defined' % album.dir, \
-                    filename, lineno)
+            raise self.position.error('album "%s" already defined' \
+                    % album.dir)
 
         album.title = node.data[1]
         album.description = node.data[2]
@@ -271,6 +377,10 @@ class DanlannInterpret(GenericASTTraversal):
         # see n_subalbum method 
         if album.dir in self.references:
             del self.references[album.dir]
+        else:
+            # album, which is not referenced yet, is root album by
+            # default; root albums are resolved by check function
+            self.gallery.subalbums.append(album)
 
         # store new album
         self.store[album.dir] = album
@@ -287,11 +397,11 @@ class DanlannInterpret(GenericASTTraversal):
         # creates the album
         if subalbum.dir not in self.store:
             self.references[subalbum.dir] = subalbum
+        else:
+            # subalbum cannot be root album, it is removed from gallery
+            # root albums by check function
+            self.nested.add(subalbum.dir)
         self.album.subalbums.append(subalbum)
-
-        # subalbum cannot be root album
-        if subalbum in self.gallery.subalbums:
-            self.gallery.subalbums.remove(subalbum)
         return subalbum
 
 
@@ -308,9 +418,8 @@ class DanlannInterpret(GenericASTTraversal):
         photo.gallery     = self.gallery
 
         if not self.album:
-            global filename, lineno
-            raise ParseError('photo %s cannot exist' \
-                    ' without album' % photo.name, filename, lineno)
+            raise self.position.error('photo %s cannot exist' \
+                    ' without album' % photo.name)
         self.album.photos.append(photo)
 
 
@@ -344,11 +453,6 @@ class DanlannInterpret(GenericASTTraversal):
             album = Album()
             album.dir = dir
             album.gallery = self.gallery
-
-            # add every album to root albums by default;
-            # n_subalbum method removes an album from gallery subalbums
-            # if an album becomes subalbum
-            self.gallery.subalbums.append(album)
         return album
 
 
@@ -372,28 +476,66 @@ class ParseError(Exception):
 
 
 
-def interpreter(gallery):
+# album file parsing engines
+ENGINES = ('fast', 'spark')
+
+# version of parser, change it when node streams of album files change
+VERSION = 2
+
+def interpreter(gallery, engine = 'fast'):
     """
     Get Danlann album file interpreter.
+
+    @param gallery: gallery object
+    @param engine:  album file parsing engine, see @C{ENGINES}
     """
+    if engine not in ENGINES:
+        raise ValueError('unknown album file parser %s' % engine)
+
     interpreter = DanlannInterpret(gallery)
-    interpreter.scanner = DanlannScanner()
-    interpreter.parser = DanlannParser()
+    interpreter.engine = engine
+    interpreter.scanner = DanlannScanner(interpreter.position)
+    interpreter.parser = DanlannParser(interpreter.position)
+    interpreter.lineparser = DanlannLineParser(interpreter.position)
     return interpreter
 
 
+def parse(interpreter, line):
+    """
+    Parse a line of album file with interpreter parsing engine and return
+    node.
+
+    @param interpreter: Danlann album file interpreter
+    @param line:        string to parse
+    """
+    if interpreter.engine == 'spark':
+        tokens = interpreter.scanner.tokenize(line)
+        return interpreter.parser.parse(tokens)
+    else:
+        return interpreter.lineparser.parse(line)
+
+
 def check(interpreter, gallery):
     """
     Check if gallery is build in appropriate way:
       - there should be at least on root album
       - every album should one or more subalbums or photos
       - there should be no false references to albums
+
+    Albums, which became subalbums after their definition, are removed
+    from gallery root albums before the checks. Order of root albums is
+    order of their definition.
     """
     def check_album(album):
         if len(album.subalbums) == 0 and len(album.photos) == 0:
             raise ParseError('album "%s" contains no subalbums nor photos'
                 % album.dir)
 
+    if interpreter.nested:
+        gallery.subalbums[:] = [album for album in gallery.subalbums
+                if album.dir not in interpreter.nested]
+        interpreter.nested.clear()
+
     if len(interpreter.references) > 0:
         raise ParseError('unresolved album references found: %s'
             % ', '.join(dir for dir in interpreter.references))
@@ -412,13 +554,125 @@ def load(f, interpreter):
     @param f:           album file
     @param interpreter: Danlann album file interpreter
     """
-    global lineno, filename
+    position = interpreter.position
+    position.filename = f.name
+    position.lineno = 0
+    for line in f:
+        line = line.strip()
+        position.lineno += 1
+        if line:
+            ast = parse(interpreter, line)
+            interpreter.generate(ast)
+
+
+def stream(f, engine = 'fast'):
+    """
+    Parse album file into node stream.
+
+    Node stream is list of line number, node type and node data tuples.
+    Empty and comment lines are not included. If a line cannot be parsed,
+    then the last tuple contains None as node type and error message as
+    node data.
+
+    @param f:      album file
+    @param engine: album file parsing engine, see @C{ENGINES}
+    """
+    nodes = []
+    interp = interpreter(None, engine)
+    # parsing engines report errors depending on album filename
+    interp.position.filename = f.name
     lineno = 0
-    filename = f.name
     for line in f:
         line = line.strip()
         lineno += 1
         if line:
-            tokens = interpreter.scanner.tokenize(line)
-            ast = interpreter.parser.parse(tokens)
-            interpreter.generate(ast)
+            try:
+                node = parse(interp, line)
+            except ParseError, ex:
+                nodes.append((lineno, None, ex.message))
+                break
+            if node.type not in ('empty', 'comment'):
+                nodes.append((lineno, node.type, node.data))
+    return nodes
+
+
+def streamFile(args):
+    """
+    Parse album file with given name into node stream.
+
+    The function is called by parsing processes.
+
+    @param args: album filename and parsing engine pair
+    """
+    fn, engine = args
+    f = codecs.open(fn, encoding = 'utf-8')
+    try:
+        return stream(f, engine)
+    finally:
+        f.close()
+
+
+def replay(interpreter, filename, nodes):
+    """
+    Replay node stream of album file into interpreter.
+
+    @param interpreter: Danlann album file interpreter
+    @param filename:    album filename
+    @param nodes:       node stream, see @C{stream}
+    """
+    position = interpreter.position
+    position.filename = filename
+    for lineno, type, data in nodes:
+        position.lineno = lineno
+        if type is None:
+            raise position.error(data)
+        interpreter.generate(Node(type, data))
+
+
+def loadMulti(files, interpreter, jobs, cache = None):
+    """
+    Load album files parsing them with many processes.
+
+    Album files are parsed into node streams by a pool of processes,
+    then node streams are replayed into interpreter in order of album
+    files. If multiprocessing module is not available, then album files
+    are parsed one after another.
+
+    If node streams cache is used, then only album files, which node
+    streams are not cached, are parsed.
+
+    @param files:       list of album filenames
+    @param interpreter: Danlann album file interpreter
+    @param jobs:        amount of parsing processes
+    @param cache:       node streams cache, i.e. StreamCache instance
+    """
+    version = '%d:%s' % (VERSION, interpreter.engine)
+    streams = [None] * len(files)
+    if cache is not None:
+        for i, fn in enumerate(files):
+            streams[i] = cache.fetch(fn, version)
+
+    changed = [i for i, nodes in enumerate(streams) if nodes is None]
+    args = [(files[i], interpreter.engine) for i in changed]
+    try:
+        import multiprocessing
+    except ImportError:
+        multiprocessing = None
+
+    if multiprocessing is None or jobs < 2 or len(args) < 2:
+        parsed = map(streamFile, args)
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(args)))
+        try:
+            parsed = pool.map(streamFile, args)
+        finally:
+            pool.close()
+            pool.join()
+
+    for i, nodes in zip(changed, parsed):
+        streams[i] = nodes
+        if cache is not None:
+            cache.store(files[i], version, nodes)
+
+    for fn, nodes in zip(files, streams):
+        replay(interpreter, fn, nodes)
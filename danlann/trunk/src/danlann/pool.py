@@ -0,0 +1,278 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Worker pool used to run photo conversions in parallel.
+
+Jobs are executed by worker threads. Conversion jobs spend most of their
+time waiting for external programs, so threads are sufficient to keep all
+processors busy.
+
+Log records emitted by a job are deferred and replayed in the order of
+job submission, so log output is the same as for sequential processing.
+
+@see danlann.generator
+"""
+
+import sys
+import threading
+import Queue
+from collections import deque
+
+import logging
+log = logging.getLogger('danlann.pool')
+
+
+class Job(object):
+    """
+    Pool job.
+
+    @ivar func:     function to be called
+    @ivar args:     function arguments
+    @ivar callback: function called with job result
+    @ivar result:   value returned by job function
+    @ivar records:  log records emitted while job was running
+    @ivar error:    exception information if job failed
+    @ivar done:     event set when job is finished
+    """
+    def __init__(self, func, args, callback):
+        self.func     = func
+        self.args     = args
+        self.callback = callback
+        self.result   = None
+        self.records  = []
+        self.error    = None
+        self.done     = threading.Event()
+
+
+    def run(self):
+        """
+        Run the job storing exception information on failure.
+        """
+        try:
+            self.result = self.func(*self.args)
+        except:
+            self.error = sys.exc_info()
+        self.done.set()
+
+
+
+class LogBuffer(logging.Filter):
+    """
+    Logging filter deferring log records emitted by pool workers.
+
+    Records emitted by a worker thread are stored in the job being
+    executed. Records emitted by other threads are passed through.
+
+    @ivar local: thread local data with currently executed job
+    """
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.local = threading.local()
+
+
+    def filter(self, record):
+        job = getattr(self.local, 'job', None)
+        if job is None:
+            return True
+        job.records.append(record)
+        return False
+
+
+
+class WorkerPool(object):
+    """
+    Pool of worker threads.
+
+    If amount of jobs is 1, then no threads are started and all jobs are
+    executed immediately on submission.
+
+    On first job failure, pool stops executing queued jobs and the
+    exception is raised in the thread processing results.
+
+    @ivar jobs:     amount of worker threads
+    @ivar loggers:  names of logger hierarchies, which records are deferred
+    @ivar filtered: loggers deferring records while workers are running
+    @ivar queue:    queue of jobs to be executed by workers
+    @ivar pending:  submitted jobs, which results were not processed yet
+    @ivar workers:  worker threads
+    @ivar stopped:  true if pool does not execute queued jobs anymore
+    @ivar buffer:   logging filter deferring job log records
+    """
+    def __init__(self, jobs, loggers = ()):
+        """
+        Create worker pool.
+
+        @param jobs:    amount of worker threads
+        @param loggers: names of logger hierarchies used by jobs, i.e.
+            records of danlann.backend logger are deferred for danlann
+            hierarchy
+        """
+        super(WorkerPool, self).__init__()
+        self.jobs     = jobs
+        self.loggers  = loggers
+        self.filtered = []
+        self.queue    = Queue.Queue(jobs * 4)
+        self.pending  = deque()
+        self.workers  = []
+        self.stopped  = False
+        self.buffer   = LogBuffer()
+
+
+    def start(self):
+        """
+        Start worker threads.
+        """
+        if self.jobs < 2:
+            return
+
+        # filters are not applied to records propagated from child
+        # loggers, so every logger of a hierarchy is filtered
+        names = logging.Logger.manager.loggerDict.keys()
+        for name in self.loggers:
+            self.filtered.append(logging.getLogger(name))
+            self.filtered.extend(logging.getLogger(n) for n in names
+                    if n.startswith(name + '.'))
+        for logger in self.filtered:
+            logger.addFilter(self.buffer)
+
+        for i in range(self.jobs):
+            worker = threading.Thread(target = self.work,
+                    name = 'danlann-worker-%d' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+        log.debug('started %d workers' % self.jobs)
+
+
+    def work(self):
+        """
+        Worker thread main loop.
+        """
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            if self.stopped:
+                # do not start new jobs when pool failed or is closed
+                job.done.set()
+                continue
+
+            self.buffer.local.job = job
+            try:
+                job.run()
+            finally:
+                self.buffer.local.job = None
+
+            if job.error:
+                self.stopped = True
+
+
+    def submit(self, func, args = (), callback = None):
+        """
+        Submit a job to the pool.
+
+        Results of already finished jobs are processed, which can raise
+        exception of a failed job.
+
+        Callback is called with job function result in the thread
+        submitting jobs, in order of job submission.
+
+        @param func:     function to be called by a worker
+        @param args:     function arguments
+        @param callback: function called with job result
+        """
+        if not self.workers:
+            result = func(*args)
+            if callback is not None:
+                callback(result)
+            return
+
+        job = Job(func, args, callback)
+        self.pending.append(job)
+        self.flush()
+        self.queue.put(job)
+
+
+    def busy(self):
+        """
+        Check if submitting a job would wait for a worker to take one of
+        queued jobs.
+        """
+        return bool(self.workers) and self.queue.full()
+
+
+    def flush(self, block = False):
+        """
+        Process results of finished jobs in order of job submission.
+
+        Deferred log records are emitted and job callbacks are called. If
+        a job failed, then the pool is closed and job exception is
+        raised.
+
+        @param block: wait for all submitted jobs if true
+        """
+        while self.pending:
+            job = self.pending[0]
+            if block:
+                job.done.wait()
+            elif not job.done.isSet():
+                break
+
+            self.pending.popleft()
+
+            for record in job.records:
+                logging.getLogger(record.name).handle(record)
+
+            if job.error:
+                self.close()
+                raise job.error[0], job.error[1], job.error[2]
+
+            if job.callback is not None:
+                job.callback(job.result)
+
+
+    def join(self):
+        """
+        Wait for all submitted jobs and process their results.
+        """
+        self.flush(True)
+
+
+    def close(self):
+        """
+        Stop worker threads.
+
+        Jobs, which are not started yet, are discarded.
+        """
+        if not self.workers:
+            return
+
+        self.stopped = True
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+        for logger in self.filtered:
+            logger.removeFilter(self.buffer)
+        self.filtered = []
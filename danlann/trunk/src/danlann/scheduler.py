@@ -0,0 +1,205 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Scheduler of gallery generation tasks.
+
+Gallery generation is a graph of tasks, i.e. photo EXIF page is written
+when album photos EXIF data is read. A task is executed when all tasks it
+depends on are finished, so i.e. pages are written while photos are
+converted.
+
+Worker tasks, i.e. photo conversion or EXIF reading, are executed by
+worker pool. Other tasks, i.e. page rendering or persistent stores
+updates, are executed by the thread running the scheduler.
+
+@see danlann.pool
+"""
+
+import Queue
+from collections import deque
+
+
+class Task(object):
+    """
+    Scheduler task.
+
+    @ivar func:       function to be called
+    @ivar args:       function arguments
+    @ivar worker:     task is executed by worker pool if true
+    @ivar callback:   function called with task result by scheduler
+                      thread
+    @ivar deps:       amount of unfinished tasks the task depends on
+    @ivar dependents: tasks depending on the task
+    @ivar result:     value returned by task function
+    @ivar failed:     true if task function raised an exception
+    """
+    def __init__(self, func, args, worker, callback):
+        super(Task, self).__init__()
+        self.func       = func
+        self.args       = args
+        self.worker     = worker
+        self.callback   = callback
+        self.deps       = 0
+        self.dependents = []
+        self.result     = None
+        self.failed     = False
+
+
+
+class Scheduler(object):
+    """
+    Scheduler of task graph.
+
+    Tasks can be added while the scheduler is running, i.e. by task
+    functions executed by scheduler thread.
+
+    Worker tasks are submitted to the worker pool while it can accept
+    jobs without waiting, then tasks of scheduler thread are executed.
+    Task dependents are scheduled in order of tasks completion.
+
+    @ivar pool:     worker pool
+    @ivar workers:  ready worker tasks
+    @ivar local:    ready scheduler thread tasks
+    @ivar finished: queue of finished worker tasks
+    @ivar running:  amount of submitted, unfinished worker tasks
+    @ivar pending:  amount of unfinished tasks
+    """
+    def __init__(self, pool):
+        """
+        Create scheduler.
+
+        @param pool: worker pool executing worker tasks
+        """
+        super(Scheduler, self).__init__()
+        self.pool     = pool
+        self.workers  = deque()
+        self.local    = deque()
+        self.finished = Queue.Queue()
+        self.running  = 0
+        self.pending  = 0
+
+
+    def add(self, func, args = (), deps = (), worker = False,
+            callback = None):
+        """
+        Add task to the scheduler.
+
+        @param func:     function to be called
+        @param args:     function arguments
+        @param deps:     tasks the task depends on, None values are
+                         ignored
+        @param worker:   task is executed by worker pool if true
+        @param callback: function called with task result by scheduler
+                         thread
+
+        @return the task
+        """
+        task = Task(func, args, worker, callback)
+        for dep in deps:
+            if dep is not None:
+                task.deps += 1
+                dep.dependents.append(task)
+
+        self.pending += 1
+        if task.deps == 0:
+            self.ready(task)
+        return task
+
+
+    def ready(self, task):
+        """
+        Queue task, which dependencies are finished.
+        """
+        if task.worker:
+            self.workers.append(task)
+        else:
+            self.local.append(task)
+
+
+    def execute(self, task):
+        """
+        Execute worker task. The method is called by worker pool.
+        """
+        try:
+            try:
+                task.result = task.func(*task.args)
+            except:
+                task.failed = True
+                raise
+        finally:
+            self.finished.put(task)
+
+
+    def finish(self, task):
+        """
+        Finish task, call its callback and queue its dependents.
+        """
+        self.pending -= 1
+        if task.callback is not None:
+            task.callback(task.result)
+
+        for dep in task.dependents:
+            dep.deps -= 1
+            if dep.deps == 0:
+                self.ready(dep)
+
+
+    def collect(self, block):
+        """
+        Finish worker tasks executed by worker pool.
+
+        If a worker task failed, then worker pool exception is raised.
+
+        @param block: wait for at least one finished task if true
+        """
+        while self.running:
+            try:
+                task = self.finished.get(block)
+            except Queue.Empty:
+                break
+            block = False
+
+            self.running -= 1
+            if task.failed:
+                # raise exception of failed task
+                self.pool.join()
+            self.finish(task)
+
+
+    def run(self):
+        """
+        Execute all tasks.
+        """
+        while True:
+            self.collect(False)
+            if not self.pending:
+                break
+
+            if self.workers and (not self.local or not self.pool.busy()):
+                task = self.workers.popleft()
+                self.running += 1
+                self.pool.submit(self.execute, (task,))
+            elif self.local:
+                task = self.local.popleft()
+                task.result = task.func(*task.args)
+                self.finish(task)
+            else:
+                assert self.running, 'tasks with unfinished dependencies'
+                self.collect(True)
@@ -17,56 +17,158 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
 import re
+from hashlib import sha1
 
 import stringtemplate3 as stringtemplate
 
-from danlann.bc import Gallery, Album, Photo
+from danlann.bc import Gallery, Album, Photo, Exif
+from danlann.cache import digest
+from danlann.compiler import TemplateGroup, Page
 import danlann.config
 
+# template rendering engines
+ENGINES = ('stringtemplate', 'compiled')
+
+# amount of strings converted by XML renderer kept in its memo
+MEMO_SIZE = 4096
+
+
+def itemData(item):
+    """
+    Get data of gallery, album or photo, which can be shown on a page.
+
+    None is returned if there is no item.
+
+    @param item: gallery, album, photo or None
+    """
+    if item is None:
+        return None
+    elif isinstance(item, Photo):
+        return (item.name, item.title, item.description)
+    elif isinstance(item, Album):
+        return (item.dir, item.title, item.description)
+    else:
+        return (item.title, item.description)
+
+
+def treeData(album):
+    """
+    Get data of album and all its subalbums.
+
+    @param album: album
+    """
+    return (itemData(album), [treeData(a) for a in album.subalbums])
+
+
+def albumItem(data):
+    """
+    Create album from album data.
+
+    @param data: album data, see @C{itemData}
+    """
+    album = Album()
+    album.dir, album.title, album.description = data
+    return album
+
+
+def photoItem(data, album = None):
+    """
+    Create photo from photo data.
+
+    @param data: photo data, see @C{itemData}
+    @param album: album containing the photo
+    """
+    photo = Photo()
+    photo.name, photo.title, photo.description = data
+    photo.album = album
+    return photo
+
+
+def treeItem(data):
+    """
+    Create album and all its subalbums from album tree data.
+
+    @param data: album tree data, see @C{treeData}
+    """
+    album = albumItem(data[0])
+    album.subalbums = [treeItem(t) for t in data[1]]
+    return album
+
+
+def neighbours(item, prev, next):
+    """
+    Get list of item and its previous and next items, so previous and next
+    item can be found with album or gallery navigation methods.
+    """
+    return [o for o in (prev, item, next) if o is not None]
+
+
 class Template(object):
     """
     A template.
 
     @ivar gallery: gallery reference
+    @ivar override: directory overriding template
     @ivar copyright: copyright text
-    @ivar st_group: StringTemplate reference
+    @ivar engine: template rendering engine
+    @ivar st_group: StringTemplate reference or group of compiled
+                    templates
     @ivar css: list of css files
     @ivar js: list of javascript files
     """
-    def __init__(self, name, gallery, override=None):
+    def __init__(self, name, gallery, override=None, engine='stringtemplate'):
         """
         Create new instance of a template with gallery instance reference.
 
         @param name: template name
         @param gallery: gallery reference
         @param override: directory overriding template 
+        @param engine: template rendering engine, see @C{ENGINES}
         """
         super(Template, self).__init__()
+        if engine not in ENGINES:
+            raise ValueError('unknown template engine %s' % engine)
+
         self.name = name
         self.gallery = gallery
+        self.override = override
+        self.engine = engine
 
         self.css = ['css/danlann.css']
         self.js = ['js/jquery.js', 'js/danlann.js']
         self.copyright = ''
 
+        # one renderer is used, so a string is converted once for all
+        # pages
+        renderer = XMLRenderer()
+
         st_group = stringtemplate.StringTemplateGroup('basic',
                 '%s/tmpl' % danlann.config.libpath)
-        st_group.registerRenderer(str, XMLRenderer());
-        st_group.registerRenderer(unicode, XMLRenderer());
+        st_group.registerRenderer(str, renderer);
+        st_group.registerRenderer(unicode, renderer);
 
         # set template override if defined
         # template override is realized with StringTemplate
         # supergroup/subgroup functionality
         if override:
             self.st_group = stringtemplate.StringTemplateGroup(name, override)
-            self.st_group.registerRenderer(str, XMLRenderer());
-            self.st_group.registerRenderer(unicode, XMLRenderer());
+            self.st_group.registerRenderer(str, renderer);
+            self.st_group.registerRenderer(unicode, renderer);
 
             self.st_group.superGroup = st_group
         else:
             self.st_group = st_group # no override
 
+        # templates are compiled into Python functions, pages using
+        # syntax not supported by the compiler are rendered with
+        # StringTemplate
+        if engine == 'compiled':
+            dirs = self.dirs()
+            dirs.reverse()
+            self.st_group = TemplateGroup(dirs, renderer, self.st_group)
+
         self.tmpl_gallery = '%s/gallery' % self.name
         self.tmpl_page    = '%s/page' % self.name
         self.tmpl_album   = '%s/album' % self.name
@@ -95,14 +197,176 @@ class Template(object):
         return page
 
 
+    def dirs(self):
+        """
+        Get list of template directories.
+        """
+        dirs = ['%s/tmpl' % danlann.config.libpath]
+        if self.override:
+            dirs.append(self.override)
+        return dirs
+
+
+    def fingerprint(self):
+        """
+        Get fingerprint of template.
+
+        The fingerprint is built of template configuration, gallery
+        title and description, which are shown on all pages, and content
+        of template files.
+        """
+        data = [self.name, self.copyright, self.css, self.js,
+                itemData(self.gallery)]
+
+        for path in self.dirs():
+            for dir, subdirs, files in os.walk(path):
+                subdirs.sort()
+                for fn in sorted(files):
+                    if fn.endswith('.st'):
+                        fn = os.path.join(dir, fn)
+                        data.append((fn[len(path):], digest(fn)))
+
+        return sha1(repr(data)).hexdigest()
+
+
+    def __getstate__(self):
+        """
+        Get template state sent to page rendering process.
+
+        Only gallery title and description are sent, gallery items are
+        recreated by rendering process from page data.
+        """
+        return (self.name, itemData(self.gallery), self.override,
+                self.engine, self.copyright, self.css, self.js)
+
+
+    def __setstate__(self, state):
+        """
+        Create template in page rendering process.
+        """
+        name, gallery, override, engine, copyright, css, js = state
+        self.__init__(name, Gallery(*gallery), override, engine)
+        self.copyright = copyright
+        self.css = css
+        self.js = js
+
+
+    def complete(self):
+        """
+        Check if page data contains all item attributes used by the
+        template.
+
+        Page data is built for templates distributed with Danlann.
+        Templates in override directory can use any attribute of gallery
+        items, i.e. photo EXIF on photo page, which is not in page data.
+        """
+        return not self.override
+
+
+    def galleryData(self):
+        """
+        Get data shown on gallery page.
+
+        Page data contains all item attributes used by templates
+        distributed with Danlann, so if page data does not change, then
+        generated page does not change.
+
+        @see Template.fingerprint
+        @see Template.complete
+        """
+        return [treeData(album) for album in self.gallery.subalbums]
+
+
+    def albumData(self, album, parent):
+        """
+        Get data shown on album page.
+
+        @see Template.galleryData
+        """
+        return (itemData(album), itemData(parent),
+                itemData(parent.prev(album)), itemData(parent.next(album)),
+                [itemData(a) for a in album.subalbums],
+                [itemData(p) for p in album.photos])
+
+
+    def photoData(self, photo):
+        """
+        Get data shown on photo page.
+
+        @see Template.galleryData
+        """
+        album = photo.album
+        return (itemData(photo), itemData(album),
+                itemData(album.prev(photo)), itemData(album.next(photo)))
+
+
+    def exifData(self, photo):
+        """
+        Get data shown on photo exif page.
+
+        @see Template.galleryData
+        """
+        return (self.photoData(photo),
+                [(e.name, e.value) for e in photo.exif])
+
+
+    def pageItems(self, render, data):
+        """
+        Recreate gallery items shown on a page from page data.
+
+        Arguments of page rendering method are returned, so a page can be
+        rendered without gallery, i.e. by page rendering process. Gallery
+        subalbums are replaced when gallery page items are recreated.
+
+        @param render: name of page rendering method, i.e. albumPage
+        @param data: page data, see @C{Template.galleryData}
+        """
+        if render == 'galleryPage':
+            self.gallery.subalbums = [treeItem(t) for t in data]
+            return ()
+
+        if render == 'albumPage':
+            album, parent, prev, next, subalbums, photos = data
+            album = albumItem(album)
+            album.subalbums = [albumItem(a) for a in subalbums]
+            album.photos = [photoItem(p, album) for p in photos]
+
+            if len(parent) == 2:
+                parent = Gallery(*parent)
+            else:
+                parent = albumItem(parent)
+            parent.subalbums = neighbours(album, prev and albumItem(prev),
+                    next and albumItem(next))
+            return (album, parent)
+
+        exif = []
+        if render == 'exifPage':
+            data, exif = data
+
+        photo, album, prev, next = data
+        album = albumItem(album)
+        photo = photoItem(photo, album)
+        photo.exif = [Exif(name, value) for name, value in exif]
+        album.photos = neighbours(photo, prev and photoItem(prev, album),
+                next and photoItem(next, album))
+        return (photo,)
+
+
     def write(self, f, page):
         """
         Write page template to file.
 
-        @param f: page output file
+        Page is encoded with UTF-8. Pages of compiled templates are
+        streamed into the file.
+
+        @param f: page output binary file
         @param page: page to be saved
         """
-        print >> f, unicode(page)
+        if isinstance(page, Page):
+            page.write(f)
+        else:
+            f.write(unicode(page).encode('utf-8'))
+        f.write('\n')
 
 
     def galleryPage(self, f):
@@ -166,15 +430,50 @@ class XMLRenderer(stringtemplate.AttributeRenderer):
     """
     XML renderer for StringTemplate library to convert special characters
     into XML entities.
+
+    Album titles and descriptions are shown on many pages, so converted
+    strings are memoized. The memo is bounded with two generations of
+    strings. When recent generation is full, it becomes old generation
+    and previous old generation is dropped. A string found in old
+    generation is moved to recent one, so least recently used strings are
+    evicted.
+
+    @ivar link:   regular expression matching links
+    @ivar size:   amount of strings in a memo generation
+    @ivar recent: recently converted strings
+    @ivar old:    strings converted before recent strings
     """
     def __init__(self, *args, **kw):
         super(XMLRenderer, self).__init__(*args, **kw)
         # url starts with http and ends with a printable character or slash
         # <> is not in a link
         self.link = re.compile(r'(\bhttps?://\w[^<>\s]+[\w/])')
+        self.size = MEMO_SIZE
+        self.recent = {}
+        self.old = {}
 
     def toString(self, val, fmt):
         assert val is not None
+        try:
+            return self.recent[val]
+        except KeyError:
+            pass
+
+        text = self.old.get(val)
+        if text is None:
+            text = self.escape(val)
+
+        if len(self.recent) >= self.size:
+            self.old = self.recent
+            self.recent = {}
+        self.recent[val] = text
+        return text
+
+    def escape(self, val):
+        """
+        Convert special characters into XML entities, new lines into
+        C{<br/>} tags and URLs into links.
+        """
         val = val.replace('&', '&amp;')
         val = val.replace('\'', '&apos;')
         val = val.replace('"', '&quot;')
@@ -185,7 +484,8 @@ class XMLRenderer(stringtemplate.AttributeRenderer):
         val = val.replace('\\n', '<br/>')
 
         # support links
-        val = self.link.sub('<a href = \'\\1\'>\\1</a>', val)
+        if 'http' in val:
+            val = self.link.sub('<a href = \'\\1\'>\\1</a>', val)
 
         assert val is not None
         return val
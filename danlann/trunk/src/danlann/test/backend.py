@@ -0,0 +1,334 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Photo conversion backends tests.
+"""
+
+import os
+import errno
+import shutil
+import tempfile
+import unittest
+
+from danlann.backend import CommandBackend, BatchProcess, PILBackend, \
+        VipsBackend, execl, quote, geometry, resize, unsharp
+from danlann.generator import ConversionArguments
+
+
+class ConvertTestCase(unittest.TestCase):
+    """
+    Photo conversion command line tests.
+
+    @ivar cmd: last executed command
+    """
+    def execl(self, args):
+        """
+        Store command instead of executing it.
+        """
+        self.cmd = args
+
+
+    def getBackend(self, graphicsmagick):
+        """
+        Create command backend, which does not execute commands.
+        """
+        backend = CommandBackend(graphicsmagick)
+        backend.execl = self.execl
+        return backend
+
+
+    def testConvert(self):
+        """single output conversion"""
+        backend = self.getBackend(True)
+        backend.convert('a.jpg', 'b.jpg', ['-resize', '10x10'])
+        self.assertEqual(self.cmd,
+            ['gm', 'gm', 'convert', 'a.jpg', '-resize', '10x10', 'b.jpg'])
+
+
+    def testConvertMultiGM(self):
+        """multiple output conversion with GraphicsMagick"""
+        commands = []
+        backend = self.getBackend(True)
+        backend.execl = commands.append
+        backend.convertMulti('a.jpg', [('b.jpg', ['-resize', '20x20']),
+            ('c.jpg', ['-resize', '10x10'])])
+        self.assertEqual(commands, [
+            ['gm', 'gm', 'convert', 'a.jpg', '-resize', '20x20', 'b.jpg'],
+            ['gm', 'gm', 'convert', 'a.jpg', '-resize', '10x10', 'c.jpg']])
+
+
+    def testConvertMultiIM(self):
+        """multiple output conversion with ImageMagick"""
+        backend = self.getBackend(False)
+        backend.convertMulti('a.jpg', [('b.jpg', ['-resize', '20x20']),
+            ('c.jpg', ['-resize', '10x10'])])
+        self.assertEqual(self.cmd,
+            ['convert', 'convert', 'a.jpg',
+                '(', '+clone', '-resize', '20x20', '-write', 'b.jpg',
+                    '+delete', ')',
+                '-resize', '10x10', 'c.jpg'])
+
+
+    def testExecl(self):
+        """command execution"""
+        execl(['true', 'true'])
+        try:
+            execl(['danlann-no-such-command', 'danlann-no-such-command'])
+        except OSError, ex:
+            self.assertEqual(ex.errno, errno.ENOENT)
+        else:
+            self.fail('OSError not raised')
+
+
+    def testDecodeOnce(self):
+        """decoding input file once for several output files"""
+        self.assert_(not self.getBackend(True).decodeonce)
+        self.assert_(self.getBackend(False).decodeonce)
+
+
+    def testConvertMultiSingle(self):
+        """multiple output conversion with one output file"""
+        backend = self.getBackend(True)
+        backend.convertMulti('a.jpg', [('b.jpg', ['-resize', '20x20'])])
+        self.assertEqual(self.cmd,
+            ['gm', 'gm', 'convert', 'a.jpg', '-resize', '20x20', 'b.jpg'])
+
+
+
+# batch process emulator; it fails or crashes on request
+BATCH_CMD = ['sh', '-c', 'while read line; do case "$line" in' \
+    ' *fail*) echo danlann:fail;; *crash*) exit 1;;' \
+    ' *) echo danlann:pass;; esac; done']
+
+class BatchProcessTestCase(unittest.TestCase):
+    """
+    GraphicsMagick batch process tests.
+    """
+    def setUp(self):
+        """
+        Create batch process using batch process emulator.
+        """
+        self.process = BatchProcess(BATCH_CMD)
+
+
+    def tearDown(self):
+        """
+        Stop batch process.
+        """
+        self.process.stop()
+
+
+    def testQuote(self):
+        """command argument quoting"""
+        self.assertEqual(quote('a b'), '"a b"')
+        self.assertEqual(quote('a"b'), '"a\\"b"')
+        self.assertEqual(quote('a\\b'), '"a\\\\b"')
+
+
+    def testExecute(self):
+        """command execution"""
+        self.process.execute(['convert', 'a.jpg', 'b.jpg'])
+        pid = self.process.process.pid
+        self.process.execute(['convert', 'c.jpg', 'd.jpg'])
+
+        # the same process executes all commands
+        self.assertEqual(pid, self.process.process.pid)
+
+
+    def testFailure(self):
+        """command failure"""
+        self.assertRaises(OSError, self.process.execute,
+                ['convert', 'fail.jpg', 'b.jpg'])
+
+        # process still works after command failure
+        self.process.execute(['convert', 'a.jpg', 'b.jpg'])
+
+
+    def testCrash(self):
+        """batch process crash"""
+        self.assertRaises(OSError, self.process.execute,
+                ['convert', 'crash.jpg', 'b.jpg'])
+        self.assert_(self.process.process is None)
+
+        # process is restarted
+        self.process.execute(['convert', 'a.jpg', 'b.jpg'])
+        self.assert_(self.process.process is not None)
+
+
+
+class GeometryTestCase(unittest.TestCase):
+    """
+    GraphicsMagick geometry and unsharp parameters parsing tests.
+    """
+    def testGeometry(self):
+        """geometry parsing"""
+        self.assertEqual(geometry('800x600>'), (800, 600, '>'))
+        self.assertEqual(geometry('800x600'), (800, 600, ''))
+        self.assertEqual(geometry('800'), (800, None, ''))
+        self.assertEqual(geometry('x600'), (None, 600, ''))
+        self.assertEqual(geometry('50%'), (50, None, '%'))
+        self.assertRaises(ValueError, geometry, '800x600+10+10')
+        self.assertRaises(ValueError, geometry, 'x')
+
+
+    def testResize(self):
+        """photo resizing"""
+        self.assertEqual(resize('800x600>', (3008, 2000)), (800, 532))
+        self.assertEqual(resize('800x600>', (2000, 3008)), (399, 600))
+        self.assertEqual(resize('128x128>', (100, 50)), (100, 50))
+        self.assertEqual(resize('128x128', (100, 50)), (128, 64))
+        self.assertEqual(resize('128x128<', (300, 150)), (300, 150))
+        self.assertEqual(resize('128x128!', (300, 150)), (128, 128))
+        self.assertEqual(resize('200', (400, 300)), (200, 150))
+        self.assertEqual(resize('x150', (400, 300)), (200, 150))
+        self.assertEqual(resize('50%', (400, 300)), (200, 150))
+
+
+    def testUnsharp(self):
+        """unsharp parameters parsing"""
+        self.assertEqual(unsharp('0.5x0.5+1.2+0'), (0.5, 0.5, 1.2, 0.0))
+        self.assertEqual(unsharp('2'), (2.0, 2.0, 1.0, 0.05))
+        self.assertEqual(unsharp('0x1+2'), (0.0, 1.0, 2.0, 0.05))
+        self.assertRaises(ValueError, unsharp, 'a')
+
+
+
+class PILBackendTestCase(unittest.TestCase):
+    """
+    Python Imaging Library backend tests.
+
+    Tests are not run if Python Imaging Library is not installed.
+
+    @ivar backend: Python Imaging Library backend
+    @ivar dir:     temporary directory for converted photos
+    """
+    def setUp(self):
+        """
+        Create the backend and temporary directory.
+        """
+        self.backend = PILBackend()
+        self.dir = tempfile.mkdtemp('tmp', 'danlann')
+
+
+    def tearDown(self):
+        """
+        Delete temporary directory.
+        """
+        shutil.rmtree(self.dir)
+
+
+    def testCheckArgs(self):
+        """unsupported conversion arguments"""
+        args = ConversionArguments('800x600>')
+        self.backend.checkArgs(args)
+
+        args.params = '-dither'
+        self.assertRaises(ValueError, self.backend.checkArgs, args)
+
+
+    def testConvert(self):
+        """photo conversion"""
+        try:
+            self.backend.check()
+        except OSError:
+            return
+
+        image = ConversionArguments('80x60>')
+        thumb = ConversionArguments('16x16>')
+        thumb.unsharp = ''
+
+        fn_image = '%s/image.jpg' % self.dir
+        fn_thumb = '%s/thumb.jpg' % self.dir
+        self.backend.convertMulti('examples/in/dsc_0001.jpg',
+                [(fn_image, image), (fn_thumb, thumb)])
+
+        # input photo is 1280x1024
+        img = self.backend.Image.open(fn_image)
+        self.assertEqual(img.size, (75, 60))
+        img = self.backend.Image.open(fn_thumb)
+        self.assertEqual(img.size, (16, 13))
+
+
+
+class VipsBackendTestCase(unittest.TestCase):
+    """
+    libvips backend tests using vips command.
+
+    @ivar backend: libvips backend, which does not execute commands
+    @ivar cmds:    executed commands
+    """
+    def setUp(self):
+        """
+        Create libvips backend using vips command.
+        """
+        self.backend = VipsBackend()
+        self.backend.pyvips = None
+        self.backend.execl = self.execl
+        self.cmds = []
+
+
+    def execl(self, args):
+        """
+        Store command instead of executing it.
+        """
+        self.cmds.append(args)
+
+
+    def testCheckArgs(self):
+        """unsupported conversion arguments"""
+        args = ConversionArguments('800x600>')
+        self.backend.checkArgs(args)
+
+        args.size = '50%'
+        self.assertRaises(ValueError, self.backend.checkArgs, args)
+
+        args.size = '800x600>'
+        args.params = '-dither'
+        self.assertRaises(ValueError, self.backend.checkArgs, args)
+
+
+    def testConvert(self):
+        """photo conversion"""
+        args = ConversionArguments('800x600>')
+        args.unsharp = ''
+        self.backend.convert('a.jpg', 'b.jpg', args)
+        self.assertEqual(self.cmds, [['vips', 'vips', 'thumbnail', 'a.jpg',
+            'b.jpg[Q=90]', '800', '--height', '600', '--size', 'down']])
+
+
+    def testConvertUnsharp(self):
+        """photo conversion with sharpening"""
+        args = ConversionArguments('800')
+        args.unsharp = '0.5x0.5+1.2+0.05'
+        self.backend.convert('a.jpg', 'b.jpg', args)
+
+        thumbnail, sharpen = self.cmds
+        fn_tmp = thumbnail[4]
+        self.assertEqual(thumbnail, ['vips', 'vips', 'thumbnail', 'a.jpg',
+            fn_tmp, '800', '--height', '10000000', '--size', 'both'])
+        self.assertEqual(sharpen, ['vips', 'vips', 'sharpen', fn_tmp,
+            'b.jpg[Q=90]', '--m1', '0', '--m2', '1.2', '--sigma', '0.5',
+            '--x1', '5.0'])
+        self.assert_(not os.path.exists(fn_tmp))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
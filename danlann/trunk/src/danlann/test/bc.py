@@ -0,0 +1,109 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Gallery data model tests.
+"""
+
+import unittest
+
+from danlann.bc import Gallery, Album, Photo
+
+
+class NavigationTestCase(unittest.TestCase):
+    """
+    Previous and next album and photo tests.
+
+    @ivar gallery: gallery with root albums
+    @ivar album:   album with photos
+    """
+    def setUp(self):
+        self.gallery = Gallery('title', 'desc')
+        for i in range(3):
+            album = Album()
+            album.dir = 'a%d' % i
+            self.gallery.subalbums.append(album)
+
+        self.album = self.gallery.subalbums[0]
+        for i in range(4):
+            photo = Photo()
+            photo.name = 'p%d' % i
+            self.album.photos.append(photo)
+
+
+    def names(self, photo):
+        """
+        Get names of previous and next photos.
+        """
+        prev = self.album.prev(photo)
+        next = self.album.next(photo)
+        return prev and prev.name, next and next.name
+
+
+    def testPhotos(self):
+        """previous and next photos"""
+        photos = self.album.photos
+        self.assertEquals(self.names(photos[0]), (None, 'p1'))
+        self.assertEquals(self.names(photos[2]), ('p1', 'p3'))
+        self.assertEquals(self.names(photos[3]), ('p2', None))
+
+
+    def testAlbums(self):
+        """previous and next albums"""
+        a0, a1, a2 = self.gallery.subalbums
+        self.assertEquals(self.gallery.prev(a0), None)
+        self.assertEquals(self.gallery.next(a0), a1)
+        self.assertEquals(self.gallery.prev(a2), a1)
+        self.assertEquals(self.gallery.next(a2), None)
+
+        self.album.subalbums.extend([a1, a2])
+        self.assertEquals(self.album.prev(a2), a1)
+        self.assertEquals(self.album.next(a1), a2)
+
+
+    def testChanges(self):
+        """navigation after changing list of photos"""
+        photos = self.album.photos
+        p0, p1, p2, p3 = photos
+        self.assertEquals(self.names(p2), ('p1', 'p3'))
+
+        photos.remove(p1)
+        self.assertEquals(self.names(p2), ('p0', 'p3'))
+        self.assertEquals(self.names(p3), ('p2', None))
+
+        photos.insert(0, p1)
+        self.assertEquals(self.names(p0), ('p1', 'p2'))
+        self.assertEquals(self.names(p1), (None, 'p0'))
+
+        self.assertRaises(ValueError, self.album.prev, Photo())
+        photos.remove(p3)
+        self.assertRaises(ValueError, self.album.next, p3)
+
+
+    def testSlots(self):
+        """compact model objects"""
+        self.assertRaises(AttributeError, setattr, self.album, 'x', 1)
+        self.assertRaises(AttributeError, setattr, self.album.photos[0],
+                'x', 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
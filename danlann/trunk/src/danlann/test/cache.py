@@ -0,0 +1,629 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent stores, caches, converted photos and pages freshness tests.
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+from danlann.bc import Gallery, Album, Photo
+from danlann.backend import CommandBackend
+from danlann.exif import Reader
+from danlann.cache import Store, ExifCache, StreamCache, PhotoCache, \
+        fingerprint
+from danlann.filemanager import FileManager
+from danlann.generator import DanlannGenerator
+from danlann.pool import WorkerPool
+from danlann.test.pool import RecordHandler
+from danlann.scheduler import Scheduler
+from danlann.template import Template
+
+
+class CacheTestCase(unittest.TestCase):
+    """
+    Base class for tests using temporary directory.
+
+    @ivar dir: temporary directory
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def write(self, fn, data):
+        """
+        Write data into file in temporary directory.
+        """
+        fn = os.path.join(self.dir, fn)
+        f = open(fn, 'wb')
+        f.write(data)
+        f.close()
+        return fn
+
+
+
+class StoreTestCase(CacheTestCase):
+    """
+    Persistent store tests.
+    """
+    def testStore(self):
+        """storing values"""
+        store = Store(os.path.join(self.dir, 'store'))
+        store.open()
+        store.set(u'a/\u0142\xf3d\u017a.jpg', ('a', 1))
+        store.set('b', 'c')
+        store.delete('b')
+        store.delete('x')
+        store.close()
+
+        store.open()
+        self.assertEqual(store.get(u'a/\u0142\xf3d\u017a.jpg'), ('a', 1))
+        self.assertEqual(store.get('b'), None)
+        self.assertEqual(store.get('b', 1), 1)
+        store.close()
+
+
+    def testFingerprint(self):
+        """file fingerprint"""
+        fn = self.write('photo.jpg', 'abc')
+        fp = fingerprint(fn)
+        self.assertEqual(fp, fingerprint(fn))
+        self.assertNotEqual(fp, fingerprint(fn, True))
+
+        self.write('photo.jpg', 'abcd')
+        self.assertNotEqual(fp, fingerprint(fn))
+
+
+    def testChecksum(self):
+        """file fingerprint with checksum"""
+        fn = self.write('photo.jpg', 'abc')
+        st = os.stat(fn)
+        fp = fingerprint(fn, True)
+
+        # same size and modification time, different content
+        self.write('photo.jpg', 'abd')
+        os.utime(fn, (st.st_atime, st.st_mtime))
+        self.assertNotEqual(fp, fingerprint(fn, True))
+
+
+
+class CountingReader(Reader):
+    """
+    EXIF reader counting read photos.
+
+    @ivar files: list of read photos
+    """
+    name = 'counting'
+
+    def __init__(self):
+        super(CountingReader, self).__init__()
+        self.files = []
+
+
+    def read(self, fn):
+        self.files.append(fn)
+        return {'File name': fn, 'Aperture': 'F8'}
+
+
+
+class ExifCacheTestCase(CacheTestCase):
+    """
+    EXIF fields cache tests.
+
+    @ivar cache: EXIF fields cache
+    """
+    def setUp(self):
+        super(ExifCacheTestCase, self).setUp()
+        self.cache = ExifCache(os.path.join(self.dir, 'exif'))
+        self.cache.open()
+
+
+    def tearDown(self):
+        self.cache.close()
+        super(ExifCacheTestCase, self).tearDown()
+
+
+    def testFetch(self):
+        """fetching EXIF fields from cache"""
+        fn = self.write('photo.jpg', 'abc')
+        self.assertEqual(self.cache.fetch(fn, 'python'), None)
+
+        self.cache.store(fn, 'python', {'Aperture': 'F8'})
+        self.assertEqual(self.cache.fetch(fn, 'python'), {'Aperture': 'F8'})
+        self.assertEqual(self.cache.fetch(fn, 'exiv2'), None)
+
+        # changed photo
+        self.write('photo.jpg', 'abcd')
+        self.assertEqual(self.cache.fetch(fn, 'python'), None)
+
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 3)
+
+
+    def readExif(self, reader, files, headers):
+        """
+        Read EXIF data of photos with gallery generator using the cache.
+
+        Dictionary of photo filename and list of its EXIF objects is
+        returned.
+        """
+        g = DanlannGenerator(Gallery('title', 'desc'),
+                FileManager(exif = reader))
+        g.exifcache = self.cache
+        g.exif_headers = headers
+
+        pool = WorkerPool(1)
+        g.scheduler = Scheduler(pool)
+        photos = []
+        for fn in files:
+            photo = Photo()
+            photo.filename = fn
+            photos.append(photo)
+        g.readExif(photos)
+        g.scheduler.run()
+        pool.close()
+        return dict((photo.filename, photo.exif) for photo in photos)
+
+
+    def testHeaders(self):
+        """reading EXIF data using cache"""
+        reader = CountingReader()
+        a = self.write('a.jpg', 'a')
+        b = self.write('b.jpg', 'b')
+
+        exif = self.readExif(reader, [a, b], ['Aperture'])
+        self.assertEqual(reader.files, [a, b])
+        self.assertEqual([e.value for e in exif[a]], ['F8'])
+
+        # all fields are cached, so changing headers needs no reading
+        exif = self.readExif(reader, [a, b], ['File name', 'Aperture'])
+        self.assertEqual(reader.files, [a, b])
+        self.assertEqual([e.value for e in exif[b]], [b, 'F8'])
+
+        self.write('b.jpg', 'bc')
+        self.readExif(reader, [a, b], ['Aperture'])
+        self.assertEqual(reader.files, [a, b, b])
+
+
+
+class StreamCacheTestCase(CacheTestCase):
+    """
+    Album files node streams cache tests.
+    """
+    def testFetch(self):
+        """fetching node streams from cache"""
+        cache = StreamCache(os.path.join(self.dir, 'albums'))
+        cache.open()
+        fn = self.write('album.txt', '/a; A\n')
+        nodes = [(1, 'album', [u'a', u'A', u''])]
+        self.assertEqual(cache.fetch(fn, '1:fast'), None)
+
+        cache.store(fn, '1:fast', nodes)
+        cache.close()
+
+        cache.open()
+        self.assertEqual(cache.fetch(fn, '1:fast'), nodes)
+        self.assertEqual(cache.fetch(fn, '1:spark'), None)
+        self.assertEqual(cache.fetch(fn, '2:fast'), None)
+
+        # changed and removed album file
+        self.write('album.txt', '/a; AB\n')
+        self.assertEqual(cache.fetch(fn, '1:fast'), None)
+        os.remove(fn)
+        self.assertEqual(cache.fetch(fn, '1:fast'), None)
+        cache.close()
+
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 5)
+
+
+
+class PhotoCacheTestCase(CacheTestCase):
+    """
+    Converted photos cache tests.
+
+    @ivar cache: converted photos cache
+    """
+    def setUp(self):
+        super(PhotoCacheTestCase, self).setUp()
+        self.cache = PhotoCache(os.path.join(self.dir, 'cache'))
+        self.cache.open()
+
+
+    def testKey(self):
+        """cache key"""
+        key = self.cache.key('abc', 'gm', ['-size', '10x10'])
+        self.assertEqual(key, self.cache.key('abc', 'gm', ['-size', '10x10']))
+        self.assertNotEqual(key,
+                self.cache.key('abd', 'gm', ['-size', '10x10']))
+        self.assertNotEqual(key,
+                self.cache.key('abc', 'vips', ['-size', '10x10']))
+        self.assertNotEqual(key,
+                self.cache.key('abc', 'gm', ['-size', '10x11']))
+
+
+    def testFetch(self):
+        """fetching photos from cache"""
+        fn = self.write('photo.jpg', 'abc')
+        fetched = os.path.join(self.dir, 'fetched.jpg')
+
+        self.assert_(not self.cache.fetch('abcd', fetched))
+        self.cache.store('abcd', fn)
+        self.assert_(self.cache.fetch('abcd', fetched))
+        self.assertEqual(open(fetched).read(), 'abc')
+
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.saved, 3)
+        self.assertEqual(self.cache.report(),
+                'photo cache: 1 hits, 1 misses, 3 bytes saved')
+
+        # statistics of next gallery generation
+        self.cache.open()
+        self.assertEqual(self.cache.report(),
+                'photo cache: 0 hits, 0 misses, 0 bytes saved')
+
+
+    def testEvict(self):
+        """least recently used photos eviction"""
+        fn = self.write('photo.jpg', 'abc')
+        for i, key in enumerate(('aa', 'bb', 'cc')):
+            self.cache.store(key, fn)
+            os.utime(self.cache.path(key), (i, i))
+
+        # mark aa photo as recently used, fetched photo is not modified
+        self.assert_(self.cache.fetch('aa', os.path.join(self.dir, 'f.jpg')))
+        self.assertEqual(os.stat(self.cache.path('aa')).st_mtime, 0)
+
+        # photo being stored by another process
+        tmp = os.path.join(os.path.dirname(self.cache.path('bb')), 'tmpbb')
+        open(tmp, 'w').write('abc')
+
+        self.cache.evict(6)
+        self.assert_(os.path.exists(self.cache.path('aa')))
+        self.assert_(not os.path.exists(self.cache.path('bb')))
+        self.assert_(os.path.exists(self.cache.path('cc')))
+        self.assert_(os.path.exists(tmp))
+
+
+
+class FreshnessTestCase(CacheTestCase):
+    """
+    Converted photos freshness tests.
+
+    @ivar generator: gallery generator
+    """
+    def setUp(self):
+        super(FreshnessTestCase, self).setUp()
+        fm = FileManager(backend = CommandBackend(True))
+        self.generator = DanlannGenerator(Gallery('title', 'desc'), fm)
+        self.generator.state = Store(os.path.join(self.dir, 'state'))
+        self.generator.state.open()
+
+
+    def tearDown(self):
+        self.generator.state.close()
+        super(FreshnessTestCase, self).tearDown()
+
+
+    def testFingerprint(self):
+        """converted photo fingerprint"""
+        g = self.generator
+        fp = g.getConvertFingerprint('1:1.0', g.getConvertArgs(None))
+        self.assertEqual(fp,
+            g.getConvertFingerprint('1:1.0', g.getConvertArgs(None)))
+        self.assertNotEqual(fp,
+            g.getConvertFingerprint('1:1.0', g.getConvertArgs('thumb')))
+        self.assertNotEqual(fp,
+            g.getConvertFingerprint('1:2.0', g.getConvertArgs(None)))
+
+        g.fm.backend = CommandBackend(False)
+        self.assertNotEqual(fp,
+            g.getConvertFingerprint('1:1.0', g.getConvertArgs(None)))
+
+
+    def testConverted(self):
+        """converted photo state"""
+        g = self.generator
+        fn = os.path.join(self.dir, 'photo.jpg')
+        self.assert_(not g.isConverted(fn, 'a/photo.jpg', 'x'))
+
+        # existing converted photo without fingerprint is adopted
+        self.write('photo.jpg', 'abc')
+        self.assert_(g.isConverted(fn, 'a/photo.jpg', 'x'))
+        self.assert_(g.isConverted(fn, 'a/photo.jpg', 'x'))
+        self.assert_(not g.isConverted(fn, 'a/photo.jpg', 'y'))
+
+        g.converted([(fn, None, 'a/photo.jpg', 'y')])
+        self.assert_(g.isConverted(fn, 'a/photo.jpg', 'y'))
+
+
+    def testCache(self):
+        """converting photos using photo cache"""
+        def convert(fn_in, fn_out, args):
+            converted.append(fn_out)
+            self.write(fn_out, 'converted')
+
+        converted = []
+        g = self.generator
+        g.fm.convert = convert
+        g.cache = PhotoCache(os.path.join(self.dir, 'cache'))
+        g.cache.open()
+
+        fn_in = self.write('photo.jpg', 'abc')
+        a, b, c = [os.path.join(self.dir, fn) for fn in 'abc']
+
+        outputs = [(a, g.getConvertArgs(None), 'a', 'x')]
+        self.assertEqual(g.convert(fn_in, outputs), outputs)
+        self.assertEqual(converted, [a + '.tmp'])
+
+        # b is fetched from cache
+        outputs = [(b, g.getConvertArgs(None), 'b', 'x'),
+            (c, g.getConvertArgs('thumb'), 'c', 'x')]
+        self.assertEqual(g.convert(fn_in, outputs), outputs)
+        self.assertEqual(converted, [a + '.tmp', c + '.tmp'])
+        self.assertEqual(open(b).read(), 'converted')
+        self.assert_(not os.path.exists(b + '.tmp'))
+
+
+    def testFailure(self):
+        """keeping output photo on conversion failure"""
+        def convert(fn_in, fn_out, args):
+            self.write(fn_out, 'partial')
+            raise OSError(1, 'command failed')
+
+        g = self.generator
+        g.fm.convert = convert
+        fn_in = self.write('photo.jpg', 'abc')
+        a = self.write('a.jpg', 'published')
+
+        outputs = [(a, g.getConvertArgs(None), 'a', 'x')]
+        self.assertEqual(g.convert(fn_in, outputs), [])
+        self.assertEqual(open(a).read(), 'published')
+        self.assert_(not os.path.exists(os.path.join(self.dir, 'a.tmp.jpg')))
+
+
+
+def titles(photos):
+    """
+    Get names and titles of photos.
+    """
+    return ' '.join('%s:%s' % (p.name, p.title) for p in photos)
+
+
+class RecordingTemplate(Template):
+    """
+    Template recording rendered pages.
+
+    @ivar pages: list of rendered photo names and albums directories
+    """
+    def __init__(self, gallery):
+        self.name = 'basic'
+        self.gallery = gallery
+        self.override = None
+        self.css = []
+        self.js = []
+        self.copyright = ''
+        self.pages = []
+
+
+    def albumPage(self, f, album, parent):
+        self.pages.append(album.dir)
+        prev = parent.prev(album)
+        f.write('%s|%s|%s|%s|%s' % (album.dir, parent.title,
+            prev and prev.dir, self.copyright, titles(album.photos)))
+
+
+    def photoPage(self, f, photo):
+        self.pages.append(photo.name)
+        album = photo.album
+        photos = (album.prev(photo), photo, album.next(photo))
+        f.write('%s|%s|%s' % (album.dir, self.copyright,
+            titles(p for p in photos if p is not None)))
+
+
+
+class PageFreshnessTestCase(CacheTestCase):
+    """
+    Gallery pages freshness tests.
+
+    @ivar generator: gallery generator
+    @ivar album:     gallery album
+    """
+    def setUp(self):
+        super(PageFreshnessTestCase, self).setUp()
+        gallery = Gallery('title', 'desc')
+        self.album = Album()
+        self.album.dir = 'a'
+        for i in range(5):
+            photo = Photo()
+            photo.name = 'p%d' % i
+            photo.album = self.album
+            self.album.photos.append(photo)
+        gallery.subalbums.append(self.album)
+        os.mkdir(os.path.join(self.dir, 'a'))
+
+        g = self.generator = DanlannGenerator(gallery, FileManager())
+        g.outdir = self.dir
+        g.tmpl = RecordingTemplate(gallery)
+        g.tmplfp = g.tmpl.fingerprint()
+        g.pages = Store(os.path.join(self.dir, 'pages'))
+        g.pages.open()
+        g.written = []
+
+
+    def tearDown(self):
+        self.generator.pages.close()
+        super(PageFreshnessTestCase, self).tearDown()
+
+
+    def generate(self):
+        """
+        Generate album and photo pages and return list of rendered pages.
+        """
+        g = self.generator
+        g.tmpl.pages = []
+        g.writePage('a/index.xhtml', 'album a',
+                g.tmpl.albumData(self.album, g.gallery),
+                g.tmpl.albumPage, self.album, g.gallery)
+        for photo in self.album.photos:
+            g.generatePhoto(photo)
+        g.flushPages(True)
+        return g.tmpl.pages
+
+
+    def read(self, fn):
+        """
+        Read page from temporary directory.
+        """
+        return open(os.path.join(self.dir, fn)).read()
+
+
+    def testRebuild(self):
+        """rebuilding changed pages only"""
+        self.assertEqual(self.generate(),
+                ['a', 'p0', 'p1', 'p2', 'p3', 'p4'])
+        self.assertEqual(self.generate(), [])
+
+        # photo title is shown on album page and neighbour photo pages
+        self.album.photos[2].title = 'new title'
+        self.assertEqual(self.generate(), ['a', 'p1', 'p2', 'p3'])
+
+        # removed page is written again
+        os.remove(os.path.join(self.dir, 'a', 'p4.xhtml'))
+        self.assertEqual(self.generate(), ['p4'])
+
+        self.assertEqual(len(self.generator.written), 11)
+
+
+    def testTemplate(self):
+        """rebuilding pages on template change"""
+        self.generate()
+        self.generator.tmpl.copyright = 'me'
+        self.generator.tmplfp = self.generator.tmpl.fingerprint()
+        self.assertEqual(self.generate(),
+                ['a', 'p0', 'p1', 'p2', 'p3', 'p4'])
+
+
+    def testOverrideRebuild(self):
+        """rendering all pages of template override"""
+        self.generator.tmpl.override = self.dir
+        self.generate()
+        self.assertEqual(len(self.generator.tmpl.pages), 6)
+
+        handler = RecordHandler()
+        log = logging.getLogger('danlann.generator')
+        log.addHandler(handler)
+        try:
+            self.generate()
+        finally:
+            log.removeHandler(handler)
+        self.assertEqual(len(self.generator.tmpl.pages), 6)
+
+        # content of pages does not change, so they are not written
+        self.assertEqual(len(self.generator.written), 6)
+        self.assertEqual([m for m in handler.messages
+                if m.startswith('generated')], [])
+
+
+    def testPages(self):
+        """written pages"""
+        self.generate()
+        self.assertEqual(self.read('a/index.xhtml'),
+                'a|title|None||p0: p1: p2: p3: p4:')
+        self.assertEqual(self.read('a/p0.xhtml'), 'a||p0: p1:')
+        self.assertEqual(self.read('a/p2.xhtml'), 'a||p1: p2: p3:')
+
+
+    def testUnchanged(self):
+        """leaving intact pages, which content did not change"""
+        self.generate()
+        fn = os.path.join(self.dir, 'a', 'p0.xhtml')
+        os.utime(fn, (0, 0))
+
+        # pages are rendered again, but their content does not change
+        self.generator.tmplfp = 'changed'
+        self.generate()
+        self.assertEqual(len(self.generator.written), 6)
+        self.assertEqual(self.generator.unchanged, 6)
+        self.assertEqual(self.generator.report(),
+                'pages: 6 written, 6 unchanged')
+        self.assertEqual(os.stat(fn).st_mtime, 0)
+
+        # no temporary files are left
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dir, 'a'))),
+                ['index.xhtml', 'p0.xhtml', 'p1.xhtml', 'p2.xhtml',
+                    'p3.xhtml', 'p4.xhtml'])
+
+
+
+class ParallelPageTestCase(PageFreshnessTestCase):
+    """
+    Gallery pages freshness tests with pages rendered by page rendering
+    processes.
+    """
+    def setUp(self):
+        super(ParallelPageTestCase, self).setUp()
+        self.generator.renderjobs = 2
+
+
+    def generate(self):
+        """
+        Generate pages and return list of written pages.
+
+        Page rendering processes are started on each generation, so they
+        use current template.
+        """
+        g = self.generator
+        written = len(g.written)
+        g.startRenderer()
+        try:
+            super(ParallelPageTestCase, self).generate()
+        finally:
+            g.stopRenderer()
+
+        pages = []
+        for fn in g.written[written:]:
+            name = os.path.basename(fn).split('.')[0]
+            if name == 'index':
+                name = os.path.basename(os.path.dirname(fn))
+            pages.append(name)
+        return pages
+
+
+    def testOverride(self):
+        """rendering pages of template override by generator"""
+        g = self.generator
+        g.tmpl.override = self.dir
+        g.startRenderer()
+        self.assert_(g.renderer is None)
+        self.assertEqual(self.generate(), ['a', 'p0', 'p1', 'p2', 'p3', 'p4'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,320 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+StringTemplate compiler tests.
+
+Expected pages are written as StringTemplate writes them.
+"""
+
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+import danlann.config
+from danlann.bc import Gallery, Album, Photo, Exif
+from danlann.compiler import TemplateGroup
+from danlann.template import Template, XMLRenderer
+
+try:
+    import stringtemplate3
+except ImportError:
+    stringtemplate3 = None
+
+# templates in source tree or installed templates
+TMPL = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'tmpl')
+if not os.path.isdir(TMPL):
+    TMPL = '%s/tmpl' % danlann.config.libpath
+
+
+class Fallback(object):
+    """
+    StringTemplate group replacement recording rendered pages.
+    """
+    def __init__(self):
+        self.pages = []
+
+
+    def getInstanceOf(self, name):
+        self.pages.append(name)
+        return {}
+
+
+
+class CompilerTestCase(unittest.TestCase):
+    """
+    StringTemplate compiler tests.
+
+    @ivar dir: directory of templates
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def render(self, templates, **attrs):
+        """
+        Compile templates and render page template with attributes.
+        """
+        for name, text in templates.items():
+            f = open(os.path.join(self.dir, name + '.st'), 'wb')
+            f.write(text)
+            f.close()
+
+        self.group = TemplateGroup([self.dir], XMLRenderer(), Fallback())
+        page = self.group.getInstanceOf('page')
+        for name, value in attrs.items():
+            page[name] = value
+        return unicode(page)
+
+
+    def testAttributes(self):
+        """attributes and properties"""
+        album = Album()
+        album.title = 'a <b> & \'c\'\\nhttp://x.org/d'
+        self.assertEqual(self.render({'page': '[$album.title$]'},
+            album = album),
+            u'[a &lt;b&gt; &amp; &apos;c&apos;<br/>'
+            u'<a href = \'http://x.org/d\'>http://x.org/d</a>]')
+        self.assertEqual(self.render({'page': '[$album.dir$$x$]'},
+            album = album, x = ['a', None, 1]), u'[a1]')
+
+
+    def testNewlines(self):
+        """removing lines of expressions without output"""
+        page = 'a\n$x$\nb\n$x$\nc'
+        self.assertEqual(self.render({'page': page}), u'a\nb\nc')
+        self.assertEqual(self.render({'page': page}, x = 'x'),
+                u'a\nx\nb\nx\nc')
+        self.assertEqual(self.render({'page': '$x$\nb'}), u'b')
+
+
+    def testConditionals(self):
+        """conditionals"""
+        page = '$if(x)$\nyes\n$elseif(!y)$\nnot y\n$else$\nno\n$endif$\nend'
+        # newline before elseif is kept
+        self.assertEqual(self.render({'page': page}, x = True), u'yes\nend')
+        self.assertEqual(self.render({'page': page}, x = []), u'not yend')
+        self.assertEqual(self.render({'page': page}, y = 1), u'noend')
+
+        # newline after indented endif is kept
+        page = '$if(x)$\nyes\n  $endif$\nend'
+        self.assertEqual(self.render({'page': page}, x = 1), u'yes\nend')
+
+        # comments
+        page = '$! comment !$\na $! comment !$\nb'
+        self.assertEqual(self.render({'page': page}), u'a \nb')
+
+
+    def testIndent(self):
+        """indentation of included templates"""
+        templates = {
+            'page': '<div>\n    $(tmpl)()$\n  $inc()$ $inc()$\n</div>',
+            'inc': 'a\n$x$\nb',
+        }
+        self.assertEqual(self.render(templates, tmpl = 'inc'),
+            u'<div>\n    a\n    b\n  a\n  b a\nb\n</div>')
+
+
+    def testApply(self):
+        """applying templates"""
+        templates = {
+            'page': '$x:item()$|$x:{ v |$i$:$v$ }$|$y:{$it$!}$',
+            'item': '[$it$$i0$]',
+        }
+        self.assertEqual(self.render(templates, x = ['a', None, 'b'],
+            y = 'c'), u'[a0][b2]|1:a 3:b |c!')
+
+
+    def testScope(self):
+        """attributes of anonymous templates"""
+        templates = {
+            'page': '$x:{ v |$y$$if(y)$y$else$n$endif$}$',
+        }
+        self.assertEqual(self.render(templates, x = ['a'], y = 'b'), u'by')
+        self.assertRaises(KeyError, self.render, templates, x = ['a'])
+
+
+    def testFallback(self):
+        """rendering unsupported templates with StringTemplate"""
+        templates = {
+            'page': '$inc()$',
+            'inc': '$x; separator = ","$',
+        }
+        self.render(templates, x = ['a'])
+        self.assertEqual(self.group.fallback.pages, ['page'])
+        self.assert_(self.group.templates['page'] is not None)
+        self.assert_(self.group.templates['inc'] is None)
+
+
+    def testStream(self):
+        """streaming page into file"""
+        templates = {'page': '$x:{ v |\n  $v$}$\n$y$'}
+        x = [u'\u0142%d' % i for i in range(5000)]
+        text = self.render(templates, x = x, y = 'end')
+
+        f = StringIO()
+        f.write('header')
+        self.group.getInstanceOf('page').write(f)
+        self.assertEqual(f.getvalue(), 'header')
+
+        page = self.group.getInstanceOf('page')
+        page['x'] = x
+        page['y'] = 'end'
+        page.write(f)
+        self.assertEqual(f.getvalue(), 'header' + text.encode('utf-8'))
+
+
+    def testStreamFallback(self):
+        """streaming page rendered with StringTemplate"""
+        templates = {
+            'page': '$x$$inc()$',
+            'inc': '$x; separator = ","$',
+        }
+        x = ['a'] * 5000
+        self.render(templates, x = x)
+
+        # text written before rendering failed is removed, fallback page
+        # is the dictionary of its attributes
+        f = StringIO()
+        f.write('header')
+        page = self.group.getInstanceOf('page')
+        page['x'] = x
+        page.write(f)
+        self.assertEqual(f.getvalue(), 'header' + str({'x': x}))
+
+
+    def testTemplates(self):
+        """compiling Danlann templates"""
+        group = TemplateGroup([TMPL], XMLRenderer(), Fallback())
+        for name in ('gallery', 'album', 'photo', 'exif', 'page'):
+            self.assert_(group.templates['basic/%s' % name] is not None)
+            self.assert_(group.templates['vflow/%s' % name] is not None)
+
+
+
+
+def gallery():
+    """
+    Create gallery with album, subalbum and photos for pages rendering.
+    """
+    g = Gallery(u'Gallery & <friends>',
+            u'Trips \u2013 see http://example.org/trips\nand more')
+
+    album = Album()
+    album.dir = 'a'
+    album.title = u'Wexford "harbour"'
+    album.description = u'Za\u017c\xf3\u0142\u0107 g\u0119\u015bl\u0105'
+    album.gallery = g
+    g.subalbums.append(album)
+
+    sub = Album()
+    sub.dir = 'a/b'
+    sub.title = u'Beach'
+    sub.gallery = g
+    album.subalbums.append(sub)
+
+    for i in range(3):
+        photo = Photo()
+        photo.name = 'p%d' % i
+        photo.title = u'Photo %d & co' % i
+        photo.description = i and u'Map: http://maps.example.org/p%d' % i \
+                or u''
+        photo.album = album
+        photo.gallery = g
+        photo.exif = [Exif('Aperture', 'F8'), Exif('Exposure time', '1/25 s')]
+        album.photos.append(photo)
+    album.thumbnail = album.photos[0]
+    sub.thumbnail = album.photos[1]
+    return g
+
+
+
+class EngineTestCase(unittest.TestCase):
+    """
+    Compiled templates and StringTemplate comparison tests.
+
+    The tests are run if StringTemplate library is installed.
+
+    @ivar libpath: Danlann library path
+    """
+    def setUp(self):
+        # use templates found by compiler tests
+        self.libpath = danlann.config.libpath
+        danlann.config.libpath = os.path.dirname(TMPL)
+
+
+    def tearDown(self):
+        danlann.config.libpath = self.libpath
+
+
+    def pages(self, name, engine):
+        """
+        Render gallery, album, photo and exif pages of a template with
+        given engine.
+        """
+        g = gallery()
+        tmpl = Template(name, g, engine = engine)
+        tmpl.copyright = u'(c) Me & You'
+        album = g.subalbums[0]
+
+        pages = []
+        for render, args in ((tmpl.galleryPage, ()),
+                (tmpl.albumPage, (album, g)),
+                (tmpl.albumPage, (album.subalbums[0], album)),
+                (tmpl.photoPage, (album.photos[0],)),
+                (tmpl.photoPage, (album.photos[1],)),
+                (tmpl.exifPage, (album.photos[2],))):
+            f = StringIO()
+            render(f, *args)
+            pages.append(f.getvalue())
+        return pages
+
+
+    def compare(self, name):
+        """
+        Check if compiled template renders the same pages as StringTemplate.
+        """
+        expected = self.pages(name, 'stringtemplate')
+        for page, data in zip(expected, self.pages(name, 'compiled')):
+            self.assertEqual(page, data)
+
+
+    def testBasic(self):
+        """basic template pages rendered with both engines"""
+        self.compare('basic')
+
+
+    def testVFlow(self):
+        """vflow template pages rendered with both engines"""
+        self.compare('vflow')
+
+
+if stringtemplate3 is None:
+    del EngineTestCase
+
+
+
+if __name__ == '__main__':
+    unittest.main()
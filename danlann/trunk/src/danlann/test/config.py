@@ -26,7 +26,10 @@ from StringIO import StringIO
 import unittest
 
 import danlann.config
-from danlann import Danlann
+from danlann import Danlann, ConfigurationError
+from danlann.backend import CommandBackend, GMBatchBackend
+from danlann.exif import PythonReader, Exiv2Reader
+from danlann.compiler import TemplateGroup
 
 # minimal configuration required by danlann
 # see Danlann Manual for specification of minimal configuration
@@ -99,12 +102,62 @@ outdir    = output_dir
 files     = xx $files ee
 """
 
+CONF_DECODE_ONCE = """
+decodeonce = True
+"""
+
+CONF_EXIF_READER = """
+exifreader = exiv2
+"""
+
+CONF_PARSER = """
+parser = spark
+"""
+
+CONF_PARSE_JOBS = """
+parsejobs = 4
+"""
+
+CONF_RENDER_JOBS = """
+renderjobs = 3
+"""
+
+CONF_INDIR_RECURSIVE = """
+indirrecursive = True
+"""
+
+CONF_CHECKSUM = """
+checksum = True
+"""
+
+CONF_GM_BATCH = """
+gmbatch = True
+"""
+
+CONF_BACKEND = """
+backend = convert
+"""
+
+CONF_CACHE = """
+cache = /tmp/danlann-cache
+cachesize = 10
+"""
+
+CONF_JOBS = """
+jobs = 4
+"""
+
 CONF_TEMPLATE = """
 [template]
 js = a b c
 css = x y z
 """
 
+CONF_TEMPLATE_ENGINE = """
+[template]
+engine = compiled
+"""
+
 # configuration data for test cases
 # test case name is used as hashtable key
 CONFIG_DATA = {}
@@ -272,6 +325,260 @@ class ConfigTestCase(Base):
         self.assertEqual(self.filemanager.convert_cmd, ['convert', 'convert'])
 
 
+    @config(CONF_MIN)
+    def testDefaultGMBatch(self):
+        """GraphicsMagick batch processes are not used by default"""
+        assert not self.conf.has_option('danlann', 'gmbatch')
+        self.assert_(not isinstance(self.filemanager.backend, GMBatchBackend))
+
+
+    @config(CONF_MIN + CONF_GM_BATCH)
+    def testGMBatch(self):
+        """using GraphicsMagick batch processes"""
+        assert self.conf.has_option('danlann', 'gmbatch')
+        self.assert_(isinstance(self.filemanager.backend, GMBatchBackend))
+
+
+    @config(CONF_MIN + CONF_BACKEND)
+    def testBackend(self):
+        """conversion backend"""
+        assert self.conf.has_option('danlann', 'backend')
+        backend = self.filemanager.backend
+        self.assert_(isinstance(backend, CommandBackend))
+        self.assert_(not isinstance(backend, GMBatchBackend))
+        self.assertEqual(self.filemanager.convert_cmd, ['convert', 'convert'])
+
+
+    @config(CONF_MIN)
+    def testDefaultDecodeOnce(self):
+        """decoding photo once is disabled by default"""
+        assert not self.conf.has_option('danlann', 'decodeonce')
+        self.assert_(not self.generator.decodeonce)
+
+
+    @config(CONF_MIN + CONF_DECODE_ONCE)
+    def testDecodeOnce(self):
+        """decoding photo once"""
+        assert self.conf.has_option('danlann', 'decodeonce')
+        self.assert_(self.generator.decodeonce)
+
+
+    @config(CONF_MIN)
+    def testDefaultIndirRecursive(self):
+        """photo files are not looked for recursively by default"""
+        assert not self.conf.has_option('danlann', 'indirrecursive')
+        self.assert_(not self.generator.recursive)
+
+
+    @config(CONF_MIN + CONF_INDIR_RECURSIVE)
+    def testIndirRecursive(self):
+        """recursive photo files lookup"""
+        assert self.conf.has_option('danlann', 'indirrecursive')
+        self.assert_(self.generator.recursive)
+
+
+    @config(CONF_MIN)
+    def testDefaultExifReader(self):
+        """in-process EXIF reader is used by default"""
+        assert not self.conf.has_option('danlann', 'exifreader')
+        self.assert_(isinstance(self.filemanager.exif, PythonReader))
+
+
+    @config(CONF_MIN + CONF_EXIF_READER)
+    def testExifReader(self):
+        """EXIF reader"""
+        assert self.conf.has_option('danlann', 'exifreader')
+        self.assert_(isinstance(self.filemanager.exif, Exiv2Reader))
+
+
+    @config(CONF_MIN)
+    def testDefaultParser(self):
+        """fast album file parser is used by default"""
+        assert not self.conf.has_option('danlann', 'parser')
+        self.assertEqual(self.processor.engine, 'fast')
+
+
+    @config(CONF_MIN + CONF_PARSER)
+    def testParser(self):
+        """album file parser"""
+        assert self.conf.has_option('danlann', 'parser')
+        self.assertEqual(self.processor.engine, 'spark')
+
+
+    @config(CONF_MIN)
+    def testDefaultParseJobs(self):
+        """album files are parsed one after another by default"""
+        assert not self.conf.has_option('danlann', 'parsejobs')
+        self.assertEqual(self.processor.parsejobs, 1)
+
+
+    @config(CONF_MIN + CONF_PARSE_JOBS)
+    def testParseJobs(self):
+        """amount of parsing jobs"""
+        assert self.conf.has_option('danlann', 'parsejobs')
+        self.assertEqual(self.processor.parsejobs, 4)
+
+
+    @config(CONF_MIN)
+    def testDefaultRenderJobs(self):
+        """pages are rendered by generator by default"""
+        assert not self.conf.has_option('danlann', 'renderjobs')
+        self.assertEqual(self.processor.generator.renderjobs, 1)
+
+
+    @config(CONF_MIN + CONF_RENDER_JOBS)
+    def testRenderJobs(self):
+        """amount of page rendering jobs"""
+        assert self.conf.has_option('danlann', 'renderjobs')
+        self.assertEqual(self.processor.generator.renderjobs, 3)
+
+
+    @config(CONF_MIN)
+    def testDefaultChecksum(self):
+        """photo checksum is disabled by default"""
+        assert not self.conf.has_option('danlann', 'checksum')
+        self.assert_(not self.generator.checksum)
+
+
+    @config(CONF_MIN + CONF_CHECKSUM)
+    def testChecksum(self):
+        """photo checksum"""
+        assert self.conf.has_option('danlann', 'checksum')
+        self.assert_(self.generator.checksum)
+
+
+    @config(CONF_MIN)
+    def testDefaultCache(self):
+        """photo cache is not used by default"""
+        assert not self.conf.has_option('danlann', 'cache')
+        self.assertEqual(self.generator.cache, None)
+
+
+    @config(CONF_MIN + CONF_CACHE)
+    def testCache(self):
+        """photo cache"""
+        assert self.conf.has_option('danlann', 'cache')
+        cache = self.generator.cache
+        self.assertEqual(cache.dir, '/tmp/danlann-cache')
+        self.assertEqual(cache.size, 10 * 1024 * 1024)
+
+
+    @config(CONF_MIN)
+    def testDefaultJobs(self):
+        """default amount of jobs"""
+        assert not self.conf.has_option('danlann', 'jobs')
+        self.assertEqual(self.generator.jobs, 1)
+
+
+    @config(CONF_MIN + CONF_JOBS)
+    def testJobs(self):
+        """amount of jobs"""
+        assert self.conf.has_option('danlann', 'jobs')
+        self.assertEqual(self.generator.jobs, 4)
+
+
+
+class FileManagerConfigTestCase(unittest.TestCase):
+    """
+    Test file manager configuration errors.
+    """
+    def testGMBatchImageMagick(self):
+        """GraphicsMagick batch processes with ImageMagick"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + CONF_FILEMANAGER + CONF_GM_BATCH))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+    def testUnknownBackend(self):
+        """unknown conversion backend"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\nbackend = xyz'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+    def testUnknownExifReader(self):
+        """unknown EXIF reader"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\nexifreader = exiftool'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+    def testUnsupportedArgs(self):
+        """conversion arguments unsupported by conversion backend"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\nbackend = pil\n' \
+                + CONF_PHOTO_PARAMS))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+
+class JobsConfigTestCase(unittest.TestCase):
+    """
+    Test amount of jobs configuration option overriding.
+    """
+    def testJobsOverride(self):
+        """override amount of jobs"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + CONF_JOBS))
+
+        processor = Danlann()
+        processor.initialize(conf, False, 8)
+        self.assertEqual(processor.generator.jobs, 8)
+
+
+    def testInvalidJobs(self):
+        """invalid amount of jobs"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\njobs = 0'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+    def testInvalidParseJobs(self):
+        """invalid amount of parsing jobs"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\nparsejobs = 0'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+    def testInvalidRenderJobs(self):
+        """invalid amount of page rendering jobs"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\nrenderjobs = 0'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+    def testUnknownParser(self):
+        """unknown album file parser"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\nparser = earley'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
+    def testInvalidCacheSize(self):
+        """invalid photo cache size"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '\ncache = /tmp\ncachesize = x'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
+
+
 
 class ValidationConfigTestCase(unittest.TestCase):
     """
@@ -327,3 +634,25 @@ class TemplateConfigTestCase(Base):
         """adding more css"""
         assert self.conf.has_option('template', 'css')
         self.assertEqual(self.generator.tmpl.css, ['css/danlann.css', 'x', 'y', 'z'])
+
+    @config(CONF_MIN)
+    def testDefaultEngine(self):
+        """StringTemplate is used by default"""
+        assert not self.conf.has_option('template', 'engine')
+        self.assert_(not isinstance(self.generator.tmpl.st_group,
+            TemplateGroup))
+
+    @config(CONF_MIN + CONF_TEMPLATE_ENGINE)
+    def testEngine(self):
+        """compiled templates"""
+        assert self.conf.has_option('template', 'engine')
+        self.assert_(isinstance(self.generator.tmpl.st_group, TemplateGroup))
+
+    @config(CONF_MIN)
+    def testUnknownEngine(self):
+        """unknown template engine"""
+        conf = ConfigParser()
+        conf.readfp(StringIO(CONF_MIN + '[template]\nengine = xyz'))
+
+        processor = Danlann()
+        self.assertRaises(ConfigurationError, processor.initialize, conf)
@@ -0,0 +1,248 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+EXIF readers tests.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from danlann.exif import PythonReader, Exiv2Reader, exposureTime, \
+        exposureBias, fnumber, aperture, focalLength, comment
+from danlann.filemanager import FileManager
+
+PHOTO = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+        'examples', 'in', 'dsc_0001.jpg')
+
+
+class FormatTestCase(unittest.TestCase):
+    """
+    EXIF values formatting tests.
+    """
+    def testExposureTime(self):
+        """exposure time formatting"""
+        self.assertEqual(exposureTime([(10, 250)]), '1/25 s')
+        self.assertEqual(exposureTime([(1, 125)]), '1/125 s')
+        self.assertEqual(exposureTime([(30, 10)]), '3 s')
+        self.assertEqual(exposureTime([(2, 1)]), '2 s')
+
+
+    def testExposureBias(self):
+        """exposure bias formatting"""
+        self.assertEqual(exposureBias([(0, 6)]), '0 EV')
+        self.assertEqual(exposureBias([(-2, 6)]), '-1/3 EV')
+        self.assertEqual(exposureBias([(6, 6)]), '+1 EV')
+        self.assertEqual(exposureBias([(1, 0)]), '(1/0)')
+
+
+    def testAperture(self):
+        """aperture formatting"""
+        self.assertEqual(fnumber([(80, 10)]), 'F8')
+        self.assertEqual(fnumber([(56, 10)]), 'F5.6')
+        self.assertEqual(fnumber([(220, 10)]), 'F22')
+        self.assertEqual(aperture([(6, 1)]), 'F8')
+
+
+    def testFocalLength(self):
+        """focal length formatting"""
+        self.assertEqual(focalLength([(180, 10)]), '18.0 mm')
+        self.assertEqual(focalLength([(50, 1)]), '50.0 mm')
+
+
+    def testComment(self):
+        """user comment formatting"""
+        self.assertEqual(comment('ASCII\0\0\0abc\0\0'), 'charset="Ascii" abc')
+        self.assertEqual(comment('\0' * 8 + 'abc '), 'abc')
+
+
+
+class PythonReaderTestCase(unittest.TestCase):
+    """
+    In-process EXIF reader tests.
+
+    @ivar dir: temporary directory
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def testRead(self):
+        """reading EXIF data"""
+        fields = PythonReader().read(PHOTO)
+        self.assertEqual(fields['Camera make'], 'NIKON CORPORATION')
+        self.assertEqual(fields['Camera model'], 'NIKON D70s')
+        self.assertEqual(fields['Image size'], '1280 x 1024')
+        self.assertEqual(fields['Image timestamp'], '2005:09:25 17:07:48')
+        self.assertEqual(fields['Exposure time'], '1/25 s')
+        self.assertEqual(fields['Aperture'], 'F8')
+        self.assertEqual(fields['Exposure bias'], '0 EV')
+        self.assertEqual(fields['Flash'], 'No flash')
+        self.assertEqual(fields['Flash bias'], '')
+        self.assertEqual(fields['Focal length'],
+                '18.0 mm (35 mm equivalent: 27.0 mm)')
+        self.assertEqual(fields['ISO speed'], '800')
+        self.assertEqual(fields['Exposure mode'], 'Aperture priority')
+        self.assertEqual(fields['Metering mode'], 'Spot')
+        self.assertEqual(fields['White balance'], 'Auto')
+
+
+    def testNoExif(self):
+        """photo without EXIF data"""
+        # copy photo without APP1 segment
+        data = open(PHOTO, 'rb').read()
+        start = data.index('\xff\xe1')
+        length = ord(data[start + 2]) * 256 + ord(data[start + 3])
+        fn = os.path.join(self.dir, 'noexif.jpg')
+        f = open(fn, 'wb')
+        f.write(data[:start] + data[start + 2 + length:])
+        f.close()
+
+        self.assertEqual(PythonReader().read(fn), {})
+
+
+    def testInvalidTag(self):
+        """tag of unexpected type"""
+        # F number stored as short instead of rational
+        data = open(PHOTO, 'rb').read()
+        start = data.index('Exif\0\0') + 6
+        order = data[start:start + 2] == 'II' and '<' or '>'
+        entry = struct.pack(order + 'HHL', 0x829d, 5, 1)
+        self.assertEqual(data.count(entry), 1)
+        fn = os.path.join(self.dir, 'short.jpg')
+        f = open(fn, 'wb')
+        f.write(data.replace(entry, struct.pack(order + 'HHL', 0x829d, 3, 1)))
+        f.close()
+
+        fields = PythonReader().read(fn)
+        self.assertEqual(fields['Aperture'], '')
+        self.assertEqual(fields['Exposure time'], '1/25 s')
+        self.assertEqual(PythonReader().readMulti([fn]).keys(), [fn])
+
+
+    def testInvalidFile(self):
+        """invalid photo file"""
+        fn = os.path.join(self.dir, 'invalid.jpg')
+        f = open(fn, 'wb')
+        f.write('\xff\xd8\xff\xe1\x00')
+        f.close()
+
+        reader = PythonReader()
+        self.assertRaises(ValueError, reader.read, fn)
+        self.assertRaises(ValueError, reader.read, __file__)
+        self.assertEqual(FileManager(True).readExif([fn]), {})
+
+
+    def testHeaders(self):
+        """EXIF headers selection and order"""
+        fm = FileManager(True)
+        exif = fm.selectExif(fm.readExif([PHOTO])[PHOTO],
+                ['ISO speed', 'Aperture', 'Unknown'])
+        self.assertEqual([(e.name, e.value) for e in exif],
+                [('ISO speed', '800'), ('Aperture', 'F8')])
+
+
+
+class Exiv2ReaderTestCase(unittest.TestCase):
+    """
+    Exiv2 command EXIF reader tests.
+    """
+    OUTPUT = """\
+/a/p1.jpg        Camera make     : NIKON CORPORATION
+/a/p1.jpg        Aperture        : F8
+/a/p1 2.jpg      Camera make     : Canon
+/a/p1 2.jpg      Image timestamp : 2008:01:02 10:11:12
+/a/p2.jpg        Aperture        : F5.6
+"""
+
+    def testSplit(self):
+        """splitting exiv2 output of many photos"""
+        files = ['/a/p1.jpg', '/a/p1 2.jpg', '/a/p1', '/a/p2.jpg']
+        output = Exiv2Reader().split(files, self.OUTPUT)
+        self.assertEqual(output['/a/p1'], [])
+        self.assertEqual(output['/a/p1 2.jpg'], [
+            '      Camera make     : Canon',
+            '      Image timestamp : 2008:01:02 10:11:12',
+        ])
+        self.assertEqual(len(output['/a/p1.jpg']), 2)
+        self.assertEqual(len(output['/a/p2.jpg']), 1)
+
+
+    def testReadMulti(self):
+        """reading EXIF data of many photos"""
+        def execute(args):
+            calls.append(args)
+            return self.OUTPUT
+
+        calls = []
+        reader = Exiv2Reader()
+        reader.execute = execute
+        files = ['/a/p1.jpg', '/a/p1 2.jpg', '/a/p2.jpg', '/a/p1.jpg']
+        result = reader.readMulti(files)
+
+        self.assertEqual(calls, [['/a/p1.jpg', '/a/p1 2.jpg', '/a/p2.jpg']])
+        self.assertEqual(result['/a/p1.jpg'],
+                {'Camera make': 'NIKON CORPORATION', 'Aperture': 'F8'})
+        self.assertEqual(result['/a/p1 2.jpg'], {'Camera make': 'Canon',
+                'Image timestamp': '2008:01:02 10:11:12'})
+        self.assertEqual(result['/a/p2.jpg'], {'Aperture': 'F5.6'})
+
+
+    def testChunks(self):
+        """running exiv2 for chunks of photos"""
+        def execute(args):
+            calls.append(args)
+            if len(args) == 1:
+                return 'Aperture : F8\n'
+            return ''.join('%s Aperture : F8\n' % fn for fn in args)
+
+        calls = []
+        reader = Exiv2Reader()
+        reader.execute = execute
+        reader.CHUNK = 2
+        files = ['/a/p%d.jpg' % i for i in range(5)]
+        result = reader.readMulti(files)
+
+        self.assertEqual(calls, [files[:2], files[2:4], files[4:]])
+        self.assertEqual(sorted(result), files)
+
+
+    def testReadMultiFailed(self):
+        """photos not read by exiv2 are not in EXIF data of many photos"""
+        reader = Exiv2Reader()
+        reader.execute = lambda args: self.OUTPUT
+        files = ['/a/p1.jpg', '/a/p3.jpg', '/a/p2.jpg']
+        result = reader.readMulti(files)
+        self.assertEqual(sorted(result), ['/a/p1.jpg', '/a/p2.jpg'])
+
+        # exiv2 is run for one photo
+        reader.execute = lambda args: ''
+        self.assertEqual(reader.readMulti(['/a/p3.jpg']), {})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
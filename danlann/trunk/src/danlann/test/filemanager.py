@@ -28,7 +28,7 @@ import shutil
 import tempfile
 import unittest
 
-from danlann.filemanager import FileManager
+from danlann.filemanager import FileManager, PhotoIndex
 
 def touch(fn):
     """
@@ -139,5 +139,51 @@ class LookupTestCase(FileManagerTestCaseBase):
 
 
 
+class PhotoIndexTestCase(FileManagerTestCaseBase):
+    """
+    Photo files index tests.
+    """
+    def setUp(self):
+        """
+        Create photo files in temporary directory.
+        """
+        super(PhotoIndexTestCase, self).setUp()
+        os.mkdir('%s/a' % self.dir)
+        os.mkdir('%s/a/2008' % self.dir)
+        os.mkdir('%s/b' % self.dir)
+
+        touch('%s/a/p1.jpg' % self.dir)
+        touch('%s/a/2008/p2.jpg' % self.dir)
+        touch('%s/b/p1.jpg' % self.dir)
+        touch('%s/b/p3.jpg' % self.dir)
+        touch('%s/b/p3.txt' % self.dir)
+
+
+    def testLookup(self):
+        """photo file lookup"""
+        path = ('%s/a' % self.dir, '%s/b' % self.dir, '%s/c' % self.dir)
+        index = PhotoIndex(path)
+        index.build()
+
+        fm = FileManager(True)
+        for fn in ('p1.jpg', 'p3.jpg'):
+            self.assertEqual(index.lookup(fn), fm.lookup(path, fn).next())
+        self.assertEqual(index.lookup('p2.jpg'), None)
+        self.assertEqual(index.lookup('p3.txt'), None)
+
+
+    def testRecursiveLookup(self):
+        """recursive photo file lookup"""
+        path = ('%s/a' % self.dir, '%s/b' % self.dir)
+        index = PhotoIndex(path, True)
+        index.build()
+
+        self.assertEqual(index.lookup('p1.jpg'), '%s/a/p1.jpg' % self.dir)
+        self.assertEqual(index.lookup('p2.jpg'),
+                '%s/a/2008/p2.jpg' % self.dir)
+        self.assertEqual(index.lookup('p3.jpg'), '%s/b/p3.jpg' % self.dir)
+
+
+
 if __name__ == '__main__':
     unittest.main()
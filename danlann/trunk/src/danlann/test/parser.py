@@ -27,12 +27,19 @@ Test Danlann parser aspects:
 @see danlann.parser
 """
 
+import os.path
+import codecs
+import shutil
 import StringIO
+import tempfile
+import threading
 import unittest
 
 from danlann.parser import DanlannScanner, DanlannParser, \
-        interpreter, load, check, ParseError
+        DanlannLineParser, interpreter, parse, load, loadMulti, stream, \
+        check, ParseError
 from danlann.bc import Gallery
+from danlann.cache import StreamCache
 
 
 class ScannerTestCase(unittest.TestCase):
@@ -184,19 +191,282 @@ class ParseNodeTestCase(unittest.TestCase):
 
 
 
+class EngineTestCase(unittest.TestCase):
+    """
+    Test fast parser against SPARK based reference parser.
+
+    @ivar scanner:    Danlann scanner instance
+    @ivar parser:     Danlann parser instance
+    @ivar lineparser: fast Danlann parser instance
+    """
+    LINES = [
+        '# comment', '#', '#/a; title; desc',
+        '/a', '/adir04', '/a/b/c', '/a/', '//a', '/a//b', '/a-b_c',
+        '/a; title', '/a; title; desc', '/a;title;desc', '/a; ; desc',
+        '/a;  title  ;  desc  ', '/a; title; desc ###',
+        'abc', 'abc; title', 'abc; title; desc', 'abc01;title',
+        'abc; title; desc http://www.danlann.org', 'a-b_c; t',
+        '\n', '', u'abc; tytu\u0142; opis',
+        # invalid lines
+        '/', ';', 'abc;', 'abc; title;', '/a;', '/a; title; desc;',
+        'abc; a; b; c', 'abc3!; title5; desc5', 'a b', 'ab/c', '/a b',
+        '/a; title\n', 'abc\n', '#a\nb', 'abc /a', '; title',
+    ]
+
+    def setUp(self):
+        """
+        Create SPARK and fast parsers.
+        """
+        self.scanner = DanlannScanner()
+        self.parser = DanlannParser()
+        self.lineparser = DanlannLineParser()
+
+
+    def parse(self, parse, line):
+        """
+        Parse a line and return node type and data or None if line is
+        invalid.
+        """
+        try:
+            node = parse(line)
+            return node.type, node.data
+        except ParseError:
+            return None
+
+
+    def testLines(self):
+        """fast and SPARK parsers nodes"""
+        for line in self.LINES:
+            expected = self.parse(lambda l:
+                    self.parser.parse(self.scanner.tokenize(l)), line)
+            result = self.parse(self.lineparser.parse, line)
+            self.assertEquals(result, expected, 'line %r' % line)
+
+
+    def load(self, f, engine):
+        """
+        Load album file with a parsing engine and return description of
+        created gallery or parse error filename and line number.
+        """
+        def dump(album, indent = ''):
+            yield '%s%s; %s; %s' % (indent, album.dir, album.title,
+                    album.description)
+            for photo in album.photos:
+                yield '%s %s; %s; %s' % (indent, photo.name, photo.title,
+                        photo.description)
+            for subalbum in album.subalbums:
+                for line in dump(subalbum, indent + ' '):
+                    yield line
+
+        gallery = Gallery('title', 'desc')
+        f.seek(0)
+        try:
+            load(f, interpreter(gallery, engine))
+        except ParseError, ex:
+            return ex.filename, ex.lineno, ex.message
+        return [line for album in gallery.subalbums for line in dump(album)]
+
+
+    def testExamples(self):
+        """fast and SPARK parsers on example album files"""
+        dir = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+                'examples')
+        for fn in ('dublin.txt', 'galway.txt'):
+            f = codecs.open(os.path.join(dir, fn), encoding = 'utf-8')
+            try:
+                result = self.load(f, 'fast')
+                self.assert_(result)
+                self.assertEquals(result, self.load(f, 'spark'))
+            finally:
+                f.close()
+
+
+    def testErrorLine(self):
+        """fast and SPARK parsers error reporting"""
+        for line in ('abc;', '/a b', 'abc3!', '/a; title; desc;'):
+            f = StringIO.StringIO('/a; title\n\nabc\n%s\nabc\n' % line)
+            f.name = 'test'
+
+            result = self.load(f, 'fast')
+            self.assertEquals(result, ('test', 4, 'syntax error'))
+            self.assertEquals(result, self.load(f, 'spark'))
+
+
+    def testThreads(self):
+        """parsing album files by many threads"""
+        def run(i):
+            engine = ('fast', 'spark')[i % 2]
+            for j in range(10):
+                f = StringIO.StringIO(data[(i + j) % len(data)])
+                f.name = 'test%d' % ((i + j) % len(data))
+                results[i].append(self.load(f, engine))
+
+        data = ['/a; title\nabc\nabc; t\n',
+            '/a; title\n\nabc\n/b; t\n/b; t\n',
+            '/a; title\nabc\nabc;\n']
+        expected = []
+        for i, text in enumerate(data):
+            f = StringIO.StringIO(text)
+            f.name = 'test%d' % i
+            expected.append(self.load(f, 'fast'))
+        self.assertEquals(expected[1:],
+            [('test1', 5, 'album "b" already defined'),
+                ('test2', 3, 'syntax error')])
+
+        results = [[] for i in range(4)]
+        threads = [threading.Thread(target = run, args = (i,))
+                for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for i, result in enumerate(results):
+            self.assertEquals(result,
+                [expected[(i + j) % len(data)] for j in range(10)])
+
+
+
+class LoadMultiTestCase(unittest.TestCase):
+    """
+    Parallel album files parsing tests.
+
+    @ivar dir: temporary directory
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def load(self, files, jobs, cache = None, engine = 'fast'):
+        """
+        Load album files and return description of created gallery or
+        parse error filename, line number and message.
+        """
+        names = []
+        for i, data in enumerate(files):
+            fn = os.path.join(self.dir, 'album%d.txt' % i)
+            # keep unchanged album files intact for node streams cache
+            if not os.path.exists(fn) or open(fn).read() != data:
+                f = open(fn, 'w')
+                f.write(data)
+                f.close()
+            names.append(fn)
+
+        gallery = Gallery('title', 'desc')
+        interp = interpreter(gallery, engine)
+        try:
+            if jobs:
+                loadMulti(names, interp, jobs, cache)
+            else:
+                for fn in names:
+                    f = codecs.open(fn, encoding = 'utf-8')
+                    load(f, interp)
+                    f.close()
+            check(interp, gallery)
+        except ParseError, ex:
+            return os.path.basename(ex.filename or ''), ex.lineno, \
+                    ex.message
+        return [(a.dir, [s.dir for s in a.subalbums],
+                [p.name for p in a.photos]) for a in interp.store.values()], \
+                [a.dir for a in gallery.subalbums]
+
+
+    def testStream(self):
+        """album file node stream"""
+        f = StringIO.StringIO('# c\n/a; t\n\nabc; x\n/b\nab c\nd\n')
+        f.name = 'album.txt'
+        self.assertEquals(stream(f), [(2, 'album', ['a', 't', '']),
+            (4, 'photo', ['abc', 'x', '']), (5, 'subalbum', ['b']),
+            (6, None, 'syntax error')])
+
+
+    def testMerge(self):
+        """merging album files"""
+        files = ['/a; A\n/b\np1\n', '/b; B\np2\n/c\n', '/c; C\np3\n']
+        expected = self.load(files, 0)
+        self.assertEquals(expected[1], ['a'])
+        self.assertEquals(self.load(files, 1), expected)
+        self.assertEquals(self.load(files, 3), expected)
+
+
+    def testErrors(self):
+        """errors of parallel album files parsing"""
+        # semantic error in first file is reported before syntax error
+        # in second file
+        files = ['/a; A\np1\n/a; A\n', '/b; B\np!\n']
+        self.assertEquals(self.load(files, 2),
+                ('album0.txt', 3, 'album "a" already defined'))
+        self.assertEquals(self.load(files, 2), self.load(files, 0))
+
+        files = ['/a; A\np1\n/b\n', '/c; C\np!\n']
+        self.assertEquals(self.load(files, 2), ('album1.txt', 2,
+                'syntax error'))
+
+        files = ['/a; A\np1\n/b\n', '/c; C\np2\n']
+        self.assertEquals(self.load(files, 2), ('', None,
+                'unresolved album references found: b'))
+
+
+    def testSparkErrors(self):
+        """errors of parallel album files parsing with SPARK parser"""
+        files = ['/a; A\np1\n/b\n', '/c; C\np!\n']
+        self.assertEquals(self.load(files, 2, engine = 'spark'),
+                ('album1.txt', 2, 'syntax error'))
+        self.assertEquals(self.load(files, 2, engine = 'spark'),
+                self.load(files, 0, engine = 'spark'))
+
+
+    def testCache(self):
+        """loading album files with node streams cache"""
+        cache = StreamCache(os.path.join(self.dir, 'albums'))
+        cache.open()
+        try:
+            files = ['/a; A\n/b\np1\n', '/b; B\np2\n/c\n', '/c; C\np3\n']
+            expected = self.load(files, 0)
+            self.assertEquals(self.load(files, 2, cache), expected)
+            self.assertEquals(cache.misses, 3)
+
+            self.assertEquals(self.load(files, 2, cache), expected)
+            self.assertEquals((cache.hits, cache.misses), (3, 3))
+
+            # only changed album file is parsed
+            files[1] = '/b; B\np2\np4\n/c\n'
+            expected = self.load(files, 0)
+            self.assertEquals(self.load(files, 2, cache), expected)
+            self.assertEquals((cache.hits, cache.misses), (5, 4))
+
+            # cached syntax error
+            files[2] = '/c; C\np!\n'
+            self.assertEquals(self.load(files, 2, cache), ('album2.txt', 2,
+                    'syntax error'))
+            self.assertEquals(self.load(files, 2, cache), ('album2.txt', 2,
+                    'syntax error'))
+            self.assertEquals((cache.hits, cache.misses), (10, 5))
+        finally:
+            cache.close()
+
+
+
 class ParseTestCaseBase(unittest.TestCase):
     """
     Basic class for Danlann parser tests.
 
+    @cvar engine:      album file parsing engine
     @ivar gallery:     gallery instance
     @ivar interpreter: album file interpreter
     """
+    engine = 'fast'
+
     def setUp(self):
         """
         Create gallery instance and Danlann album file interpreter.
         """
         self.gallery = Gallery('title', 'desc')
-        self.interpreter = interpreter(self.gallery)
+        self.interpreter = interpreter(self.gallery, self.engine)
 
 
 
@@ -213,8 +483,7 @@ class GenerateTestCase(ParseTestCaseBase):
 
         @param line: string to parse
         """
-        tokens = self.interpreter.scanner.tokenize(line)
-        ast = self.interpreter.parser.parse(tokens)
+        ast = parse(self.interpreter, line)
         self.interpreter.generate(ast)
 
 
@@ -429,6 +698,134 @@ photo_a4
         self.failUnlessRaises(ParseError, self.load, f)
 
 
+    def testRootOrder(self):
+        """order of root albums"""
+        f = self.getFile("""\
+/album1; album 1
+photo_a1
+/album2; album 2
+photo_a2
+/album3; album 3
+/album2
+/album4
+/album4; album 4
+photo_a4
+/album5; album 5
+/album1
+""")
+        self.load(f)
+        check(self.interpreter, self.gallery)
+        self.assertEquals([a.dir for a in self.gallery.subalbums],
+                ['album3', 'album5'])
+
+
+
+class CountingList(list):
+    """
+    List counting appended items and items scanned by searching and
+    removing.
+
+    @ivar ops: amount of list operations
+    """
+    def __init__(self):
+        super(CountingList, self).__init__()
+        self.ops = 0
+
+
+    def append(self, item):
+        self.ops += 1
+        super(CountingList, self).append(item)
+
+
+    def __contains__(self, item):
+        self.ops += len(self)
+        return super(CountingList, self).__contains__(item)
+
+
+    def index(self, item, *args):
+        self.ops += len(self)
+        return super(CountingList, self).index(item, *args)
+
+
+    def remove(self, item):
+        self.ops += len(self)
+        super(CountingList, self).remove(item)
+
+
+
+class ScalingTestCase(unittest.TestCase):
+    """
+    Test parsing of large album trees.
+
+    Operations on gallery root albums are counted instead of measuring
+    parsing time, so the tests do not depend on machine load.
+    """
+    def load(self, data):
+        """
+        Load album file and check created gallery, return amount of
+        operations on gallery root albums.
+        """
+        f = StringIO.StringIO(data)
+        f.name = 'test'
+        gallery = Gallery('title', 'desc')
+        gallery.subalbums = CountingList()
+        interp = interpreter(gallery)
+        load(f, interp)
+        check(interp, gallery)
+        return gallery.subalbums.ops
+
+
+    def assertLinear(self, create):
+        """
+        Check that amount of operations on gallery root albums grows
+        linearly with amount of albums.
+
+        @param create: function creating album file for amount of albums
+        """
+        n = 500
+        ops1 = self.load(create(n))
+        ops2 = self.load(create(4 * n))
+        # quadratic growth would need 16 times more operations
+        self.assert_(0 < ops1 and ops2 <= 4 * ops1 + 4,
+                '%d vs %d operations' % (ops1, ops2))
+
+
+    def testWide(self):
+        """parsing wide album tree"""
+        def create(n):
+            albums = ''.join('/a%d; A\np\n' % i for i in range(n))
+            refs = ''.join('/a%d\n' % i for i in reversed(range(n)))
+            return albums + '/root; Root\n' + refs
+
+        self.assertLinear(create)
+
+
+    def testDeep(self):
+        """parsing deep album tree"""
+        def create(n):
+            albums = ''.join('/a%d; A\n/a%d\np\n' % (i, i - 1)
+                    for i in range(1, n))
+            return '/a0; A\np\n' + albums
+
+        self.assertLinear(create)
+
+
+
+class SparkGenerateTestCase(GenerateTestCase):
+    """
+    Test album and photo object generation with SPARK parsing engine.
+    """
+    engine = 'spark'
+
+
+
+class SparkParserTestCase(ParserTestCase):
+    """
+    Test parsing album files with SPARK parsing engine.
+    """
+    engine = 'spark'
+
+
 
 if __name__ == '__main__':
     unittest.main()
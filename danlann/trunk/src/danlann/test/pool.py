@@ -0,0 +1,156 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Worker pool tests.
+"""
+
+import time
+import logging
+import unittest
+
+from danlann.pool import WorkerPool
+
+log = logging.getLogger('danlann.test.pool')
+jlog = logging.getLogger('danlann.test.pool.job')
+
+
+class RecordHandler(logging.Handler):
+    """
+    Logging handler storing messages of log records.
+
+    @ivar messages: list of log messages
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+    """
+    Worker pool tests.
+
+    @ivar handler: log records handler
+    """
+    def setUp(self):
+        """
+        Install log records handler.
+        """
+        self.handler = RecordHandler()
+        log.addHandler(self.handler)
+        log.setLevel(logging.INFO)
+
+
+    def tearDown(self):
+        """
+        Remove log records handler.
+        """
+        log.removeHandler(self.handler)
+
+
+    def job(self, i):
+        """
+        Pool job emitting log messages with logger and its child logger.
+        Jobs submitted earlier run longer.
+        """
+        log.info('job %d start' % i)
+        time.sleep(0.01 * (5 - i))
+        jlog.info('job %d end' % i)
+
+
+    def failingJob(self, i):
+        """
+        Pool job failing for job no 2.
+        """
+        if i == 2:
+            raise ValueError('job %d failed' % i)
+        log.info('job %d' % i)
+
+
+    def testLogOrder(self):
+        """log records order"""
+        pool = WorkerPool(4, ('danlann.test.pool',))
+        pool.start()
+        try:
+            for i in range(5):
+                pool.submit(self.job, (i,))
+            pool.join()
+        finally:
+            pool.close()
+
+        expected = []
+        for i in range(5):
+            expected.append('job %d start' % i)
+            expected.append('job %d end' % i)
+        self.assertEqual(self.handler.messages, expected)
+
+
+    def testCallback(self):
+        """job callbacks"""
+        results = []
+        pool = WorkerPool(3)
+        pool.start()
+        try:
+            for i in range(5):
+                pool.submit(lambda i: i * 2, (i,), results.append)
+            pool.join()
+        finally:
+            pool.close()
+
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+
+
+    def testSingleJob(self):
+        """single job pool"""
+        pool = WorkerPool(1, ('danlann.test.pool',))
+        pool.start()
+        self.assertEqual(pool.workers, [])
+
+        pool.submit(self.job, (4,))
+        self.assertEqual(self.handler.messages, ['job 4 start', 'job 4 end'])
+        pool.join()
+        pool.close()
+
+
+    def testFailure(self):
+        """job failure"""
+        def run():
+            for i in range(5):
+                pool.submit(self.failingJob, (i,))
+            pool.join()
+
+        pool = WorkerPool(2, ('danlann.test.pool',))
+        pool.start()
+        try:
+            self.assertRaises(ValueError, run)
+        finally:
+            pool.close()
+
+        self.assertEqual(pool.workers, [])
+        self.assertEqual(self.handler.messages[:2], ['job 0', 'job 1'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Generation tasks scheduler tests.
+"""
+
+import threading
+import time
+import unittest
+
+from danlann.pool import WorkerPool
+from danlann.scheduler import Scheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """
+    Generation tasks scheduler tests.
+
+    @ivar pool:   worker pool
+    @ivar events: list of executed tasks names
+    @ivar lock:   lock guarding list of executed tasks
+    """
+    jobs = 3
+
+    def setUp(self):
+        self.pool = WorkerPool(self.jobs)
+        self.pool.start()
+        self.events = []
+        self.lock = threading.Lock()
+
+
+    def tearDown(self):
+        self.pool.close()
+
+
+    def task(self, name, delay = 0):
+        """
+        Task recording its name after delay.
+        """
+        time.sleep(delay)
+        self.lock.acquire()
+        self.events.append(name)
+        self.lock.release()
+        return name
+
+
+    def testDependencies(self):
+        """task dependencies"""
+        s = Scheduler(self.pool)
+        exif = s.add(self.task, ('exif', 0.05), worker = True)
+        s.add(self.task, ('page',), (exif,))
+        s.add(self.task, ('convert',), worker = True,
+                callback = lambda name: self.task('converted'))
+        s.add(self.task, ('index',), (None,))
+        s.run()
+
+        events = self.events
+        self.assertEqual(sorted(events),
+                ['convert', 'converted', 'exif', 'index', 'page'])
+        self.assert_(events.index('exif') < events.index('page'))
+        self.assert_(events.index('convert') < events.index('converted'))
+
+
+    def testAdd(self):
+        """adding tasks while scheduler is running"""
+        def add():
+            s.add(self.task, ('format',), worker = True)
+
+        s = Scheduler(self.pool)
+        s.add(add)
+        s.run()
+        self.assertEqual(self.events, ['format'])
+
+
+    def testFailure(self):
+        """worker task failure"""
+        def fail():
+            raise ValueError('failed')
+
+        s = Scheduler(self.pool)
+        task = s.add(fail, worker = True)
+        s.add(self.task, ('page',), (task,))
+        self.assertRaises(ValueError, s.run)
+        self.assertEqual(self.events, [])
+
+
+
+class InlineSchedulerTestCase(SchedulerTestCase):
+    """
+    Generation tasks scheduler tests with worker tasks executed
+    immediately.
+    """
+    jobs = 1
+
+
+
+if __name__ == '__main__':
+    unittest.main()
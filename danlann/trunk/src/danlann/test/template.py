@@ -343,3 +343,23 @@ class TemplateSpecialCharacterRenderTestCase(unittest.TestCase):
         # https url
         s = renderer.str('a %s a' % link)
         assert ('a <a href = \'%s\'>%s</a> a' % (link, link)) == s, s
+
+
+    def testMemo(self):
+        """memoized strings"""
+        renderer = XMLRenderer()
+        renderer.size = 2
+        for i in range(2):
+            self.assertEqual(renderer.toString(u'a & b', None), u'a &amp; b')
+            self.assertEqual(renderer.toString(u'a\\n', None), u'a<br/>')
+        self.assertEqual(renderer.recent,
+                {u'a & b': u'a &amp; b', u'a\\n': u'a<br/>'})
+
+        # recent strings become old strings, old strings used again
+        # become recent strings
+        renderer.toString(u'<c>', None)
+        renderer.toString(u'a & b', None)
+        self.assertEqual(sorted(renderer.recent), [u'<c>', u'a & b'])
+        renderer.toString(u'd', None)
+        self.assertEqual(sorted(renderer.old), [u'<c>', u'a & b'])
+        self.assertEqual(renderer.recent, {u'd': u'd'})
@@ -0,0 +1,178 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Gallery sources watchers tests.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import danlann.watch
+from danlann.watch import PollingWatcher, under, watch
+
+
+class PollingWatcherTestCase(unittest.TestCase):
+    """
+    Polling watcher tests.
+
+    @ivar dir: temporary directory
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for dir in ('in', 'in/sub', 'in/out'):
+            os.mkdir(os.path.join(self.dir, dir))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def write(self, fn, data):
+        """
+        Write data into file in temporary directory.
+        """
+        fn = os.path.join(self.dir, fn)
+        f = open(fn, 'wb')
+        f.write(data)
+        f.close()
+        return fn
+
+
+    def watcher(self, delay = 0.05):
+        """
+        Create watcher of gallery.ini file and input directory.
+        """
+        return PollingWatcher([os.path.join(self.dir, 'gallery.ini')],
+                [os.path.join(self.dir, 'in')],
+                [os.path.join(self.dir, 'in', 'out')],
+                delay = delay, interval = 0.01)
+
+
+    def testUnder(self):
+        """checking files in directories"""
+        self.assert_(under('/a/b/c', ['/x', '/a/b']))
+        self.assert_(under('/a/b', ['/a/b']))
+        self.assert_(not under('/a/bc', ['/a/b']))
+
+
+    def testChanges(self):
+        """detecting changed files"""
+        ini = self.write('gallery.ini', 'a')
+        watcher = self.watcher()
+
+        self.write('gallery.ini', 'ab')
+        photo = self.write('in/sub/photo.jpg', 'abc')
+        self.write('in/out/page.xhtml', 'abc')
+        self.write('other.txt', 'abc')
+        self.assertEqual(watcher.wait(), set([ini, photo]))
+
+        os.remove(photo)
+        self.assertEqual(watcher.wait(), set([photo]))
+
+
+    def testBurst(self):
+        """gathering burst of changes"""
+        def edit():
+            for i in range(5):
+                self.write('in/p%d.jpg' % i, 'abc')
+                time.sleep(0.02)
+
+        watcher = self.watcher(0.5)
+        t = threading.Thread(target = edit)
+        t.start()
+        changed = watcher.wait()
+        t.join()
+
+        self.assertEqual(changed, set(os.path.join(self.dir, 'in',
+            'p%d.jpg' % i) for i in range(5)))
+
+
+
+
+class Stop(Exception):
+    """
+    Exception stopping watch mode loop.
+    """
+
+
+
+class WatchTestCase(unittest.TestCase):
+    """
+    Watch mode tests.
+
+    @ivar changes: changes returned by watcher, watch mode loop is
+                   stopped when there are no more changes
+    """
+    def setUp(self):
+        self.changes = []
+        self.create = danlann.watch.create
+        danlann.watch.create = lambda *args, **kw: self
+
+
+    def tearDown(self):
+        danlann.watch.create = self.create
+
+
+    def wait(self):
+        """
+        Get next change of gallery sources.
+        """
+        if not self.changes:
+            raise Stop()
+        return self.changes.pop(0)
+
+
+    def close(self):
+        pass
+
+
+    def testErrors(self):
+        """watching gallery sources after rebuild errors"""
+        class Processor(object):
+            def __init__(self):
+                self.albums = []
+                self.outdir = 'out'
+                self.generator = self
+                self.tmpl = self
+                self.indir = []
+
+            def dirs(self):
+                return []
+
+        def build(processor, reload):
+            builds.append(reload)
+            raise errors.pop(0)
+
+        builds = []
+        errors = [IOError(28, 'No space left on device'),
+                OSError(2, 'No such file or directory'), Stop()]
+        self.changes = [set(['album.txt']), set(['album.txt'])]
+        self.assertRaises(Stop, watch, 'gallery.ini',
+                lambda fn: Processor(), build)
+        self.assertEqual(builds, [True, False, False])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
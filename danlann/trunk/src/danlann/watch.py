@@ -0,0 +1,336 @@
+#
+# Danlann - Memory Jail - an easy to use photo gallery generator.
+#
+# Copyright (C) 2006-2008 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Watch mode: gallery is rebuilt when its sources change.
+
+Gallery sources are configuration file, album files, input directories
+and template directories. Changes are detected with inotify, if pyinotify
+module is installed, or by polling file system otherwise.
+
+Bursts of changes, i.e. an editor saving several files, are gathered
+together, so gallery is rebuilt once for all of them.
+"""
+
+import os
+import time
+
+from danlann import ConfigurationError
+from danlann.parser import ParseError
+
+import logging
+log = logging.getLogger('danlann.watch')
+
+
+def under(fn, dirs):
+    """
+    Check if file is in one of directories or their subdirectories.
+
+    @param fn:   absolute filename
+    @param dirs: list of absolute directory names
+    """
+    for dir in dirs:
+        if fn == dir or fn.startswith(dir + os.sep):
+            return True
+    return False
+
+
+
+class Watcher(object):
+    """
+    Watcher of files and directories.
+
+    @ivar files:   absolute filenames of watched files
+    @ivar dirs:    absolute names of directories watched with their
+                   subdirectories
+    @ivar exclude: absolute names of directories, which are not watched
+    @ivar delay:   time in seconds without changes, which ends a burst
+                   of changes
+    """
+    def __init__(self, files, dirs, exclude = (), delay = 0.2):
+        """
+        Create watcher of files and directories.
+
+        @param files:   watched files
+        @param dirs:    watched directories
+        @param exclude: directories, which are not watched
+        @param delay:   time without changes, which ends a burst of
+                        changes
+        """
+        super(Watcher, self).__init__()
+        self.files   = set(os.path.abspath(fn) for fn in files)
+        self.dirs    = [os.path.abspath(dir) for dir in dirs]
+        self.exclude = [os.path.abspath(dir) for dir in exclude]
+        self.delay   = delay
+
+
+    def watched(self, fn):
+        """
+        Check if file is watched.
+
+        @param fn: absolute filename
+        """
+        return fn in self.files \
+            or under(fn, self.dirs) and not under(fn, self.exclude)
+
+
+    def wait(self):
+        """
+        Wait for a burst of changes and return set of changed files.
+        """
+        raise NotImplementedError
+
+
+    def close(self):
+        """
+        Stop watching files and directories.
+        """
+        pass
+
+
+
+class PollingWatcher(Watcher):
+    """
+    Watcher checking size and modification time of files periodically.
+
+    @ivar interval: polling interval in seconds
+    @ivar state:    size and modification time of watched files
+    """
+    def __init__(self, files, dirs, exclude = (), delay = 0.2,
+            interval = 0.5):
+        """
+        Create polling watcher.
+
+        @param interval: polling interval
+
+        @see Watcher.__init__
+        """
+        super(PollingWatcher, self).__init__(files, dirs, exclude, delay)
+        self.interval = interval
+        self.state = self.snapshot()
+
+
+    def snapshot(self):
+        """
+        Get size and modification time of all watched files.
+        """
+        def stat(fn):
+            try:
+                st = os.stat(fn)
+                state[fn] = (st.st_size, st.st_mtime)
+            except OSError:
+                # file removed
+                pass
+
+        state = {}
+        for fn in self.files:
+            stat(fn)
+
+        for path in self.dirs:
+            for dir, subdirs, files in os.walk(path):
+                subdirs[:] = [d for d in subdirs
+                        if not under(os.path.join(dir, d), self.exclude)]
+                for fn in files:
+                    stat(os.path.join(dir, fn))
+
+        return state
+
+
+    def diff(self, old, new):
+        """
+        Get set of files changed between two snapshots.
+        """
+        return set(fn for fn in set(old) | set(new)
+                if old.get(fn) != new.get(fn))
+
+
+    def wait(self):
+        state = self.state
+        changed = set()
+        while not changed:
+            time.sleep(self.interval)
+            latest = self.snapshot()
+            changed = self.diff(state, latest)
+            state = latest
+
+        # gather changes until files stop changing
+        while True:
+            time.sleep(self.delay)
+            latest = self.snapshot()
+            more = self.diff(state, latest)
+            if not more:
+                break
+            changed |= more
+            state = latest
+
+        self.state = state
+        return changed
+
+
+
+class InotifyWatcher(Watcher):
+    """
+    Watcher using Linux inotify with pyinotify module.
+
+    Parent directories of watched files are watched, so files replaced by
+    editors are detected.
+
+    @C{ImportError} is raised on watcher creation if pyinotify module is
+    not installed.
+
+    @ivar notifier: pyinotify notifier
+    @ivar changed:  changed files reported by pyinotify
+    """
+    def __init__(self, files, dirs, exclude = (), delay = 0.2):
+        super(InotifyWatcher, self).__init__(files, dirs, exclude, delay)
+
+        import pyinotify
+
+        changed = self.changed = set()
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                changed.add(event.pathname)
+
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE \
+            | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM \
+            | pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB
+
+        wm = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(wm, Handler())
+
+        parents = set(os.path.dirname(fn) for fn in self.files)
+        if parents:
+            wm.add_watch(list(parents), mask)
+        if self.dirs:
+            wm.add_watch(self.dirs, mask, rec = True, auto_add = True,
+                    exclude_filter = lambda dir: under(dir, self.exclude))
+
+
+    def read(self, timeout):
+        """
+        Read and process inotify events.
+
+        False is returned if there were no events within timeout.
+
+        @param timeout: timeout in milliseconds, wait infinitely if None
+        """
+        if not self.notifier.check_events(timeout):
+            return False
+        self.notifier.read_events()
+        self.notifier.process_events()
+        return True
+
+
+    def wait(self):
+        changed = set()
+        while not changed:
+            self.read(None)
+            changed = set(fn for fn in self.changed if self.watched(fn))
+            self.changed.clear()
+
+        # gather changes until files stop changing
+        while self.read(self.delay * 1000):
+            pass
+
+        changed.update(fn for fn in self.changed if self.watched(fn))
+        self.changed.clear()
+        return changed
+
+
+    def close(self):
+        self.notifier.stop()
+
+
+
+def create(files, dirs, exclude = (), interval = 0.5):
+    """
+    Create inotify watcher or polling watcher if inotify cannot be used.
+
+    @param files:    watched files
+    @param dirs:     watched directories
+    @param exclude:  directories, which are not watched
+    @param interval: polling interval
+    """
+    try:
+        return InotifyWatcher(files, dirs, exclude)
+    except (ImportError, EnvironmentError), ex:
+        log.debug('inotify cannot be used, polling file system: %s' % ex)
+        return PollingWatcher(files, dirs, exclude, interval = interval)
+
+
+
+def watch(fn, load, build, interval = 0.5):
+    """
+    Build gallery and rebuild it when its sources change.
+
+    Danlann processor is created again when configuration file or
+    template files change. Otherwise the processor, its template and
+    caches are reused, album files are parsed again and gallery is
+    generated, which converts changed photos and writes changed pages
+    only. Input directories are scanned again only when photo files
+    change.
+
+    Parser, configuration and input/output errors are logged and sources
+    are watched for their fixes.
+
+    @param fn:       gallery configuration filename
+    @param load:     function creating danlann processor for
+                     configuration filename
+    @param build:    function building gallery with danlann processor,
+                     called with the processor and flag indicating if
+                     processor is created again
+    @param interval: polling interval
+    """
+    fn = os.path.abspath(fn)
+    processor = None
+    watcher = None
+    tmpldirs = []
+    indirs = []
+    changed = set()
+    while True:
+        reload = processor is None or fn in changed \
+                or bool([f for f in changed if under(f, tmpldirs)])
+        try:
+            if reload:
+                processor = None
+                processor = load(fn)
+
+                generator = processor.generator
+                tmpldirs = [os.path.abspath(d) for d in generator.tmpl.dirs()]
+                indirs = [os.path.abspath(d) for d in generator.indir]
+
+                if watcher is not None:
+                    watcher.close()
+                watcher = create([fn] + processor.albums,
+                        tmpldirs + indirs, [processor.outdir], interval)
+
+            elif [f for f in changed if under(f, indirs)]:
+                processor.generator.index = None
+
+            build(processor, reload)
+        except (ParseError, ConfigurationError, EnvironmentError), ex:
+            log.error('%s' % ex)
+
+        if watcher is None:
+            watcher = create([fn], [], interval = interval)
+
+        log.info('watching gallery sources for changes')
+        changed = watcher.wait()
+        log.info('changed: %s' % ', '.join(sorted(changed)))